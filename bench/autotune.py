@@ -0,0 +1,161 @@
+"""
+TinyllamaChatbot - Host Auto-Tuner
+"""
+
+import os
+import json
+import time
+import logging
+import platform
+import itertools
+import multiprocessing
+from typing import Dict, List, Optional
+
+from core.utils import PROFILES_DIR, host_profile_path, percentile
+
+CALIBRATION_PROMPT = "Explain in two sentences why the sky is blue."
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+def _calibrate(conn, settings: dict, overrides: dict, prompt: str, runs: int):
+    """Child process: load the model with ``settings`` and time a few short generations."""
+    from core.chatbot import TinyllamaChatbot
+
+    try:
+        chatbot = TinyllamaChatbot({
+            **overrides,
+            **settings,
+            "logging_enabled": False,
+            "response_cache_enabled": False,
+            "conversation_store_enabled": False,
+            "warmup_enabled": False
+        })
+        start = time.perf_counter()
+        if not chatbot.load_model():
+            conn.send({"error": "Failed to load model"})
+            return
+        load_time = time.perf_counter() - start
+
+        formatted = chatbot.prompt_manager.format_prompt(prompt)
+        ttfts, rates = [], []
+        for run in range(runs + 1):
+            chatbot.reset_context()
+            stats = {}
+            for _ in chatbot.stream_completion(formatted, stats, use_cache=False, temperature=0):
+                pass
+            if run == 0:
+                continue  # warm-up
+            ttfts.append(stats.get("ttft") or stats.get("elapsed", 0.0))
+            decode_time = stats.get("elapsed", 0.0) - (stats.get("ttft") or 0.0)
+            tokens = stats.get("completion_tokens", 0)
+            rates.append((tokens - 1) / decode_time if tokens > 1 and decode_time > 0 else 0.0)
+
+        conn.send({
+            "load_time": load_time,
+            "ttft": percentile(ttfts, 50),
+            "tokens_per_second": percentile(rates, 50),
+            "peak_memory_mb": _peak_rss_mb()
+        })
+    except Exception as e:
+        conn.send({"error": str(e)})
+    finally:
+        conn.close()
+
+
+class AutoTuner:
+    """Finds the fastest threads/batch_size/context_length for this host.
+
+    Every grid combination is calibrated in a fresh process, so each one
+    pays its own model load and its peak memory can be measured in
+    isolation. Combinations over ``memory_limit_mb`` are rejected. Of the
+    rest, those within ``tolerance`` of the best tokens/s compete on time to
+    first token, and remaining ties go to the larger context.
+    """
+
+    def __init__(self, grid: Dict[str, List], runs: int = 2, memory_limit_mb: Optional[float] = None,
+                 tolerance: float = 0.05, prompt: str = CALIBRATION_PROMPT,
+                 config_overrides: Optional[dict] = None):
+        self.grid = grid
+        self.runs = runs
+        self.memory_limit_mb = memory_limit_mb
+        self.tolerance = tolerance
+        self.prompt = prompt
+        self.config_overrides = config_overrides or {}
+        self.logger = logging.getLogger(__name__)
+
+    def run(self) -> dict:
+        """Calibrate every combination and return all measurements plus the chosen settings."""
+        keys = list(self.grid)
+        context = multiprocessing.get_context("spawn")
+        results = []
+        for values in itertools.product(*(self.grid[key] for key in keys)):
+            settings = dict(zip(keys, values))
+            self.logger.info(f"Calibrating {settings}")
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_calibrate, args=(child_conn, settings, self.config_overrides, self.prompt, self.runs)
+            )
+            process.start()
+            child_conn.close()
+            try:
+                measured = parent_conn.recv()
+            except EOFError:
+                measured = {"error": "Calibration process exited"}
+            process.join()
+
+            result = {"settings": settings, **measured}
+            if "error" not in result and self._over_memory_limit(result):
+                result["rejected"] = f"peak memory {result['peak_memory_mb']:.0f} MB over limit"
+            results.append(result)
+            self.logger.info(f"Result: {result}")
+
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "cpu_count": os.cpu_count(),
+            "memory_limit_mb": self.memory_limit_mb,
+            "results": results,
+            "best": self.choose(results)
+        }
+
+    def _over_memory_limit(self, result: dict) -> bool:
+        peak = result.get("peak_memory_mb")
+        return bool(self.memory_limit_mb) and peak is not None and peak > self.memory_limit_mb
+
+    def choose(self, results: List[dict]) -> Optional[dict]:
+        """Pick the winning result, or None if every combination failed or was rejected."""
+        feasible = [r for r in results if "error" not in r and "rejected" not in r]
+        if not feasible:
+            return None
+        best_rate = max(r["tokens_per_second"] for r in feasible)
+        fast = [r for r in feasible if r["tokens_per_second"] >= best_rate * (1 - self.tolerance)]
+        return min(fast, key=lambda r: (r["ttft"], -r["settings"].get("context_length", 0)))
+
+
+def write_profile(tuning: dict, path: Optional[str] = None) -> str:
+    """Save the chosen settings as this host's profile and return its path."""
+    path = path or host_profile_path()
+    os.makedirs(os.path.dirname(path) or PROFILES_DIR, exist_ok=True)
+    best = tuning["best"]
+    profile = {
+        "host": tuning["host"],
+        "created": tuning["timestamp"],
+        "cpu_count": tuning["cpu_count"],
+        "measured": {key: best.get(key) for key in ("load_time", "ttft", "tokens_per_second", "peak_memory_mb")},
+        "settings": best["settings"]
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    return path
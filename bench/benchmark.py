@@ -0,0 +1,226 @@
+"""
+TinyllamaChatbot - Inference Benchmark Suite
+"""
+
+import csv
+import json
+import time
+import logging
+import itertools
+import platform
+from typing import Dict, List, Optional
+
+from core.chatbot import TinyllamaChatbot
+from core.utils import percentile
+
+DEFAULT_PROMPTS = [
+    "What is the capital of France?",
+    "Explain in one sentence what a CPU cache is.",
+    "Write a short greeting for a new user.",
+    "List three uses of a hash table."
+]
+
+METRICS = ["ttft", "tokens_per_second", "e2e_latency", "prompt_eval", "cache_hit_latency"]
+
+class InferenceBenchmark:
+    """Sweeps model settings and measures load time, TTFT, tokens/s and end-to-end latency.
+
+    Every combination of ``grid`` values gets a freshly loaded chatbot. Each
+    prompt is run ``runs`` times with the evaluated context reset in between,
+    so every run pays full prompt evaluation. A cached repeat of each prompt
+    measures response-cache hit latency.
+    """
+
+    def __init__(self, grid: Dict[str, List], prompts: Optional[List[str]] = None, runs: int = 3,
+                 warmup: int = 1, config_overrides: Optional[dict] = None):
+        self.grid = grid
+        self.prompts = prompts or DEFAULT_PROMPTS
+        self.runs = runs
+        self.warmup = warmup
+        self.config_overrides = config_overrides or {}
+        self.logger = logging.getLogger(__name__)
+
+    def run(self) -> dict:
+        """Run the whole sweep and return machine-readable results."""
+        keys = list(self.grid)
+        results = []
+        for values in itertools.product(*(self.grid[key] for key in keys)):
+            settings = dict(zip(keys, values))
+            self.logger.info(f"Benchmarking {settings}")
+            results.append(self._run_config(settings))
+
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "backend": self.config_overrides.get("backend", "ctransformers"),
+            "runs": self.runs,
+            "prompts": len(self.prompts),
+            "results": results
+        }
+
+    def _run_config(self, settings: dict) -> dict:
+        chatbot = TinyllamaChatbot({
+            **self.config_overrides,
+            **settings,
+            "logging_enabled": False,
+            "response_cache_enabled": False,
+            "conversation_store_enabled": False,
+            # Warm-up is part of the measured loop below, not a background thread
+            "warmup_enabled": False
+        })
+
+        start = time.perf_counter()
+        if not chatbot.load_model():
+            return {"settings": settings, "error": "Failed to load model"}
+        load_time = time.perf_counter() - start
+
+        for prompt in self.prompts[:self.warmup]:
+            self._measure(chatbot, prompt)
+
+        samples: Dict[str, List[float]] = {metric: [] for metric in METRICS}
+        completion_tokens = 0
+        speculation = {"draft_tokens": 0, "accepted_tokens": 0, "forward_passes": 0}
+        for _ in range(self.runs):
+            for prompt in self.prompts:
+                chatbot.reset_context()
+                measured = self._measure(chatbot, prompt)
+                completion_tokens += measured.pop("completion_tokens")
+                for key, value in measured.pop("speculative", {}).items():
+                    if key in speculation:
+                        speculation[key] += value
+                for metric, value in measured.items():
+                    samples[metric].append(value)
+
+        samples["cache_hit_latency"] = self._measure_cache_hits(chatbot)
+
+        summary = {"settings": settings, "load_time": load_time, "completion_tokens": completion_tokens}
+        if speculation["forward_passes"]:
+            summary["speculative"] = {
+                **speculation,
+                "acceptance_rate": speculation["accepted_tokens"] / max(speculation["draft_tokens"], 1),
+                "tokens_per_pass": completion_tokens / speculation["forward_passes"]
+            }
+        for metric, values in samples.items():
+            summary[metric] = {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "samples": len(values)
+            }
+        return summary
+
+    def _measure(self, chatbot: TinyllamaChatbot, prompt: str) -> dict:
+        stats = {}
+        formatted = chatbot.prompt_manager.format_prompt(prompt)
+        start = time.perf_counter()
+        for _ in chatbot.stream_completion(formatted, stats, use_cache=False):
+            pass
+        e2e = time.perf_counter() - start
+
+        tokens = stats.get("completion_tokens", 0)
+        ttft = stats.get("ttft") or e2e
+        decode_time = e2e - ttft
+        return {
+            "ttft": ttft,
+            "tokens_per_second": (tokens - 1) / decode_time if tokens > 1 and decode_time > 0 else 0.0,
+            "e2e_latency": e2e,
+            "prompt_eval": stats.get("prompt_eval", 0.0),
+            "completion_tokens": tokens,
+            "speculative": stats.get("speculative", {})
+        }
+
+    def _measure_cache_hits(self, chatbot: TinyllamaChatbot) -> List[float]:
+        """Time response-cache hits against a throwaway in-memory cache."""
+        from core.response_cache import ResponseCache
+
+        chatbot.response_cache = ResponseCache(":memory:")
+        chatbot.model_identity = chatbot.model_identity or "benchmark"
+        latencies = []
+        try:
+            for prompt in self.prompts:
+                formatted = chatbot.prompt_manager.format_prompt(prompt)
+                "".join(chatbot.stream_completion(formatted, use_cache=True))
+                for _ in range(self.runs):
+                    start = time.perf_counter()
+                    "".join(chatbot.stream_completion(formatted, use_cache=True))
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            chatbot.response_cache.close()
+            chatbot.response_cache = None
+        return latencies
+
+
+def speculative_speedups(results: dict) -> List[dict]:
+    """Pair each speculative run with the plain run of the same settings and compare tokens/s."""
+    plain = {}
+    for result in results["results"]:
+        if "error" not in result and not result["settings"].get("speculative_decoding"):
+            key = tuple(sorted((k, v) for k, v in result["settings"].items() if k != "speculative_decoding"))
+            plain[key] = result
+    speedups = []
+    for result in results["results"]:
+        if "error" in result or not result["settings"].get("speculative_decoding"):
+            continue
+        key = tuple(sorted((k, v) for k, v in result["settings"].items() if k != "speculative_decoding"))
+        baseline = plain.get(key)
+        if baseline and baseline["tokens_per_second"]["p50"]:
+            speedups.append({
+                "settings": dict(key),
+                "speedup": result["tokens_per_second"]["p50"] / baseline["tokens_per_second"]["p50"],
+                "acceptance_rate": result.get("speculative", {}).get("acceptance_rate", 0.0)
+            })
+    return speedups
+
+
+def write_json(results: dict, path: str):
+    """Write full benchmark results as JSON."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+def write_csv(results: dict, path: str):
+    """Write one row per configuration with the percentile columns of every metric."""
+    rows = []
+    for result in results["results"]:
+        row = dict(result["settings"])
+        row["load_time"] = result.get("load_time")
+        row["error"] = result.get("error", "")
+        for metric in METRICS:
+            for stat in ("mean", "p50", "p90", "p99"):
+                row[f"{metric}_{stat}"] = result.get(metric, {}).get(stat)
+        if "speculative" in result:
+            row["acceptance_rate"] = result["speculative"]["acceptance_rate"]
+            row["tokens_per_pass"] = result["speculative"]["tokens_per_pass"]
+        rows.append(row)
+
+    if not rows:
+        return
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Return a description of every p50 regression beyond ``tolerance`` versus a baseline run."""
+    lower_is_better = {"ttft", "e2e_latency", "prompt_eval", "cache_hit_latency"}
+    previous = {json.dumps(r["settings"], sort_keys=True): r for r in baseline.get("results", [])}
+    regressions = []
+
+    for result in results["results"]:
+        before = previous.get(json.dumps(result["settings"], sort_keys=True))
+        if not before or "error" in result or "error" in before:
+            continue
+        for metric in METRICS:
+            old, new = before[metric]["p50"], result[metric]["p50"]
+            if not old:
+                continue
+            change = (new - old) / old
+            if metric not in lower_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append(
+                    f"{result['settings']} {metric} p50: {old:.4f} -> {new:.4f} ({change:+.0%} worse)"
+                )
+    return regressions
@@ -0,0 +1,370 @@
+"""
+TinyllamaChatbot - Load Testing by Trace Replay
+"""
+
+import json
+import math
+import time
+import random
+import logging
+import platform
+import threading
+import http.client
+from urllib.parse import urlparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from core.utils import percentile
+
+METRICS = ["latency", "ttft", "queue_wait"]
+# Request fields passed on as they are
+REQUEST_KEYS = ("temperature", "max_tokens", "priority", "user")
+
+def read_trace(path: str, prompt_field: str = "prompt") -> List[dict]:
+    """Read a JSONL trace into request dicts.
+
+    Each line needs ``prompt_field`` (a string, or ``title`` and ``body``
+    as in a backlog file) or ``messages`` for a chat request, and may set
+    ``temperature``, ``max_tokens``, ``priority`` ("interactive" or
+    "batch") and ``user`` (the session the scheduler queues it under).
+    """
+    requests = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            request = {key: record[key] for key in REQUEST_KEYS if record.get(key) is not None}
+            if isinstance(record.get("messages"), list):
+                request["messages"] = record["messages"]
+            elif isinstance(record.get(prompt_field), str):
+                request["prompt"] = record[prompt_field]
+            elif isinstance(record.get("body"), str):
+                request["prompt"] = f"{record.get('title', '')}\n\n{record['body']}".strip()
+            else:
+                raise ValueError(f"Line {line_number} has no '{prompt_field}' or 'messages'")
+            requests.append(request)
+    return requests
+
+def arrival_times(count: int, rate: float, ramp_up: float = 0.0, poisson: bool = False,
+                  seed: Optional[int] = None) -> List[float]:
+    """Send times (seconds from the start) of ``count`` requests arriving at ``rate`` per second.
+
+    With ``ramp_up`` the rate climbs linearly from 0 to ``rate`` over that
+    many seconds. Arrivals are evenly spaced, or a Poisson process with
+    ``poisson``.
+    """
+    rng = random.Random(seed)
+    # Requests expected by the end of the ramp
+    ramp_requests = rate * ramp_up / 2
+    times = []
+    expected = 0.0
+    for _ in range(count):
+        # Invert the expected number of arrivals by time t
+        if expected <= ramp_requests and ramp_up:
+            times.append(math.sqrt(2 * ramp_up * expected / rate))
+        else:
+            times.append(ramp_up + (expected - ramp_requests) / rate)
+        expected += rng.expovariate(1.0) if poisson else 1.0
+    return times
+
+
+class InProcessTarget:
+    """Sends requests straight to a chatbot (or worker pool) in this process."""
+
+    def __init__(self, chatbot, use_cache: bool = False):
+        self.chatbot = chatbot
+        self.use_cache = use_cache
+        self.name = "in-process"
+
+    def start(self):
+        if not self.chatbot.is_model_loaded() and not self.chatbot.load_model():
+            raise RuntimeError("Failed to load model")
+
+    def send(self, request: dict) -> Iterator[str]:
+        """Yield the reply's chunks; fills ``request["stats"]`` when done."""
+        prompt_manager = self.chatbot.prompt_manager
+        if "messages" in request:
+            prompt = prompt_manager.format_messages(request["messages"])
+        else:
+            prompt = prompt_manager.format_prompt(request["prompt"])
+        params = {key: request[key] for key in ("temperature", "max_tokens", "priority") if key in request}
+        if "user" in request:
+            params["session"] = request["user"]
+        stats = request["stats"] = {}
+        yield from self.chatbot.stream_completion(prompt, stats, use_cache=self.use_cache, **params)
+
+    def queue_wait(self, request: dict, latency: float) -> Optional[float]:
+        stats = request.get("stats", {})
+        if stats.get("queue_wait") is not None:
+            return stats["queue_wait"]
+        # The generation's own elapsed time starts once it holds the model
+        elapsed = stats.get("elapsed")
+        return max(latency - elapsed, 0.0) if elapsed is not None else None
+
+    def server_metrics(self) -> Optional[dict]:
+        return None
+
+
+class HTTPTarget:
+    """Sends requests to the OpenAI-compatible server, streaming so TTFT can be measured."""
+
+    def __init__(self, url: str, timeout: float = 300.0):
+        parsed = urlparse(url if "://" in url else f"http://{url}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.name = f"http://{self.host}:{self.port}"
+
+    def _connection(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def start(self):
+        """Wait until the server reports the model as loaded."""
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            try:
+                conn = self._connection()
+                conn.request("GET", "/health")
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status == 200:
+                    return
+            except OSError:
+                pass
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Server at {self.name} did not become ready")
+            time.sleep(0.5)
+
+    def send(self, request: dict) -> Iterator[str]:
+        chat = "messages" in request
+        body = {key: request[key] for key in REQUEST_KEYS if key in request}
+        body["stream"] = True
+        if chat:
+            body["messages"] = request["messages"]
+        else:
+            body["prompt"] = request["prompt"]
+
+        conn = self._connection()
+        try:
+            conn.request("POST", "/v1/chat/completions" if chat else "/v1/completions",
+                         body=json.dumps(body), headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            if response.status != 200:
+                response.read()
+                raise RuntimeError(f"HTTP {response.status}")
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data == b"[DONE]":
+                    break
+                event = json.loads(data)
+                if "error" in event:
+                    raise RuntimeError(event["error"].get("type", "error"))
+                choice = event["choices"][0]
+                text = choice["delta"].get("content", "") if chat else choice.get("text", "")
+                if text:
+                    yield text
+        finally:
+            conn.close()
+
+    def queue_wait(self, request: dict, latency: float) -> Optional[float]:
+        # Not visible per request over HTTP; the server's histogram is reported instead
+        return None
+
+    def server_metrics(self) -> Optional[dict]:
+        try:
+            conn = self._connection()
+            conn.request("GET", "/v1/metrics")
+            response = conn.getresponse()
+            snapshot = json.loads(response.read())
+            conn.close()
+        except (OSError, ValueError):
+            return None
+        return {
+            "queue_wait_seconds": snapshot.get("histograms", {}).get("queue_wait_seconds"),
+            "counters": snapshot.get("counters", {}),
+            "scheduler": snapshot.get("scheduler")
+        }
+
+
+class LoadTest:
+    """Replays a request trace against a target and measures it under load.
+
+    Closed loop (no ``rate``): ``concurrency`` clients each send their next
+    request as soon as the previous one finishes, started evenly over
+    ``ramp_up`` seconds. Open loop: requests are sent at ``rate`` per
+    second (ramping up over ``ramp_up`` seconds) whether or not earlier ones
+    have finished, with at most ``concurrency`` in flight. Latency is
+    counted from when a request was due to be sent, so a backlog on the
+    client side shows up in the numbers instead of hiding it.
+    """
+
+    def __init__(self, target, trace: List[dict], concurrency: int = 1, rate: Optional[float] = None,
+                 ramp_up: float = 0.0, requests: Optional[int] = None, poisson: bool = False,
+                 seed: Optional[int] = None):
+        self.target = target
+        self.trace = trace
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.ramp_up = ramp_up
+        self.count = requests or len(trace)
+        self.poisson = poisson
+        self.seed = seed
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._start = 0.0
+
+    def run(self) -> dict:
+        """Send every request and return the measurements and their summary."""
+        if not self.trace:
+            raise ValueError("The trace is empty")
+        self.target.start()
+        # Longer runs than the trace cycle through it
+        requests = [dict(self.trace[i % len(self.trace)]) for i in range(self.count)]
+        results = [None] * self.count
+        self.logger.info(f"Load test: {self.count} requests against {self.target.name}, "
+                         f"{'rate ' + str(self.rate) + '/s' if self.rate else 'closed loop'}, "
+                         f"concurrency {self.concurrency}")
+
+        start = self._start = time.perf_counter()
+        if self.rate:
+            schedule = arrival_times(self.count, self.rate, self.ramp_up, self.poisson, self.seed)
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for i, offset in enumerate(schedule):
+                    delay = start + offset - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self._run_one, requests, results, i, start + offset)
+        else:
+            next_index = iter(range(self.count))
+
+            def client(client_id: int):
+                time.sleep(self.ramp_up * client_id / self.concurrency)
+                while True:
+                    with self._lock:
+                        i = next(next_index, None)
+                    if i is None:
+                        return
+                    self._run_one(requests, results, i, time.perf_counter())
+
+            threads = [threading.Thread(target=client, args=(c,), daemon=True) for c in range(self.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        duration = time.perf_counter() - start
+
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "target": self.target.name,
+            "mode": "open" if self.rate else "closed",
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "ramp_up": self.ramp_up,
+            "summary": summarize(results, duration, self.target.server_metrics()),
+            "requests": results
+        }
+
+    def _run_one(self, requests: List[dict], results: List[Optional[dict]], i: int, due: float):
+        request = requests[i]
+        started = time.perf_counter()
+        result = {"index": i, "priority": request.get("priority", "interactive"),
+                  "scheduled": due - self._start, "send_delay": started - due}
+        first = None
+        chunks = 0
+        try:
+            for chunk in self.target.send(request):
+                if first is None:
+                    first = time.perf_counter()
+                chunks += 1
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+        end = time.perf_counter()
+
+        stats = request.get("stats", {})
+        latency = end - due
+        result.update({
+            "latency": latency,
+            "ttft": (first - due) if first is not None else None,
+            "queue_wait": self.target.queue_wait(request, end - started),
+            "completion_tokens": stats.get("completion_tokens", chunks),
+            "finish_reason": stats.get("finish_reason")
+        })
+        results[i] = result
+
+
+def _distribution(values: List[float]) -> dict:
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+        "samples": len(values)
+    }
+
+def summarize(results: List[dict], duration: float, server_metrics: Optional[dict] = None) -> dict:
+    """Percentiles, throughput and error rates over all results."""
+    ok = [r for r in results if r and "error" not in r]
+    failed = [r for r in results if r and "error" in r]
+    summary = {
+        "requests": len(results),
+        "completed": len(ok),
+        "errors": len(failed),
+        "error_rate": len(failed) / len(results) if results else 0.0,
+        "errors_by_type": dict(Counter(r["error"] for r in failed)),
+        "duration": duration,
+        "requests_per_second": len(ok) / duration if duration else 0.0,
+        "tokens_per_second": sum(r["completion_tokens"] for r in ok) / duration if duration else 0.0
+    }
+    for metric in METRICS:
+        summary[metric] = _distribution([r[metric] for r in ok if r.get(metric) is not None])
+    priorities = sorted({r.get("priority", "interactive") for r in ok})
+    if len(priorities) > 1:
+        # How each scheduler lane fared, e.g. interactive latency while batch work runs
+        summary["priorities"] = {
+            priority: {
+                metric: _distribution([r[metric] for r in ok
+                                       if r.get("priority", "interactive") == priority and r.get(metric) is not None])
+                for metric in METRICS
+            }
+            for priority in priorities
+        }
+    if server_metrics:
+        summary["server"] = server_metrics
+    return summary
+
+def format_summary(report: dict) -> str:
+    """A few lines for the terminal."""
+    summary = report["summary"]
+    lines = [
+        f"{summary['requests']} requests to {report['target']} ({report['mode']} loop, "
+        f"concurrency {report['concurrency']}{', rate ' + str(report['rate']) + '/s' if report['rate'] else ''}) "
+        f"in {summary['duration']:.1f}s",
+        f"Throughput: {summary['requests_per_second']:.2f} requests/s, {summary['tokens_per_second']:.1f} tokens/s",
+        f"Errors: {summary['errors']} ({summary['error_rate']:.1%})"
+        + (f" {summary['errors_by_type']}" if summary["errors_by_type"] else "")
+    ]
+    for metric in METRICS:
+        d = summary[metric]
+        if d["samples"]:
+            lines.append(f"{metric:<11} p50 {d['p50'] * 1000:8.0f} ms | p95 {d['p95'] * 1000:8.0f} ms | "
+                         f"p99 {d['p99'] * 1000:8.0f} ms | max {d['max'] * 1000:8.0f} ms")
+    for priority, distributions in summary.get("priorities", {}).items():
+        d = distributions["latency"]
+        wait = distributions["queue_wait"]
+        lines.append(f"{priority:<11} latency p50 {d['p50'] * 1000:.0f} ms | p99 {d['p99'] * 1000:.0f} ms"
+                     + (f" | queue wait p99 {wait['p99'] * 1000:.0f} ms" if wait["samples"] else "")
+                     + f" ({d['samples']} requests)")
+    server_wait = summary.get("server", {}).get("queue_wait_seconds")
+    if server_wait and server_wait.get("count"):
+        lines.append(f"Server queue wait (all requests since start) p50 {server_wait['p50'] * 1000:.0f} ms | "
+                     f"p95 {server_wait['p95'] * 1000:.0f} ms | p99 {server_wait['p99'] * 1000:.0f} ms")
+    return "\n".join(lines)
@@ -0,0 +1,242 @@
+"""
+TinyllamaChatbot - Streaming Batch Inference over JSONL Files
+"""
+
+import os
+import json
+import time
+import struct
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Tuple
+
+from core.utils import clean_text
+
+# A .seen record: a prompt's 16-byte digest and the line it first appeared on
+SEEN_RECORD = struct.Struct("<16sQ")
+
+class BatchRunner:
+    """Runs every prompt of a JSONL file through the chatbot and appends results to an output JSONL.
+
+    The input is read one line at a time, so files larger than memory are
+    fine. Progress is checkpointed next to the output file; a killed run
+    started again with the same arguments resumes after the last finished
+    line. Duplicate prompts (same cleaned text and sampling parameters) are
+    only generated once; later copies get a ``duplicate_of`` record naming
+    the line that was.
+    """
+
+    def __init__(self, chatbot, input_path: str, output_path: str, prompt_field: str = "prompt",
+                 checkpoint_every: int = 1, progress_interval: float = 5.0):
+        self.chatbot = chatbot
+        self.input_path = input_path
+        self.output_path = output_path
+        self.prompt_field = prompt_field
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.progress_interval = progress_interval
+        self.checkpoint_path = output_path + ".ckpt"
+        self.seen_path = output_path + ".seen"
+        # Lines of one file take turns with other batch jobs in the scheduler
+        self.session = f"batch:{os.path.basename(input_path)}"
+        self.logger = logging.getLogger(__name__)
+
+        self.line_number = 0
+        self.input_offset = 0
+        # Digest of each prompt generated so far -> the line it was on
+        self.seen = {}
+        self.stats = {"processed": 0, "skipped_duplicates": 0, "errors": 0, "tokens": 0}
+        self._baseline = dict(self.stats)
+
+    def run(self) -> dict:
+        """Process the input file to the end and return the run statistics."""
+        if not self.chatbot.is_model_loaded() and not self.chatbot.load_model():
+            raise RuntimeError("Failed to load model")
+
+        self._restore_checkpoint()
+        self._baseline = dict(self.stats)
+
+        # A worker pool can generate several lines at once; results are still
+        # written (and checkpointed) in input order
+        concurrency = getattr(self.chatbot, "num_workers", 1)
+
+        start = time.perf_counter()
+        last_report = start
+        since_checkpoint = 0
+        line_number, input_offset = self.line_number, self.input_offset
+
+        with open(self.input_path, 'rb') as src, \
+                open(self.output_path, 'ab') as out, \
+                open(self.seen_path, 'ab') as seen_file, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            src.seek(input_offset)
+            pending = deque()
+
+            for raw_line in iter(src.readline, b''):
+                line_number += 1
+                input_offset += len(raw_line)
+                pending.append((line_number, input_offset, self._submit_line(raw_line, line_number, executor)))
+
+                while pending and (len(pending) > concurrency or pending[0][2].done()):
+                    self._write_result(*pending.popleft(), out, seen_file)
+                    since_checkpoint += 1
+                    if since_checkpoint >= self.checkpoint_every:
+                        self._save_checkpoint(out, seen_file)
+                        since_checkpoint = 0
+
+                now = time.perf_counter()
+                if now - last_report >= self.progress_interval:
+                    self._report_progress(now - start)
+                    last_report = now
+
+            while pending:
+                self._write_result(*pending.popleft(), out, seen_file)
+            self._save_checkpoint(out, seen_file)
+
+        elapsed = time.perf_counter() - start
+        self._report_progress(elapsed)
+        self.stats["elapsed"] = elapsed
+        return self.stats
+
+    def _submit_line(self, raw_line: bytes, line_number: int, executor: ThreadPoolExecutor) -> Future:
+        """Parse one input line and start generating it; resolves to (record, digest)."""
+        done = Future()
+        if not raw_line.strip():
+            done.set_result((None, None))
+            return done
+
+        try:
+            item = json.loads(raw_line)
+            if not isinstance(item, dict):
+                item = {self.prompt_field: item}
+            prompt = item[self.prompt_field]
+            if not isinstance(prompt, str):
+                raise ValueError(f"'{self.prompt_field}' must be a string")
+            params = {}
+            if item.get("temperature") is not None:
+                params["temperature"] = float(item["temperature"])
+            if item.get("max_tokens") is not None:
+                params["max_tokens"] = int(item["max_tokens"])
+        except (ValueError, KeyError, TypeError) as e:
+            done.set_result(({"line": line_number, "error": f"Invalid input line: {str(e)}"}, None))
+            return done
+
+        cleaned_prompt = clean_text(prompt)
+        digest = hashlib.blake2b(
+            json.dumps([cleaned_prompt, params], sort_keys=True).encode('utf-8'), digest_size=16
+        ).digest()
+        record = {"line": line_number}
+        for key in ("id", "request_id"):
+            if key in item:
+                record[key] = item[key]
+        if digest in self.seen:
+            self.stats["skipped_duplicates"] += 1
+            record["duplicate_of"] = self.seen[digest]
+            done.set_result((record, None))
+            return done
+        self.seen[digest] = line_number
+        record["prompt"] = cleaned_prompt
+
+        return executor.submit(self._generate, record, params, digest)
+
+    def _generate(self, record: dict, params: dict, digest: bytes) -> Tuple[dict, bytes]:
+        """Run one prompt through the model (on an executor thread)."""
+        try:
+            stats = {}
+            formatted = self.chatbot.prompt_manager.format_prompt(record["prompt"])
+            # Batch lines give way to interactive requests sharing the model
+            response = "".join(self.chatbot.stream_completion(formatted, stats, priority="batch",
+                                                              session=self.session, **params))
+            record["response"] = clean_text(response)
+            record["completion_tokens"] = stats.get("completion_tokens", 0)
+            record["elapsed"] = round(stats.get("elapsed", 0.0), 4)
+        except Exception as e:
+            self.logger.error(f"Error generating response for line {record['line']}: {str(e)}")
+            record["error"] = str(e)
+        return record, digest
+
+    def _write_result(self, line_number: int, input_offset: int, future: Future, out, seen_file):
+        """Append a finished line's record and advance the position the next checkpoint records."""
+        record, digest = future.result()
+        if record is not None:
+            out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            if "error" in record:
+                self.stats["errors"] += 1
+            if digest is not None:
+                self.stats["processed"] += 1
+                self.stats["tokens"] += record.get("completion_tokens", 0)
+        if digest is not None:
+            seen_file.write(SEEN_RECORD.pack(digest, line_number))
+
+        self.line_number = line_number
+        self.input_offset = input_offset
+
+    def _restore_checkpoint(self):
+        """Resume from a previous run's checkpoint, discarding output written after it."""
+        if not os.path.exists(self.checkpoint_path):
+            # Fresh run: start the output and duplicate index from scratch
+            open(self.output_path, 'wb').close()
+            open(self.seen_path, 'wb').close()
+            return
+
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+
+        if checkpoint.get("input_path") != os.path.abspath(self.input_path):
+            raise RuntimeError(f"Checkpoint {self.checkpoint_path} belongs to a different input file")
+
+        self.line_number = checkpoint["line"]
+        self.input_offset = checkpoint["input_offset"]
+        self.stats.update(checkpoint.get("stats", {}))
+
+        # Anything past the checkpointed sizes was written by an interrupted run;
+        # a file shorter than that was changed since, and resuming would lose lines
+        for path, size in ((self.output_path, checkpoint["output_size"]), (self.seen_path, checkpoint["seen_size"])):
+            found = os.path.getsize(path) if os.path.exists(path) else 0
+            if found < size:
+                raise RuntimeError(
+                    f"{path} is {found} bytes but checkpoint {self.checkpoint_path} expects at least {size}; "
+                    f"remove the checkpoint to start over"
+                )
+            with open(path, 'ab') as f:
+                f.truncate(size)
+        if checkpoint.get("seen_record_size", 16) != SEEN_RECORD.size:
+            raise RuntimeError(f"{self.seen_path} was written by an older version; remove the checkpoint to start over")
+        with open(self.seen_path, 'rb') as f:
+            for record in iter(lambda: f.read(SEEN_RECORD.size), b''):
+                digest, line_number = SEEN_RECORD.unpack(record)
+                self.seen[digest] = line_number
+
+        self.logger.info(f"Resuming {self.input_path} after line {self.line_number}")
+
+    def _save_checkpoint(self, out, seen_file):
+        """Flush output and atomically record how far the run has got."""
+        for f in (out, seen_file):
+            f.flush()
+            os.fsync(f.fileno())
+
+        checkpoint = {
+            "input_path": os.path.abspath(self.input_path),
+            "line": self.line_number,
+            "input_offset": self.input_offset,
+            "output_size": out.tell(),
+            "seen_size": seen_file.tell(),
+            "seen_record_size": SEEN_RECORD.size,
+            "stats": self.stats
+        }
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _report_progress(self, elapsed: float):
+        elapsed = max(elapsed, 1e-9)
+        # Throughput only counts work done by this run, not resumed totals
+        prompts = self.stats["processed"] - self._baseline["processed"]
+        tokens = self.stats["tokens"] - self._baseline["tokens"]
+        self.logger.info(
+            f"Line {self.line_number}: {self.stats['processed']} generated, "
+            f"{self.stats['skipped_duplicates']} duplicates skipped, {self.stats['errors']} errors | "
+            f"{prompts / elapsed:.2f} prompts/s, {tokens / elapsed:.1f} tokens/s"
+        )
@@ -0,0 +1,266 @@
+"""
+TinyllamaChatbot - Terminal Chat REPL
+"""
+
+import sys
+import time
+import queue
+import logging
+import threading
+from typing import Optional, TextIO
+
+from core.chatbot import INTERRUPTED
+from core.utils import clean_text
+
+# Parameters /set accepts, with how to parse their values
+PARAMETERS = {
+    "temperature": float,
+    "max_tokens": int,
+    "top_k": int,
+    "top_p": float,
+    "repetition_penalty": float,
+    "seed": int,
+    "timeout": float,
+    "token_budget": int
+}
+
+HELP = """Commands:
+  /help                 Show this help
+  /history              Show the conversation so far
+  /clear                Forget the conversation and start a new session
+  /export FILE          Export the conversation (.json, .jsonl or text)
+  /stats                Show statistics of the last reply and of this session
+  /set NAME VALUE       Change a generation parameter (/set NAME to reset it)
+  /params               Show the parameters in effect
+  /models               List the available models
+  /model NAME           Continue the conversation on another model
+  /quit                 Exit (Ctrl+D works too)
+Ctrl+C stops a reply that is being generated."""
+
+class ChatREPL:
+    """Chat with the model from a terminal, streaming replies as they are generated.
+
+    Lines starting with / are commands; everything else is a message. The
+    model loads in the background, so the prompt is shown at once and the
+    first message waits for it if needed. When input is piped the prompt,
+    banner and status lines are left out and every line is sent in turn,
+    so stdout carries nothing but the replies, each ending in a newline.
+    """
+
+    def __init__(self, chatbot, stdin: TextIO = sys.stdin, stdout: TextIO = sys.stdout,
+                 stderr: TextIO = sys.stderr, interactive: Optional[bool] = None,
+                 start_time: Optional[float] = None, **params):
+        self.chatbot = chatbot
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.interactive = stdin.isatty() if interactive is None else interactive
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.params = {key: value for key, value in params.items() if value is not None}
+        self.logger = logging.getLogger(__name__)
+
+        self.startup_time: Optional[float] = None
+        self.last_stats: dict = {}
+        self.session = {"messages": 0, "completion_tokens": 0, "generation_time": 0.0}
+        self._loaded = threading.Event()
+        self._load_ok = False
+
+    def run(self) -> int:
+        """Read messages and commands until EOF or /quit; returns an exit code."""
+        threading.Thread(target=self._load_model, name="repl-load", daemon=True).start()
+        if self.interactive:
+            self._enable_line_editing()
+            self.status("Tinyllama Chatbot - type /help for commands, /quit to exit")
+        self.startup_time = time.perf_counter() - self.start_time
+        self.logger.info(f"Startup: prompt ready after {self.startup_time * 1000:.0f} ms")
+
+        while True:
+            try:
+                line = self._read_line()
+            except KeyboardInterrupt:
+                self.stdout.write("\n")
+                continue
+            if line is None:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("/"):
+                if not self.command(line):
+                    break
+            elif not self.send(line):
+                return 1
+        return 0
+
+    def _load_model(self):
+        try:
+            self._load_ok = self.chatbot.load_model()
+        except Exception as e:
+            self.logger.error(f"Failed to load model: {str(e)}")
+        finally:
+            self._loaded.set()
+
+    def _enable_line_editing(self):
+        try:
+            # Arrow keys and history for input(); not available on every platform
+            import readline  # noqa: F401
+        except ImportError:
+            pass
+
+    def _read_line(self) -> Optional[str]:
+        if self.interactive:
+            try:
+                return input("You: ")
+            except EOFError:
+                self.stdout.write("\n")
+                return None
+        line = self.stdin.readline()
+        return line or None
+
+    def status(self, message: str):
+        """Print a message that isn't part of a reply; hidden when input is piped."""
+        if self.interactive:
+            print(message, file=self.stderr)
+
+    def send(self, message: str) -> bool:
+        """Stream the reply to ``message``; False if the model could not be loaded."""
+        if not self._loaded.is_set():
+            self.status("Loading model...")
+        self._loaded.wait()
+        if not self._load_ok:
+            print("Error: Failed to load model (see logs/application.log)", file=self.stderr)
+            return False
+
+        stats = {}
+        chunks = queue.Queue()
+
+        def generate():
+            try:
+                for chunk in self.chatbot.stream_response(message, stats, **self.params):
+                    chunks.put(chunk)
+            finally:
+                chunks.put(None)
+
+        # Generated on another thread so Ctrl+C can cancel it and still keep the partial reply
+        threading.Thread(target=generate, name="repl-generate", daemon=True).start()
+        if self.interactive:
+            self.stdout.write("Bot: ")
+        text = []
+        while True:
+            try:
+                chunk = chunks.get()
+            except KeyboardInterrupt:
+                self.chatbot.cancel()
+                continue
+            if chunk is None:
+                break
+            text.append(chunk)
+            self.stdout.write(chunk)
+            self.stdout.flush()
+        self.stdout.write("\n")
+        self.stdout.flush()
+
+        self.last_stats = stats
+        if "".join(text).startswith("Error:"):
+            return True
+        self.session["messages"] += 1
+        self.session["completion_tokens"] += stats.get("completion_tokens", 0)
+        self.session["generation_time"] += stats.get("elapsed", 0.0)
+        if stats.get("finish_reason") in INTERRUPTED:
+            self.status(f"(stopped: {stats['finish_reason']})")
+        return True
+
+    def command(self, line: str) -> bool:
+        """Run a slash command; False means exit."""
+        name, _, argument = line[1:].partition(" ")
+        argument = argument.strip()
+        if name in ("quit", "exit", "q"):
+            return False
+        handler = getattr(self, f"cmd_{name}", None)
+        if handler is None:
+            print(f"Unknown command /{name} (try /help)", file=self.stderr)
+        else:
+            handler(argument)
+        return True
+
+    def cmd_help(self, argument: str):
+        print(HELP, file=self.stdout)
+
+    def cmd_history(self, argument: str):
+        history = self.chatbot.prompt_manager.get_conversation_history()
+        if not history:
+            print("(no messages yet)", file=self.stdout)
+        for user_msg, bot_msg in history:
+            print(f"You: {user_msg}\nBot: {bot_msg}", file=self.stdout)
+
+    def cmd_clear(self, argument: str):
+        self.chatbot.clear_history()
+        self.status("Conversation cleared")
+
+    def cmd_export(self, argument: str):
+        if not argument:
+            print("Usage: /export FILE", file=self.stderr)
+        elif self.chatbot.prompt_manager.export_history(argument):
+            self.status(f"Exported to {argument}")
+        else:
+            print(f"Failed to export to {argument}", file=self.stderr)
+
+    def cmd_stats(self, argument: str):
+        stats = self.last_stats
+        lines = [f"Startup: prompt ready after {self.startup_time * 1000:.0f} ms"]
+        if stats.get("completion_tokens"):
+            ttft = stats.get("ttft")
+            decode = stats.get("elapsed", 0.0) - (ttft or 0.0)
+            rate = (stats["completion_tokens"] - 1) / decode if decode > 0 else 0.0
+            lines.append(
+                f"Last reply: {stats['completion_tokens']} tokens in {stats.get('elapsed', 0.0):.2f}s, "
+                f"first token {(ttft or 0.0) * 1000:.0f} ms, {rate:.1f} tokens/s, "
+                f"{stats.get('prompt_tokens', 0)} prompt tokens ({stats.get('reused_tokens', 0)} reused), "
+                f"finish: {stats.get('finish_reason')}"
+            )
+        elif stats.get("cached"):
+            lines.append("Last reply: served from the response cache")
+        session = self.session
+        rate = session["completion_tokens"] / session["generation_time"] if session["generation_time"] else 0.0
+        lines.append(f"Session: {session['messages']} replies, {session['completion_tokens']} tokens, "
+                     f"{rate:.1f} tokens/s overall")
+        print("\n".join(lines), file=self.stdout)
+
+    def cmd_set(self, argument: str):
+        name, _, value = argument.partition(" ")
+        if name not in PARAMETERS:
+            print(f"Usage: /set NAME [VALUE], NAME one of {', '.join(PARAMETERS)}", file=self.stderr)
+            return
+        if not value.strip():
+            self.params.pop(name, None)
+            self.status(f"{name} reset to the configured value")
+            return
+        try:
+            self.params[name] = PARAMETERS[name](value.strip())
+        except ValueError:
+            print(f"Invalid value for {name}: {value.strip()}", file=self.stderr)
+            return
+        self.status(f"{name} = {self.params[name]}")
+
+    def cmd_params(self, argument: str):
+        config = self.chatbot.config
+        for name in PARAMETERS:
+            value = self.params.get(name, config.get(f"request_{name}" if name in ("timeout", "token_budget") else name))
+            source = "set" if name in self.params else "config"
+            print(f"{name} = {'model default' if value is None else value} ({source})", file=self.stdout)
+
+    def cmd_models(self, argument: str):
+        for model in self.chatbot.list_models():
+            marker = "*" if model["active"] else " "
+            print(f"{marker} {model['name']} ({model['template']}, "
+                  f"{'loaded' if model['resident'] else 'not loaded'})", file=self.stdout)
+
+    def cmd_model(self, argument: str):
+        # Switching during the initial load would be undone when it finishes
+        self._loaded.wait()
+        if not argument:
+            print(f"Current model: {self.chatbot.session_model}", file=self.stdout)
+        elif self.chatbot.select_model(clean_text(argument)):
+            self.status(f"Switched to {argument}")
+        else:
+            print(f"Failed to switch to model {argument}", file=self.stderr)
@@ -1,107 +1,940 @@
-"""
-TinyllamaChatbot Core - Model Loading and Response Generation
-"""
-
-import os
-import json
-import logging
-from typing import Optional
-from ctransformers import AutoModelForCausalLM
-
-from .prompt_manager import PromptManager
-from .utils import clean_text
-
-class TinyllamaChatbot:
-    """Main chatbot class that handles model loading and response generation."""
-
-    def __init__(self):
-        self.model = None
-        self.prompt_manager = PromptManager()
-        self.config = self._load_config()
-        self.logger = logging.getLogger(__name__)
-
-    def _load_config(self) -> dict:
-        """Load configuration from settings.json."""
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'settings.json')
-        try:
-            with open(config_path, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            self.logger.warning("Config file not found, using defaults")
-            return {
-                "model_path": "C:\\Users\\Blakka\\Documents\\CHATBOT\\model\\Tinyllama-1B-miniguanaco.Q2_K.gguf",
-                "model_type": "tinyllama",
-                "temperature": 0.7,
-                "max_tokens": 256,
-                "gpu_layers": 0,
-                "logging_enabled": True
-            }
-
-    def load_model(self) -> bool:
-        """Public method to load the Tinyllama model using ctransformers."""
-        try:
-            model_path = self.config["model_path"]
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"Model file not found: {model_path}")
-
-            self.logger.info(f"Loading model from: {model_path}")
-
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                model_type=self.config["model_type"],
-                gpu_layers=self.config["gpu_layers"],
-                temperature=self.config["temperature"],
-                max_new_tokens=self.config["max_tokens"],
-                context_length=2048
-            )
-
-            self.logger.info("Model loaded successfully")
-            return True
-
-        except Exception as e:
-            self.logger.error(f"Failed to load model: {str(e)}")
-            return False
-
-    def generate_response(self, user_input: str) -> str:
-        """Generate a response to user input."""
-        if not self.model:
-            return "Error: Model not loaded"
-
-        try:
-            cleaned_input = clean_text(user_input)
-            prompt = self.prompt_manager.format_prompt(cleaned_input)
-
-            self.logger.info(f"Generating response for: {cleaned_input}")
-
-            response = self.model(
-                prompt,
-                max_new_tokens=self.config["max_tokens"],
-                temperature=self.config["temperature"],
-                stop=["Human:", "User:", "\n\n"]
-            )
-
-            cleaned_response = clean_text(response)
-
-            if self.config.get("logging_enabled", True):
-                self.prompt_manager.log_interaction(cleaned_input, cleaned_response)
-
-            return cleaned_response
-
-        except Exception as e:
-            self.logger.error(f"Error generating response: {str(e)}")
-            return f"Error: {str(e)}"
-
-    def is_model_loaded(self) -> bool:
-        """Check if the model is loaded and ready."""
-        return self.model is not None
-
-    def get_model_info(self) -> dict:
-        """Return model configuration and status."""
-        return {
-            "model_path": self.config.get("model_path"),
-            "model_type": self.config.get("model_type"),
-            "temperature": self.config.get("temperature"),
-            "max_tokens": self.config.get("max_tokens"),
-            "gpu_layers": self.config.get("gpu_layers"),
-            "is_loaded": self.is_model_loaded()
-        }
+"""
+TinyllamaChatbot Core - Model Loading and Response Generation
+"""
+
+import os
+import time
+import atexit
+import bisect
+import codecs
+import logging
+import itertools
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from .prompt_manager import GROUNDING_HEADER, PromptManager
+from .postprocess import OutputProcessor
+from .conversation import ConversationContext
+from .gguf import inspect_model
+from .metrics import NULL_TRACE, metrics
+from .model_registry import ModelRegistry
+from .response_cache import ResponseCache
+from .retrieval import open_index
+from .scheduler import LANES, RequestScheduler
+from .speculative import PromptLookupDrafter
+from .templates import TemplateTokens
+from .utils import clean_text, load_config
+
+# Prompts are evaluated in slices this long so cancellation and deadlines are noticed mid-prompt
+PROMPT_EVAL_SLICE = 64
+# Config keys passed through to the backend's sampler
+SAMPLING_KEYS = ("top_k", "top_p", "repetition_penalty", "last_n_tokens", "seed")
+# Finish reasons of generations that were cut short; their output is partial and never cached
+INTERRUPTED = ("cancelled", "deadline", "budget")
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+class TinyllamaChatbot:
+    """Main chatbot class that handles model loading and response generation."""
+
+    def __init__(self, config_overrides: Optional[dict] = None):
+        self.model = None
+        self.active = None
+        self.context = ConversationContext()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.config = self._load_config()
+        # Applied before the cache and stores below are opened
+        self.config.update(config_overrides or {})
+        self.prompt_manager = PromptManager(self.config)
+        self.registry = ModelRegistry(self.config)
+        self.session_model = None
+        self._conversation_version = 0
+        metrics.enabled = self.config.get("metrics_enabled", True)
+        self.model_identity = ""
+        self.model_metadata = None
+        self.startup_timings = {}
+        self._request_ids = itertools.count(1)
+        self._last_request_id = 0
+        self._cancelled_through = 0
+        self.response_cache = None
+        if self.config.get("response_cache_enabled", False):
+            self.response_cache = ResponseCache(
+                self.config.get("response_cache_path") or os.path.join(PROJECT_ROOT, 'cache', 'responses.sqlite3'),
+                max_entries=self.config.get("response_cache_max_entries", 10000),
+                max_bytes=self.config.get("response_cache_max_bytes", 50 * 1024 * 1024)
+            )
+        self.semantic_cache = None
+        if self.config.get("semantic_cache_enabled", False):
+            self.semantic_cache = self._open_semantic_cache()
+        # Generation requests queue here for the model; see core/scheduler.py
+        self.scheduler = RequestScheduler(self._lock, {
+            "interactive": self.config.get("scheduler_interactive_queue_size", 16),
+            "batch": self.config.get("scheduler_batch_queue_size", 256)
+        })
+        self.retriever = None
+        if self.config.get("retrieval_enabled", False):
+            self.retriever = open_index(self.config)
+            atexit.register(self.retriever.close)
+        # Moving average of generation time, to estimate what a semantic cache hit saved
+        self._generation_seconds = None
+        self._compaction_pending = threading.Event()
+        self._compaction_thread = None
+
+    def _load_config(self) -> dict:
+        """Load configuration from settings.json."""
+        return load_config()
+
+    def _open_semantic_cache(self):
+        try:
+            # Imported lazily: NumPy is only needed for this optional cache
+            from .semantic_cache import SemanticCache
+        except ImportError as e:
+            self.logger.warning(f"Semantic cache disabled, NumPy is not available: {str(e)}")
+            return None
+        cache = SemanticCache(
+            self.config.get("semantic_cache_path") or os.path.join(PROJECT_ROOT, 'cache', 'semantic'),
+            capacity=self.config.get("semantic_cache_max_entries", 10000),
+            threshold=self.config.get("semantic_cache_threshold", 0.92),
+            dim=self.config.get("semantic_cache_dim", 128)
+        )
+        atexit.register(cache.close)
+        return cache
+
+    def inspect_model(self) -> Optional[dict]:
+        """Read the GGUF header of the configured model file without loading its weights."""
+        if self.model_metadata is None and self.config.get("backend") != "fake":
+            model_path = self.config.get("model_path", "")
+            if os.path.isfile(model_path):
+                self.model_metadata = inspect_model(model_path)
+        return self.model_metadata
+
+    def load_model(self) -> bool:
+        """Public method to load the Tinyllama model using ctransformers.
+
+        The model directory is scanned and the configured model (or the
+        first one found) is loaded through the registry. GGUF headers are
+        checked before ctransformers is even imported, so a wrong or
+        truncated file fails fast. With ``"backend": "fake"`` a deterministic
+        FakeModel is used instead, so benchmarks and tests can run without
+        the GGUF file. Each startup phase is timed into ``startup_timings``.
+        """
+        try:
+            start = time.perf_counter()
+            self.registry.scan()
+            self.startup_timings["inspect_header"] = time.perf_counter() - start
+            name = self.session_model or self.registry.default_name()
+            if name is None:
+                raise FileNotFoundError(f"Model file not found: {self.config['model_path']}")
+
+            with self._lock:
+                loaded = self._activate(name)
+            self.session_model = name
+            self.startup_timings.update(loaded.timings)
+            self.logger.info(
+                f"Model {name} loaded successfully ("
+                + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.startup_timings.items())
+                + ")"
+            )
+            if self.config.get("speculative_decoding", False) and not hasattr(loaded.model, "verify"):
+                # ctransformers only exposes the logits of the last evaluated position
+                self.logger.warning("Speculative decoding needs batched verification, which this backend "
+                                    "lacks; generating one token per forward pass")
+            self._start_warmup()
+            for preload in self.config.get("model_preload", []):
+                self.registry.preload(preload)
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to load model: {str(e)}")
+            return False
+
+    def list_models(self) -> List[dict]:
+        """The models found in the model directory, with which are loaded and active."""
+        if not self.registry.models:
+            self.registry.scan()
+        return self.registry.list()
+
+    def select_model(self, name: str) -> bool:
+        """Use model ``name`` for this session from now on, loading it if needed."""
+        try:
+            with self._lock:
+                self._activate(name)
+            self.session_model = name
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to switch to model {name}: {str(e)}")
+            return False
+
+    def _activate(self, name: str):
+        """Make ``name`` the model requests run on (caller holds the lock).
+
+        Each resident model keeps its own evaluated context; if the
+        conversation moved on while another model was active, the turns are
+        re-added as text and tokenized on the next request.
+        """
+        if self.active is not None and self.active.name == name:
+            return self.active
+        start = time.perf_counter()
+        loaded = self.registry.get(name)
+        previous = self.active.name if self.active else None
+        if loaded.template_tokens is None:
+            # Only used while this model is active, so self._tokenize uses its tokenizer
+            loaded.template_tokens = TemplateTokens(loaded.template, self._tokenize, self.prompt_manager.system_prompt)
+        self.prompt_manager.set_template(loaded.template)
+        if loaded.synced != self._conversation_version:
+            loaded.context.clear()
+            # Rebuilt on the next request, with the current memory
+            loaded.context.preamble_tokens = []
+            for i, (user_msg, bot_msg) in enumerate(self.prompt_manager.recent_history()):
+                loaded.context.add_text_turn(self.prompt_manager.format_exchange(user_msg, bot_msg, first=i == 0))
+            loaded.synced = self._conversation_version
+        self.active = loaded
+        self.model = loaded.model
+        self.context = loaded.context
+        self.model_identity = loaded.identity
+        self.model_metadata = loaded.metadata
+        self.registry.activated(name, previous)
+        if previous:
+            elapsed = time.perf_counter() - start
+            metrics.increment("model_switches_total")
+            metrics.observe("model_switch_seconds", elapsed)
+            self.logger.info(f"Switched model {previous} -> {name} in {elapsed * 1000:.1f} ms")
+        return loaded
+
+    def _conversation_changed(self):
+        """Note that the conversation changed; only the active model's context follows it."""
+        self._conversation_version += 1
+        if self.active is not None:
+            self.active.synced = self._conversation_version
+
+    def _start_warmup(self):
+        """Evaluate the preamble and sample one token in the background.
+
+        This pays one-time costs (page faults on the weights, allocator and
+        thread pool setup) before the first real request, and leaves the
+        preamble evaluated so the first turn reuses it. A request that
+        arrives meanwhile simply waits for the model lock.
+        """
+        if not self.config.get("warmup_enabled", True):
+            return
+
+        def warm_up():
+            start = time.perf_counter()
+            try:
+                with self._lock:
+                    if not self.context.preamble_tokens:
+                        self.context.preamble_tokens = self._preamble_tokens()
+                    for _ in self._generate(list(self.context.preamble_tokens), max_tokens=1):
+                        pass
+                self.startup_timings["warmup"] = time.perf_counter() - start
+                self.logger.info(f"Warm-up finished in {self.startup_timings['warmup'] * 1000:.0f} ms")
+            except Exception as e:
+                self.logger.warning(f"Warm-up failed: {str(e)}")
+
+        threading.Thread(target=warm_up, daemon=True).start()
+
+    def reset_context(self):
+        """Forget the conversation and drop every evaluated token, e.g. between benchmark runs."""
+        with self._lock:
+            self.context.clear()
+            if self.model:
+                # Evaluated tokens are only kept while they prefix the next prompt
+                self.model.prepare_inputs_for_generation([self.model.eos_token_id], reset=True)
+
+    def generate_response(self, user_input: str) -> str:
+        """Generate a response to user input."""
+        return clean_text("".join(self.stream_response(user_input)))
+
+    def cancel(self):
+        """Stop every request started so far at its next token.
+
+        Running generations end as if they had finished, so the caller gets
+        the partial text and the turn is kept in the conversation; requests
+        still waiting for the model end without generating. Requests started
+        after this call are not affected.
+        """
+        self._cancelled_through = self._last_request_id
+        self.logger.info(f"Cancelling requests up to #{self._cancelled_through}")
+
+    def _request_limits(self, overrides: dict, start: float) -> dict:
+        """Turn the ``timeout`` and ``token_budget`` overrides into arguments for ``_generate``."""
+        request_id = next(self._request_ids)
+        self._last_request_id = max(self._last_request_id, request_id)
+        timeout = overrides.pop("timeout", None) or self.config.get("request_timeout", 0)
+        token_budget = overrides.pop("token_budget", None) or self.config.get("request_token_budget", 0)
+        return {
+            "request_id": request_id,
+            "deadline": start + timeout if timeout else None,
+            "token_budget": token_budget or None
+        }
+
+    def stream_response(self, user_input: str, stats: Optional[dict] = None,
+                        use_cache: Optional[bool] = None, **overrides) -> Iterator[str]:
+        """Generate the next conversation turn, yielding text chunks as they are produced.
+
+        Earlier turns of the conversation are part of the prompt; only the
+        tokens the model has not evaluated yet are fed to it. A turn never
+        yields the model to other requests once it runs, since they could
+        change the conversation under it. Errors are
+        reported as an "Error: ..." chunk rather than raised. See
+        ``stream_completion`` for ``stats``, ``use_cache``, the limits and
+        the sampling overrides.
+        """
+        if not self.model:
+            yield "Error: Model not loaded"
+            return
+
+        stats = {} if stats is None else stats
+        trace = metrics.trace("request")
+        error = False
+        try:
+            start = time.perf_counter()
+            limits = self._request_limits(overrides, start)
+            model = overrides.pop("model", None) or self.session_model
+            priority = overrides.pop("priority", None) or LANES[0]
+            session = overrides.pop("session", None) or "chat"
+            with trace.span("clean_text"):
+                cleaned_input = clean_text(user_input)
+            self.logger.info(f"Generating response for: {cleaned_input}")
+
+            version = self._conversation_version
+            with trace.span("cache_lookup"):
+                cache_key = self._cache_key("chat", cleaned_input, overrides, use_cache, model)
+                response = self.response_cache.get(cache_key) if cache_key and self.response_cache else None
+
+            embedding = None
+            if response is None and cache_key and self.semantic_cache is not None:
+                with trace.span("semantic_lookup"):
+                    # Includes the conversation state, like the exact key
+                    scope = self._cache_key("chat", "", overrides, use_cache, model)
+                    embedding, hit = self._semantic_lookup(model, cleaned_input, scope, priority, session)
+                if hit is not None:
+                    stats["semantic_similarity"], response = hit
+
+            if response is not None:
+                # Held like a generated turn, so clear_history or compaction can't come between context and history
+                with self._lock:
+                    if self._conversation_version != version:
+                        # The conversation moved on since the lookup, so the reply may not fit it any more
+                        response = cache_key = None
+                        stats.pop("semantic_similarity", None)
+                    else:
+                        self.context.add_text_turn(
+                            self.prompt_manager.format_exchange(cleaned_input, response, first=not self.context.turns)
+                        )
+                        self.prompt_manager.add_to_history(cleaned_input, response)
+                        self._conversation_changed()
+
+            if response is not None:
+                self._record_cache_hit(stats, start)
+                if "semantic_similarity" in stats and self._generation_seconds is not None:
+                    saved = self._generation_seconds - stats["elapsed"]
+                    self.semantic_cache.record_saving(saved)
+                    metrics.increment("semantic_cache_saved_seconds_total", max(saved, 0.0))
+                yield response
+            else:
+                passages = []
+                if self.retriever is not None:
+                    with trace.span("retrieve"):
+                        passages = self._retrieve(cleaned_input)
+                with self.scheduler.slot(priority, session) as slot:
+                    stats["queue_wait"] = slot.wait_seconds
+                    with trace.span("switch_model"):
+                        self._activate(model)
+                    template_tokens = self.active.template_tokens
+                    with trace.span("format"):
+                        if not self.context.preamble_tokens:
+                            self.context.preamble_tokens = self._preamble_tokens()
+                    with trace.span("tokenize"):
+                        # Template fragments come from the cache; only the user's text is tokenized
+                        first = not self.context.turns
+                        turn_tokens = template_tokens.turn(cleaned_input, first=first)
+                        max_tokens = overrides.get("max_tokens") or self.config["max_tokens"]
+                        budget = self.model.context_length - max_tokens
+                    if self.context.turns and self.config.get("compaction_enabled", True):
+                        with trace.span("compact"):
+                            # Turns this message would push out of the window are folded now; build would drop them
+                            if self._fold_turns(budget - len(turn_tokens), keep=0) and not self.context.turns:
+                                first = True
+                                turn_tokens = template_tokens.turn(cleaned_input, first=True)
+                    with trace.span("tokenize"):
+                        plain_turn = None
+                        notes = self._fit_passages(passages, budget - len(self.context.preamble_tokens) - len(turn_tokens))
+                        if notes:
+                            plain_turn = turn_tokens
+                            grounded = self.prompt_manager.format_grounded_input(cleaned_input, [text for text, _ in notes])
+                            turn_tokens = template_tokens.turn(grounded, first=first)
+                            stats["retrieved_passages"] = [source for _, source in notes]
+                        tokens = self.context.build(turn_tokens, budget, self._tokenize)
+                    counts = {
+                        "preamble_tokens": len(self.context.preamble_tokens),
+                        "history_tokens": len(tokens) - len(self.context.preamble_tokens) - len(turn_tokens),
+                        "retrieval_tokens": len(turn_tokens) - len(plain_turn) if plain_turn is not None else 0,
+                        **template_tokens.last_counts
+                    }
+                    stats.update(counts)
+                    self.logger.info(
+                        f"Prompt ({template_tokens.template.name}): {len(tokens)} tokens = "
+                        f"{counts['preamble_tokens']} preamble + {counts['history_tokens']} history + "
+                        f"{counts['template_tokens']} template + {counts['user_tokens']} user"
+                        + (f" (of which {counts['retrieval_tokens']} retrieved)" if notes else "")
+                    )
+
+                    chunks = []
+                    output_tokens = []
+                    for chunk in self._generate(tokens, stats, output_tokens=output_tokens, trace=trace,
+                                                **limits, **overrides):
+                        chunks.append(chunk)
+                        yield chunk
+
+                    separator = template_tokens.separator()
+                    # Retrieved notes stay out of the history, so later prompts don't carry them
+                    prompt_turn = plain_turn if plain_turn is not None else tokens[len(tokens) - len(turn_tokens):]
+                    self.context.add_turn(prompt_turn + output_tokens + separator)
+                    response = clean_text("".join(chunks))
+                    # Still holding the model, so clear_history can't come between the turn and its history
+                    self.prompt_manager.add_to_history(cleaned_input, response)
+                    self._conversation_changed()
+
+                if cache_key and stats.get("finish_reason") not in INTERRUPTED:
+                    if self.response_cache:
+                        self.response_cache.put(cache_key, response)
+                    if embedding is not None:
+                        self.semantic_cache.put(embedding, scope, cleaned_input, response)
+                elapsed = time.perf_counter() - start
+                self._generation_seconds = (elapsed if self._generation_seconds is None
+                                            else 0.8 * self._generation_seconds + 0.2 * elapsed)
+
+            with trace.span("logging"):
+                if self.config.get("logging_enabled", True):
+                    self.prompt_manager.log_interaction(cleaned_input, response, stats)
+            self._schedule_compaction()
+
+        except Exception as e:
+            error = True
+            self.logger.error(f"Error generating response: {str(e)}")
+            yield f"Error: {str(e)}"
+        finally:
+            trace.finish(error)
+
+    def stream_completion(self, prompt: str, stats: Optional[dict] = None,
+                          use_cache: Optional[bool] = None, **overrides) -> Iterator[str]:
+        """Stream the model's continuation of an already formatted prompt.
+
+        Accepts ``temperature``, ``max_tokens``, ``stop`` and SAMPLING_KEYS
+        overrides, which default to the configured values. ``timeout`` (seconds, counted from
+        this call, so time spent waiting for the model counts) and
+        ``token_budget`` (tokens evaluated for the prompt plus tokens
+        generated) cut the request short; like ``cancel()`` they end it with
+        the partial text. ``priority`` ("interactive" or "batch") and
+        ``session`` pick the scheduler queue the request waits in; a batch
+        request steps aside between tokens while interactive ones run. If a
+        ``stats`` dict is given it is filled with token counts, timings, the
+        ``queue_wait`` and the ``finish_reason`` once the generation
+        finishes. ``use_cache=False`` skips the response cache (e.g. to get
+        a fresh sample); ``True`` uses it even when sampling bypass is
+        configured. Errors are raised to the caller.
+        """
+        if not self.model:
+            raise RuntimeError("Model not loaded")
+
+        stats = {} if stats is None else stats
+        trace = metrics.trace("completion")
+        error = True
+        try:
+            start = time.perf_counter()
+            limits = self._request_limits(overrides, start)
+            model = overrides.pop("model", None) or self.session_model
+            priority = overrides.pop("priority", None) or LANES[0]
+            session = overrides.pop("session", None)
+            with trace.span("cache_lookup"):
+                cache_key = self._cache_key("completion", prompt, overrides, use_cache, model)
+                response = self.response_cache.get(cache_key) if cache_key and self.response_cache else None
+            if response is not None:
+                self._record_cache_hit(stats, start)
+                error = False
+                yield response
+                return
+
+            chunks = []
+            with self.scheduler.slot(priority, session) as slot:
+                stats["queue_wait"] = slot.wait_seconds
+                with trace.span("switch_model"):
+                    self._activate(model)
+                with trace.span("tokenize"):
+                    tokens = self._tokenize(prompt, bos=True)
+                for chunk in self._generate(tokens, stats, trace=trace, slot=slot, **limits, **overrides):
+                    chunks.append(chunk)
+                    yield chunk
+
+            if cache_key and self.response_cache and stats.get("finish_reason") not in INTERRUPTED:
+                self.response_cache.put(cache_key, "".join(chunks))
+            error = False
+        finally:
+            trace.finish(error)
+
+    def _cache_key(self, kind: str, text: str, overrides: dict, use_cache: Optional[bool],
+                   model: str) -> Optional[str]:
+        """Return the response cache key for a request, or None if it must not be cached."""
+        if (self.response_cache is None and self.semantic_cache is None) or use_cache is False:
+            return None
+
+        temperature = overrides.get("temperature")
+        if temperature is None:
+            temperature = self.config["temperature"]
+        if use_cache is None and temperature > 0 and self.config.get("response_cache_bypass_sampling", True):
+            return None
+
+        if kind == "chat":
+            # A turn's reply depends on the conversation before it, so only the same conversation state matches
+            state = self.prompt_manager.conversation_digest()
+            if self.retriever is not None:
+                # Replies depend on the passages retrieved, so each index build starts over
+                kind = f"chat@{self.retriever.generation()}"
+            kind = f"{kind}#{state}"
+        return ResponseCache.make_key(
+            f"{kind}:{text}", temperature,
+            overrides.get("max_tokens") or self.config["max_tokens"],
+            overrides.get("stop") or self.prompt_manager.template.stop,
+            self.registry.identity(model),
+            {key: overrides[key] for key in SAMPLING_KEYS if overrides.get(key) is not None}
+        )
+
+    def _semantic_lookup(self, model: str, text: str, scope: str, priority: str = LANES[0],
+                         session: Optional[str] = None) -> Tuple[Optional[List[float]], Optional[tuple]]:
+        """Embed a message and look for the reply to a similar one; returns (embedding, hit).
+
+        Embedding resets a model's context, so it runs on a second instance
+        of the model and the conversation evaluated on the first is kept.
+        It waits for the model in the scheduler like a generation.
+        """
+        with self.scheduler.slot(priority, session):
+            loaded = self._activate(model)
+            embedder = self.registry.embedder(loaded)
+            if not hasattr(embedder, "embed"):
+                return None, None
+            start = time.perf_counter()
+            embedding = embedder.embed(text)
+        lookup_start = time.perf_counter()
+        hit = self.semantic_cache.get(embedding, scope)
+        lookup = time.perf_counter() - lookup_start
+        metrics.observe("semantic_cache_embed_seconds", lookup_start - start)
+        metrics.observe("semantic_cache_lookup_seconds", lookup)
+        metrics.increment("semantic_cache_hits_total" if hit else "semantic_cache_misses_total")
+        if hit:
+            self.logger.info(f"Semantic cache hit (similarity {hit[0]:.3f}) in {lookup * 1e6:.0f} us")
+        return embedding, hit
+
+    def _retrieve(self, text: str) -> List[dict]:
+        """Passages of the local documents relevant to a message; none if the index can't be read."""
+        start = time.perf_counter()
+        try:
+            passages = self.retriever.search(text, self.config.get("retrieval_top_k", 3),
+                                             self.config.get("retrieval_min_score", 1.0))
+        except Exception as e:
+            self.logger.error(f"Document retrieval failed: {str(e)}")
+            return []
+        elapsed = time.perf_counter() - start
+        metrics.observe("retrieval_seconds", elapsed)
+        self.logger.info(f"Retrieved {len(passages)} passages in {elapsed * 1000:.1f} ms")
+        return passages
+
+    def _fit_passages(self, passages: List[dict], room: int) -> List[Tuple[str, str]]:
+        """(text, source) of the passages that fit in ``room`` tokens and retrieval_max_tokens, best first.
+
+        The best passage is cut short rather than left out if it is too long on its own.
+        """
+        if not passages:
+            return []
+        budget = min(room, self.config.get("retrieval_max_tokens", 96)) - len(self._tokenize(GROUNDING_HEADER + "\n\n"))
+        notes = []
+        for passage in passages:
+            words = passage["text"].split()
+            size = len(self._tokenize("- " + " ".join(words) + "\n"))
+            while not notes and words and size > budget:
+                words = words[:len(words) * max(budget, 0) // size]
+                size = len(self._tokenize("- " + " ".join(words) + "\n"))
+            if words and size <= budget:
+                notes.append((" ".join(words), f"{passage['path']}:{passage['line']}"))
+                budget -= size
+        return notes
+
+    def _record_cache_hit(self, stats: Optional[dict], start: float):
+        elapsed = time.perf_counter() - start
+        self.logger.debug(f"Response cache hit in {elapsed * 1e6:.0f} us")
+        metrics.increment("cache_hits_total")
+        if stats is not None:
+            stats.update({
+                "cached": True, "prompt_tokens": 0, "reused_tokens": 0, "completion_tokens": 0,
+                "prompt_eval": 0.0, "ttft": elapsed, "elapsed": elapsed, "chunks": 0
+            })
+
+    def clear_history(self):
+        """Forget the conversation so far, once the turn being generated (if any) is recorded."""
+        with self._lock:
+            self.context.clear()
+            self.context.preamble_tokens = []
+            self.prompt_manager.clear_history()
+            self._conversation_changed()
+
+    def resume_session(self, session_id: int) -> List[Tuple[str, str]]:
+        """Continue a stored conversation; its recent turns become the model's context again."""
+        with self._lock:
+            self.context.clear()
+            self.context.preamble_tokens = []
+            turns = self.prompt_manager.load_session(session_id)
+            for i, (user_msg, bot_msg) in enumerate(turns):
+                self.context.add_text_turn(self.prompt_manager.format_exchange(user_msg, bot_msg, first=i == 0))
+            self._conversation_changed()
+        return turns
+
+    def _preamble_tokens(self) -> List[int]:
+        """Tokens of the active model's preamble, including the conversation memory (cached per text)."""
+        return self.active.template_tokens.preamble(self.prompt_manager.format_system())
+
+    def _schedule_compaction(self):
+        """Have the compaction thread look at the conversation once the model is idle."""
+        if not self.config.get("compaction_enabled", True):
+            return
+        if self._compaction_thread is None:
+            self._compaction_thread = threading.Thread(target=self._compaction_loop, name="compaction", daemon=True)
+            self._compaction_thread.start()
+        self._compaction_pending.set()
+
+    def _compaction_loop(self):
+        while True:
+            self._compaction_pending.wait()
+            self._compaction_pending.clear()
+            try:
+                # Never makes a request wait: if the model is busy, try again shortly
+                while not self._compact():
+                    time.sleep(0.05)
+            except Exception as e:
+                self.logger.warning(f"Conversation compaction failed: {str(e)}")
+
+    def _compact(self) -> bool:
+        """Fold old turns between requests so the next message has room.
+
+        Runs after a reply. Once the preamble and the turns kept verbatim
+        leave less than ``compaction_reserve_tokens`` of the prompt budget
+        for the next message, turns are folded as in ``_fold_turns``. The
+        new preamble is tokenized here, so the next request finds
+        everything ready. Returns False if the model was busy.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.model is not None:
+                budget = self.model.context_length - self.config["max_tokens"]
+                self._fold_turns(budget - self.config.get("compaction_reserve_tokens", 64))
+            return True
+        finally:
+            self._lock.release()
+
+    def _fold_turns(self, limit: int, keep: int = 1) -> int:
+        """Fold the oldest turns into the rolling memory once the prompt is over ``limit`` tokens.
+
+        Turns the context already dropped are folded first. Past the limit
+        the oldest turns are folded (keeping at least the last ``keep``)
+        until three quarters of it is used, counting the memory as fitted, so a
+        memory too small for its prefix and one note takes no room. Returns
+        how many turns were folded; the caller holds the model lock.
+        """
+        start = time.perf_counter()
+        memory = self.prompt_manager.memory
+        context = self.context
+        context.tokenize_turns(self._tokenize)
+        recent = self.prompt_manager.recent_history()
+        # Turns the context already dropped to stay within the budget go first
+        dropped = max(len(recent) - len(context.turns), 0)
+        turns = context.turns[len(context.turns) - (len(recent) - dropped):]
+
+        used = len(self._preamble_tokens()) + sum(len(turn) for turn in turns)
+        if used <= limit and not dropped:
+            return 0
+
+        def count_tokens(text: str) -> int:
+            return len(self._tokenize(text))
+
+        for user_msg, bot_msg in recent[:dropped]:
+            memory.fold(user_msg, bot_msg)
+        memory.fit(count_tokens)
+        kept = 0
+        if used > limit:
+            used = len(self._preamble_tokens()) + sum(len(turn) for turn in turns)
+            while kept < len(turns) - keep and used > limit * 3 // 4:
+                memory.fold(*recent[dropped + kept])
+                kept += 1
+                memory.fit(count_tokens)
+                used = len(self._preamble_tokens()) + sum(len(turn) for turn in turns[kept:])
+        folded = dropped + kept
+
+        template = self.active.template
+        if kept and template.first_turn_prefix != template.turn_prefix:
+            # The new first turn needs the first-turn markup (Llama-2 opens it in the preamble)
+            context.turns = [self.prompt_manager.format_exchange(user_msg, bot_msg, first=i == 0)
+                             for i, (user_msg, bot_msg) in enumerate(recent[folded:])]
+        else:
+            context.turns = turns[kept:]
+        context.preamble_tokens = self._preamble_tokens()
+        self._conversation_changed()
+        elapsed = time.perf_counter() - start
+        metrics.increment("compactions_total")
+        metrics.observe("compaction_seconds", elapsed)
+        self.logger.info(
+            f"Folded {folded} turns into the conversation memory in {elapsed * 1000:.1f} ms; "
+            f"{len(context.preamble_tokens)} preamble tokens, {len(context.turns)} turns kept"
+        )
+        return folded
+
+    def _tokenize(self, text: str, bos: bool = False) -> List[int]:
+        """Tokenize text; a BOS token is only added at the very start of a prompt."""
+        return self.model.tokenize(text, add_bos_token=bos and self.model.model_type == "llama")
+
+    def _generate(self, tokens: List[int], stats: Optional[dict] = None,
+                  temperature: Optional[float] = None,
+                  max_tokens: Optional[int] = None,
+                  stop: Optional[List[str]] = None,
+                  output_tokens: Optional[List[int]] = None, trace=NULL_TRACE,
+                  request_id: Optional[int] = None, deadline: Optional[float] = None,
+                  token_budget: Optional[int] = None, slot=None, **sampling_overrides) -> Iterator[str]:
+        """Run the token loop for a prompt, yielding text as it is decoded.
+
+        ``sampling_overrides`` (any of SAMPLING_KEYS) replace the configured
+        sampling settings for this request.
+
+        Tokens the model evaluated for the previous request are reused: only
+        the part of ``tokens`` after the longest common prefix is evaluated.
+        Decoded text goes through an OutputProcessor, which ends generation
+        at the token where a stop sequence or the max_response_chars /
+        max_response_sentences cap is reached. Generated tokens that make
+        it into the response are appended to ``output_tokens`` if given.
+        Prompt evaluation and the token loop are recorded as spans of
+        ``trace``.
+
+        Between prompt slices and between tokens the loop checks whether
+        request ``request_id`` was cancelled or ``deadline`` (a perf_counter
+        value) has passed, and it never evaluates more than ``token_budget``
+        tokens in total. At the same points a request holding a scheduler
+        ``slot`` gives the model to higher priority requests that are
+        waiting; when it gets it back, the tokens it had evaluated are
+        evaluated again (mostly reused, unless the other requests moved the
+        model to a different prompt) and generation carries on.
+        """
+        model = self.model
+        model_name = self.active.name if self.active else None
+        max_tokens = max_tokens if max_tokens is not None else self.config["max_tokens"]
+        temperature = temperature if temperature is not None else self.config["temperature"]
+        stop = stop if stop is not None else self.prompt_manager.template.stop
+        # Unset keys stay None so the backend falls back to its own defaults
+        sampling = {key: self.config.get(key) for key in SAMPLING_KEYS}
+        unknown = set(sampling_overrides) - set(SAMPLING_KEYS)
+        if unknown:
+            raise TypeError(f"Unknown generation parameters: {', '.join(sorted(unknown))}")
+        sampling.update((key, value) for key, value in sampling_overrides.items() if value is not None)
+        sampling["temperature"] = temperature
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+        def interrupted() -> Optional[str]:
+            if request_id is not None and request_id <= self._cancelled_through:
+                return "cancelled"
+            if deadline is not None and time.perf_counter() >= deadline:
+                return "deadline"
+            return None
+
+        def resume(evaluated: List[int]):
+            """Yield the model, then bring its context back to ``evaluated``."""
+            while True:
+                slot.yield_model()
+                self._activate(model_name)
+                restored = self.model.prepare_inputs_for_generation(evaluated, reset=True)
+                for i in range(0, len(restored), PROMPT_EVAL_SLICE):
+                    # Restoring can take as long as a prompt, so it steps aside again if needed
+                    if slot.should_yield():
+                        break
+                    self.model.eval(restored[i:i + PROMPT_EVAL_SLICE])
+                else:
+                    return self.model
+
+        start = time.perf_counter()
+        finish_reason = interrupted()
+        with trace.span("prompt_eval"):
+            suffix = model.prepare_inputs_for_generation(tokens, reset=True)
+            if token_budget is not None and len(suffix) >= token_budget:
+                finish_reason = finish_reason or "budget"
+            reused = len(tokens) - len(suffix)
+            for i in range(0, len(suffix), PROMPT_EVAL_SLICE):
+                if finish_reason:
+                    break
+                if i and slot is not None and slot.should_yield():
+                    model = resume(tokens[:reused + i])
+                model.eval(suffix[i:i + PROMPT_EVAL_SLICE])
+                finish_reason = interrupted()
+        prompt_eval = time.perf_counter() - start
+        self.logger.info(
+            f"Prompt eval: {len(suffix)} new tokens ({len(tokens) - len(suffix)} reused) "
+            f"in {prompt_eval * 1000:.0f} ms"
+        )
+        if token_budget is not None:
+            max_tokens = min(max_tokens, token_budget - len(suffix))
+
+        ttft = None
+        generated = []
+        token_ends = []
+        output = OutputProcessor(stop, max_chars=self.config.get("max_response_chars", 0),
+                                 max_sentences=self.config.get("max_response_sentences", 0))
+
+        # Greedy requests on a backend with batched verification can speculate
+        drafter = None
+        speculation = {"draft_tokens": 0, "accepted_tokens": 0, "forward_passes": 0}
+        if self.config.get("speculative_decoding", False) and temperature == 0 and hasattr(model, "verify"):
+            drafter = PromptLookupDrafter(tokens, max_ngram=self.config.get("speculative_max_ngram", 3))
+        pending = []
+
+        while not finish_reason:
+            if len(generated) >= max_tokens:
+                over_budget = token_budget is not None and len(suffix) + len(generated) >= token_budget
+                finish_reason = "budget" if over_budget else "length"
+                break
+            if not pending:
+                if slot is not None and slot.should_yield():
+                    # Everything but the last generated token has been evaluated
+                    model = resume(tokens + generated[:-1])
+                if drafter is not None and generated:
+                    pending = self._speculate(model, drafter, max_tokens - len(generated) - 1, sampling, speculation)
+                else:
+                    if generated:
+                        model.eval([generated[-1]])
+                    pending = [model.sample(**sampling)]
+                    speculation["forward_passes"] += 1
+            token = pending.pop(0)
+            if model.is_eos_token(token):
+                finish_reason = "eos"
+                break
+            generated.append(token)
+            if drafter is not None:
+                drafter.append(token)
+            chunk = output.feed(decoder.decode(model.detokenize([token], decode=False)))
+            token_ends.append(len(output.text))
+            if chunk:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    self.logger.info(f"Time to first token: {ttft * 1000:.0f} ms")
+                yield chunk
+            # A stop sequence or output cap ends generation at this token
+            finish_reason = output.finish_reason or interrupted()
+
+        tail = output.flush()
+        if tail:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            yield tail
+
+        if output.finish_reason == "stop":
+            # Tokens that are part of the stop sequence don't belong to the reply
+            kept = bisect.bisect_right(token_ends, output.cut)
+        elif output.finish_reason:
+            # The token crossing a length cap was partly shown, so it stays
+            kept = min(bisect.bisect_left(token_ends, output.cut) + 1, len(generated))
+        else:
+            kept = len(generated)
+        if output_tokens is not None:
+            output_tokens.extend(generated[:kept])
+
+        elapsed = time.perf_counter() - start
+        trace.add("generation", elapsed - prompt_eval)
+        self.logger.info(
+            f"Response generated in {elapsed:.2f}s "
+            f"(first token: {ttft * 1000 if ttft is not None else 0:.0f} ms, tokens: {len(generated)}, "
+            f"finish: {finish_reason})"
+        )
+        if finish_reason in INTERRUPTED:
+            metrics.increment(f"{finish_reason}_total")
+        if drafter is not None:
+            drafted = speculation["draft_tokens"]
+            speculation["acceptance_rate"] = speculation["accepted_tokens"] / drafted if drafted else 0.0
+            self.logger.info(
+                f"Speculative decoding: accepted {speculation['accepted_tokens']}/{drafted} draft tokens "
+                f"({speculation['acceptance_rate']:.0%}), {len(generated)} tokens in "
+                f"{speculation['forward_passes']} forward passes"
+            )
+            metrics.increment("speculative_draft_tokens_total", drafted)
+            metrics.increment("speculative_accepted_tokens_total", speculation["accepted_tokens"])
+
+        result = {
+            "prompt_tokens": len(tokens),
+            "reused_tokens": len(tokens) - len(suffix),
+            "completion_tokens": len(generated),
+            "prompt_eval": prompt_eval,
+            "ttft": ttft,
+            "elapsed": elapsed,
+            "chunks": len(generated),
+            "finish_reason": finish_reason
+        }
+        if drafter is not None:
+            result["speculative"] = speculation
+        if slot is not None and slot.yields:
+            result["yields"] = slot.yields
+        metrics.record_generation(result)
+        if stats is not None:
+            stats.update(result)
+
+    def _speculate(self, model, drafter: PromptLookupDrafter, room: int, sampling: dict,
+                   speculation: dict) -> List[int]:
+        """Decide the next tokens with one forward pass, drafting from the context.
+
+        The last generated token and up to ``room`` draft tokens are
+        evaluated in a single batch. Drafts are accepted while they equal
+        the model's own greedy choice, and the model's choice after the last
+        accepted one is kept as well, so the output is token for token what
+        plain greedy decoding would give. Rejected drafts are rolled back
+        out of the model's context.
+        """
+        drafts = drafter.draft(min(self.config.get("speculative_draft_tokens", 8), room))
+        speculation["forward_passes"] += 1
+        if not drafts:
+            model.eval([drafter.tokens[-1]])
+            return [model.sample(**sampling)]
+
+        predictions = model.verify([drafter.tokens[-1]] + drafts)
+        accepted = 0
+        while accepted < len(drafts) and drafts[accepted] == predictions[accepted]:
+            accepted += 1
+        model.rollback(len(drafts) - accepted)
+        speculation["draft_tokens"] += len(drafts)
+        speculation["accepted_tokens"] += accepted
+        return drafts[:accepted] + [predictions[accepted]]
+
+    def is_model_loaded(self) -> bool:
+        """Check if the model is loaded and ready."""
+        return self.model is not None
+
+    def get_model_info(self) -> dict:
+        """Return model configuration and status."""
+        active = self.active.name if self.active else None
+        return {
+            "model": active,
+            "model_path": self.registry.models[active]["path"] if active else self.config.get("model_path"),
+            "model_type": self.config.get("model_type"),
+            "temperature": self.config.get("temperature"),
+            "max_tokens": self.config.get("max_tokens"),
+            "gpu_layers": self.config.get("gpu_layers"),
+            "is_loaded": self.is_model_loaded(),
+            "response_cache": self.response_cache.stats() if self.response_cache else None,
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache else None,
+            "retrieval": self.retriever.stats() if self.retriever else None,
+            "scheduler": self.scheduler.stats(),
+            "gguf": self._safe_inspect(),
+            "startup_timings": dict(self.startup_timings),
+            "resident_models": list(self.registry.resident)
+        }
+
+    def _safe_inspect(self) -> Optional[dict]:
+        try:
+            metadata = self.inspect_model()
+        except Exception as e:
+            self.logger.warning(f"Could not read model header: {str(e)}")
+            return None
+        if metadata is None:
+            return None
+        return {key: value for key, value in metadata.items() if key != "metadata"}
@@ -0,0 +1,91 @@
+"""
+TinyllamaChatbot - Rolling Conversation Memory
+"""
+
+import re
+from typing import Callable, List, Optional
+
+MEMORY_PREFIX = "Earlier in this conversation: "
+
+def condense(text: str, max_words: int) -> str:
+    """The first sentence of ``text``, cut to ``max_words`` words."""
+    text = " ".join(text.split())
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0].rstrip(".!?")
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "..."
+    return sentence
+
+
+class _Note:
+    """One folded turn, condensed further at each level."""
+
+    __slots__ = ("user", "bot", "level", "_texts")
+
+    def __init__(self, user: str, bot: str):
+        self.user = user
+        self.bot = bot
+        self.level = 0
+        self._texts: List[Optional[str]] = [None, None]
+
+    def text(self) -> str:
+        cached = self._texts[self.level]
+        if cached is None:
+            if self.level == 0:
+                cached = f"user: {condense(self.user, 16)} | you: {condense(self.bot, 12)}"
+            else:
+                cached = f"user: {condense(self.user, 8)}"
+            self._texts[self.level] = cached
+        return cached
+
+
+class RollingMemory:
+    """Condensed notes of the turns folded out of the prompt, kept within a token budget.
+
+    Each folded turn becomes a note with the first sentences of the
+    message and the reply. When the notes no longer fit ``max_tokens``,
+    the oldest full note is cut down to the user's message, and once every
+    note is cut down the oldest ones are forgotten; if not even the prefix
+    and one cut-down note fit, the memory stays empty rather than taking
+    room in the prompt for nothing. ``folded`` counts the
+    turns of the conversation history the notes stand for; ``text`` is the
+    memory as last fitted, so it is only rebuilt when turns are folded.
+    """
+
+    def __init__(self, max_tokens: int = 48):
+        self.max_tokens = max_tokens
+        self.notes: List[_Note] = []
+        self.folded = 0
+        self.text = ""
+
+    def fold(self, user_input: str, bot_response: str):
+        """Add the oldest turn still in the prompt."""
+        self.notes.append(_Note(user_input, bot_response))
+        self.folded += 1
+
+    def fit(self, count_tokens: Callable[[str], int]) -> str:
+        """Condense or drop the oldest notes until the memory fits and return its text."""
+        if count_tokens(MEMORY_PREFIX) >= self.max_tokens:
+            self.notes.clear()
+        while self.notes:
+            text = self.render()
+            if count_tokens(text) <= self.max_tokens:
+                self.text = text
+                return text
+            full = next((note for note in self.notes if note.level == 0), None)
+            if full is not None:
+                full.level = 1
+            else:
+                self.notes.pop(0)
+        self.text = ""
+        return self.text
+
+    def render(self) -> str:
+        if not self.notes:
+            return ""
+        return MEMORY_PREFIX + "; ".join(note.text() for note in self.notes) + "."
+
+    def clear(self):
+        self.notes.clear()
+        self.folded = 0
+        self.text = ""
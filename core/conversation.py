@@ -0,0 +1,73 @@
+"""
+TinyllamaChatbot - Token-level Conversation Context
+"""
+
+import logging
+from typing import Callable, List, Optional, Union
+
+class ConversationContext:
+    """Keeps the token sequence of a multi-turn conversation stable between turns.
+
+    Each turn's prompt is built as the previous turn's tokens (including the
+    tokens the model generated) followed by the new turn, so everything the
+    model has already evaluated stays a prefix and only the suffix has to be
+    evaluated. When the conversation no longer fits the token budget the
+    oldest turns are dropped in one go, down to half the budget, so the
+    prefix only changes once in a while instead of on every turn.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.preamble_tokens: List[int] = []
+        self.turns: List[Union[List[int], str]] = []
+
+    def build(self, turn_tokens: List[int], budget: int,
+              tokenize: Optional[Callable[[str], List[int]]] = None) -> List[int]:
+        """Return the tokens to feed the model for a new turn within ``budget`` tokens.
+
+        Turns recorded as text are tokenized with ``tokenize`` first.
+        """
+        if tokenize is not None:
+            self.tokenize_turns(tokenize)
+
+        history = sum(len(turn) for turn in self.turns)
+        total = len(self.preamble_tokens) + history + len(turn_tokens)
+
+        if total > budget:
+            target = budget // 2
+            dropped = 0
+            while self.turns and total > target:
+                total -= len(self.turns.pop(0))
+                dropped += 1
+            self.logger.info(f"Conversation exceeds {budget} tokens, dropped {dropped} oldest turns")
+
+            # A single oversized turn keeps its most recent tokens
+            room = budget - len(self.preamble_tokens)
+            if len(turn_tokens) > room:
+                turn_tokens = turn_tokens[-room:] if room > 0 else []
+
+        tokens = list(self.preamble_tokens)
+        for turn in self.turns:
+            tokens.extend(turn)
+        tokens.extend(turn_tokens)
+        return tokens
+
+    def tokenize_turns(self, tokenize: Callable[[str], List[int]]):
+        """Tokenize the turns recorded as text."""
+        self.turns = [tokenize(turn) if isinstance(turn, str) else turn for turn in self.turns]
+
+    def add_turn(self, tokens: List[int]):
+        """Record the full token sequence of a finished turn (prompt and response)."""
+        self.turns.append(tokens)
+
+    def add_text_turn(self, text: str):
+        """Record a finished turn the model never saw (e.g. a cached reply) as text.
+
+        It is tokenized lazily on the next ``build``, so recording it does
+        not touch the model.
+        """
+        self.turns.append(text)
+
+    def clear(self):
+        """Forget all turns; the preamble is kept."""
+        self.turns.clear()
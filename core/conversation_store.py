@@ -0,0 +1,230 @@
+"""
+TinyllamaChatbot - Persistent Conversation Store
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+# Rows fetched per round trip when streaming an export
+EXPORT_FETCH_SIZE = 500
+
+class ConversationStore:
+    """SQLite store of chat sessions and their messages.
+
+    The database runs in WAL mode, so the GUI can page through history
+    while replies are being written. Messages are indexed by
+    (session_id, id) and sessions by (updated, id) for keyset paging, which
+    costs the same on the first page and the millionth; each session keeps
+    its message count so listing never counts rows. Where SQLite has FTS5, an external-content
+    full-text index kept in sync by triggers backs ``search``. Otherwise
+    search falls back to a LIKE scan.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+        """)
+        self._migrate()
+        self.fts = self._create_fts()
+        self._db.commit()
+
+    def _migrate(self):
+        """Bring a database created by an older version up to the current schema."""
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        if "message_count" not in columns:
+            self._db.execute("ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE sessions SET message_count = "
+                             "(SELECT COUNT(*) FROM messages m WHERE m.session_id = sessions.id)")
+
+    def _create_fts(self) -> bool:
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                    USING fts5 (content, content='messages', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError as e:
+            self.logger.warning(f"FTS5 unavailable, falling back to LIKE search: {str(e)}")
+            return False
+
+    def create_session(self, title: str = "") -> int:
+        """Start a new session and return its id."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO sessions (title, created, updated) VALUES (?, ?, ?)",
+                (title or time.strftime("Chat %Y-%m-%d %H:%M"), now, now)
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def add_turn(self, session_id: int, user_input: str, bot_response: str):
+        """Append a user message and the reply to a session in one transaction."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO messages (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                [(session_id, "user", user_input, now), (session_id, "assistant", bot_response, now)]
+            )
+            self._db.execute("UPDATE sessions SET updated = ?, message_count = message_count + 2 WHERE id = ?",
+                             (now, session_id))
+            self._db.commit()
+
+    def list_sessions(self, limit: int = 50, before: Optional[Tuple[float, int]] = None) -> List[dict]:
+        """Return up to ``limit`` sessions, most recently updated first.
+
+        Pass the ``(updated, id)`` of the last session of a page as
+        ``before`` to get the next page; the id keeps sessions updated in
+        the same instant from being skipped.
+        """
+        # The index on updated ends in the rowid, so it serves (updated, id) order as is
+        query = "SELECT id, title, created, updated, message_count AS messages FROM sessions "
+        params = []
+        if before is not None:
+            query += "WHERE (updated, id) < (?, ?) "
+            params.extend(before)
+        query += "ORDER BY updated DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, params)]
+
+    def get_messages(self, session_id: int, limit: int = 50, before_id: Optional[int] = None) -> List[dict]:
+        """Return the ``limit`` messages of a session that precede ``before_id``, oldest first.
+
+        Without ``before_id`` this is the latest page; pass the id of the
+        first message returned to load the page before it.
+        """
+        query = "SELECT id, session_id, role, content, created FROM messages WHERE session_id = ? "
+        params = [session_id]
+        if before_id is not None:
+            query += "AND id < ? "
+            params.append(before_id)
+        query += "ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = [dict(row) for row in self._db.execute(query, params)]
+        rows.reverse()
+        return rows
+
+    def search(self, text: str, limit: int = 50, offset: int = 0) -> List[dict]:
+        """Full-text search over all messages, best matches first."""
+        if not text.strip():
+            return []
+        with self._lock:
+            if self.fts:
+                # Quote every term so user input is never parsed as FTS syntax
+                match = " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+                cursor = self._db.execute(
+                    "SELECT m.id, m.session_id, m.role, m.created, s.title, "
+                    "snippet(messages_fts, 0, '[', ']', '...', 12) AS snippet "
+                    "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                    "JOIN sessions s ON s.id = m.session_id "
+                    "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                    (match, limit, offset)
+                )
+            else:
+                cursor = self._db.execute(
+                    "SELECT m.id, m.session_id, m.role, m.created, s.title, substr(m.content, 1, 120) AS snippet "
+                    "FROM messages m JOIN sessions s ON s.id = m.session_id "
+                    "WHERE m.content LIKE ? ORDER BY m.id DESC LIMIT ? OFFSET ?",
+                    (f"%{text}%", limit, offset)
+                )
+            return [dict(row) for row in cursor]
+
+    def delete_session(self, session_id: int):
+        """Delete a session and all of its messages."""
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+
+    def export(self, filename: str, session_id: Optional[int] = None, fmt: Optional[str] = None) -> int:
+        """Stream messages to a JSON or JSONL file and return how many were written.
+
+        Rows are read from a dedicated connection in batches of
+        EXPORT_FETCH_SIZE and written out as they arrive, so exporting
+        millions of messages never holds them all in memory. The format
+        follows the file extension unless ``fmt`` is given.
+        """
+        fmt = fmt or ("jsonl" if filename.lower().endswith(".jsonl") else "json")
+        query = ("SELECT m.id, m.session_id, s.title, m.role, m.content, m.created "
+                 "FROM messages m JOIN sessions s ON s.id = m.session_id ")
+        params = []
+        if session_id is not None:
+            query += "WHERE m.session_id = ? "
+            params.append(session_id)
+        query += "ORDER BY m.session_id, m.id"
+
+        # A separate connection keeps the export out of the writers' lock
+        db = self._db if self.path == ":memory:" else sqlite3.connect(self.path)
+        count = 0
+        try:
+            cursor = db.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            with open(filename, 'w', encoding='utf-8') as f:
+                if fmt == "json":
+                    f.write('{"exported": %s, "messages": [' % json.dumps(time.strftime("%Y-%m-%dT%H:%M:%S")))
+                while True:
+                    rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                    if not rows:
+                        break
+                    for row in rows:
+                        record = json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+                        if fmt == "json":
+                            f.write(("," if count else "") + "\n  " + record)
+                        else:
+                            f.write(record + "\n")
+                        count += 1
+                if fmt == "json":
+                    f.write("\n]}\n")
+        finally:
+            if db is not self._db:
+                db.close()
+        return count
+
+    def stats(self) -> dict:
+        """Return session and message counts."""
+        with self._lock:
+            sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {"sessions": sessions, "messages": messages, "full_text_search": self.fts}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,126 @@
+"""
+TinyllamaChatbot - Deterministic Fake Model Backend
+"""
+
+import re
+import math
+import time
+import zlib
+from typing import List, Optional, Sequence, Union
+
+FAKE_REPLY = "This is a deterministic reply from the fake backend, used for benchmarks and tests. "
+EMBEDDING_DIM = 256
+
+class FakeModel:
+    """Stand-in for a ctransformers LLM that needs no model file.
+
+    Implements the subset of the ctransformers API the chatbot uses
+    (tokenize/detokenize, eval, sample, prepare_inputs_for_generation) with
+    a byte-level tokenizer and a fixed reply, and sleeps a configurable
+    time per evaluated and generated token so scheduling, caching and
+    streaming overhead can be measured on any machine.
+
+    It also implements ``verify`` and ``rollback``, the batched
+    verification that speculative decoding needs and ctransformers lacks
+    (it only exposes the logits of the last position), and ``embed``,
+    which hashes character trigrams so that paraphrases get similar
+    vectors.
+    """
+
+    model_type = "fake"
+    eos_token_id = 2
+    bos_token_id = 1
+
+    def __init__(self, context_length: int = 2048, token_delay: float = 0.0,
+                 prompt_token_delay: float = 0.0, load_delay: float = 0.0,
+                 reply: str = FAKE_REPLY, reply_tokens: Optional[int] = None):
+        self.context_length = context_length
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.reply = reply.encode('utf-8')
+        self.reply_tokens = reply_tokens
+        self._context: List[int] = []
+        self._n_generated = 0
+        if load_delay:
+            time.sleep(load_delay)
+
+    def tokenize(self, text: str, add_bos_token: Optional[bool] = None) -> List[int]:
+        """Map each UTF-8 byte to a token; ids 0-2 are reserved for pad/BOS/EOS."""
+        tokens = [self.bos_token_id] if add_bos_token else []
+        tokens.extend(byte + 3 for byte in text.encode('utf-8'))
+        return tokens
+
+    def detokenize(self, tokens: Union[int, Sequence[int]], decode: bool = True) -> Union[str, bytes]:
+        if isinstance(tokens, int):
+            tokens = [tokens]
+        data = bytes(token - 3 for token in tokens if token > 2)
+        return data.decode('utf-8', errors='ignore') if decode else data
+
+    def is_eos_token(self, token: int) -> bool:
+        return token == self.eos_token_id
+
+    def prepare_inputs_for_generation(self, tokens: Sequence[int], reset: Optional[bool] = None) -> Sequence[int]:
+        """Keep the longest already evaluated prefix, like ctransformers does."""
+        self._n_generated = 0
+        n = min(len(tokens) - 1, len(self._context))
+        common = 0
+        while common < n and tokens[common] == self._context[common]:
+            common += 1
+        self._context = self._context[:common]
+        return tokens[common:]
+
+    def eval(self, tokens: Sequence[int], batch_size: Optional[int] = None, threads: Optional[int] = None):
+        if self.prompt_token_delay and len(tokens) > 1:
+            time.sleep(self.prompt_token_delay * len(tokens))
+        self._context.extend(tokens)
+
+    def sample(self, **kwargs) -> int:
+        """Return the next byte of the fixed reply, or EOS after ``reply_tokens`` tokens."""
+        if self.token_delay:
+            time.sleep(self.token_delay)
+        if self.reply_tokens is not None and self._n_generated >= self.reply_tokens:
+            return self.eos_token_id
+        token = self.reply[self._n_generated % len(self.reply)] + 3
+        self._n_generated += 1
+        return token
+
+    def verify(self, tokens: Sequence[int]) -> List[int]:
+        """Evaluate ``tokens`` in one batch and return the greedy next token after each of them.
+
+        Costs one generated token's delay plus the prompt delay for the
+        rest of the batch, like a real batched forward pass.
+        """
+        if self.token_delay or self.prompt_token_delay:
+            time.sleep(self.token_delay + self.prompt_token_delay * (len(tokens) - 1))
+        self._context.extend(tokens)
+        predictions = []
+        for _ in tokens:
+            if self.reply_tokens is not None and self._n_generated >= self.reply_tokens:
+                predictions.append(self.eos_token_id)
+            else:
+                predictions.append(self.reply[self._n_generated % len(self.reply)] + 3)
+            self._n_generated += 1
+        return predictions
+
+    def rollback(self, count: int):
+        """Forget the last ``count`` evaluated tokens, e.g. rejected draft tokens."""
+        if count > 0:
+            del self._context[-count:]
+            self._n_generated -= count
+
+    def reset(self):
+        self._context.clear()
+        self._n_generated = 0
+
+    def embed(self, input: Union[str, Sequence[int]], batch_size: Optional[int] = None,
+              threads: Optional[int] = None) -> List[float]:
+        """Evaluate the input like ctransformers does and return a unit vector of its trigrams."""
+        tokens = self.tokenize(input) if isinstance(input, str) else list(input)
+        self.reset()
+        self.eval(tokens)
+        text = " " + " ".join(re.findall(r"[a-z0-9]+", self.detokenize(tokens).lower())) + " "
+        vector = [0.0] * EMBEDDING_DIM
+        for i in range(len(text) - 2):
+            vector[zlib.crc32(text[i:i + 3].encode('utf-8')) % EMBEDDING_DIM] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
@@ -0,0 +1,135 @@
+"""
+TinyllamaChatbot - GGUF Header Inspection
+"""
+
+import struct
+from typing import BinaryIO, Optional
+
+GGUF_MAGIC = b"GGUF"
+
+# Metadata value types from the GGUF spec
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+_SCALARS = {
+    _UINT8: "<B", _INT8: "<b", _UINT16: "<H", _INT16: "<h", _UINT32: "<I", _INT32: "<i",
+    _FLOAT32: "<f", _BOOL: "<?", _UINT64: "<Q", _INT64: "<q", _FLOAT64: "<d"
+}
+
+# general.file_type values (llama_ftype)
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K"
+}
+
+# Arrays longer than this (tokenizer vocabularies, merges) are skipped, not stored
+MAX_ARRAY_ITEMS = 64
+
+class GGUFError(ValueError):
+    """Raised when a file is not a readable GGUF model."""
+
+
+class _Reader:
+    def __init__(self, f: BinaryIO, version: int):
+        self.f = f
+        # GGUF v1 used 32-bit counts and string lengths
+        self.count_format = "<I" if version == 1 else "<Q"
+
+    def unpack(self, fmt: str):
+        size = struct.calcsize(fmt)
+        data = self.f.read(size)
+        if len(data) != size:
+            raise GGUFError("Unexpected end of file in GGUF header")
+        return struct.unpack(fmt, data)[0]
+
+    def count(self) -> int:
+        return self.unpack(self.count_format)
+
+    def string(self) -> str:
+        length = self.count()
+        data = self.f.read(length)
+        if len(data) != length:
+            raise GGUFError("Unexpected end of file in GGUF header")
+        return data.decode("utf-8", errors="replace")
+
+    def skip_string(self):
+        self.f.seek(self.count(), 1)
+
+    def value(self, value_type: int):
+        if value_type in _SCALARS:
+            return self.unpack(_SCALARS[value_type])
+        if value_type == _STRING:
+            return self.string()
+        if value_type == _ARRAY:
+            item_type = self.unpack("<I")
+            length = self.count()
+            if length <= MAX_ARRAY_ITEMS:
+                return [self.value(item_type) for _ in range(length)]
+            self.skip_array(item_type, length)
+            return None
+        raise GGUFError(f"Unknown GGUF metadata type {value_type}")
+
+    def skip_array(self, item_type: int, length: int):
+        if item_type in _SCALARS:
+            self.f.seek(struct.calcsize(_SCALARS[item_type]) * length, 1)
+        elif item_type == _STRING:
+            for _ in range(length):
+                self.skip_string()
+        else:
+            for _ in range(length):
+                self.value(item_type)
+
+
+def read_gguf_metadata(path: str) -> dict:
+    """Read the header and metadata of a GGUF file without touching the tensor data.
+
+    Returns the format version, tensor count, the raw metadata key/values
+    (large arrays such as the vocabulary are left out) and a few derived
+    fields: architecture, name, context length and quantization.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != GGUF_MAGIC:
+                raise GGUFError(f"Not a GGUF file: {path}")
+            version = struct.unpack("<I", f.read(4))[0]
+            if version not in (1, 2, 3):
+                raise GGUFError(f"Unsupported GGUF version {version}")
+
+            reader = _Reader(f, version)
+            tensor_count = reader.count()
+            kv_count = reader.count()
+            metadata = {}
+            for _ in range(kv_count):
+                key = reader.string()
+                value = reader.value(reader.unpack("<I"))
+                if value is not None:
+                    metadata[key] = value
+    except (OSError, struct.error) as e:
+        raise GGUFError(f"Could not read GGUF header: {str(e)}")
+
+    architecture = metadata.get("general.architecture")
+    file_type = metadata.get("general.file_type")
+    return {
+        "version": version,
+        "tensor_count": tensor_count,
+        "architecture": architecture,
+        "name": metadata.get("general.name"),
+        "context_length": metadata.get(f"{architecture}.context_length"),
+        "quantization": FILE_TYPES.get(file_type, str(file_type) if file_type is not None else None),
+        "metadata": metadata
+    }
+
+
+def is_gguf(path: str) -> bool:
+    """Check the magic bytes of a file."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == GGUF_MAGIC
+    except OSError:
+        return False
+
+
+def inspect_model(path: str) -> Optional[dict]:
+    """Return GGUF metadata for a model file, or None if it is not a GGUF file."""
+    if not is_gguf(path):
+        return None
+    return read_gguf_metadata(path)
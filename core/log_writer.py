@@ -0,0 +1,161 @@
+"""
+TinyllamaChatbot - Asynchronous Buffered Log Writer
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import weakref
+
+_writers = weakref.WeakSet()
+
+class AsyncLogWriter:
+    """Appends lines to a file from a background thread.
+
+    ``write`` only enqueues, so callers on the generation path never touch
+    the disk. The writer thread drains the queue in batches, writes each
+    batch with a single call, flushes at least every ``flush_interval``
+    seconds and optionally fsyncs after every flush. The file is rotated to
+    ``<path>.1`` ... ``<path>.<backup_count>`` when it would grow past
+    ``max_bytes`` or has been open longer than ``rotate_interval`` seconds.
+    Every writer still open at interpreter exit is drained and closed.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 rotate_interval: float = 0, flush_interval: float = 1.0, fsync: bool = False,
+                 batch_size: int = 256, queue_size: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+
+        # A full queue blocks the caller instead of dropping records
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._opened_at = 0.0
+        self._closed = False
+        self.written = 0
+        self.rotations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        _writers.add(self)
+
+    def write(self, text: str):
+        """Queue text to be appended to the log."""
+        if self._closed:
+            raise RuntimeError("Log writer is closed")
+        self._queue.put(text)
+
+    def flush(self):
+        """Block until everything queued so far is written and flushed."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = False
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+
+            waiters = []
+            batch = []
+            while item is not False:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write_batch("".join(batch))
+                    pending = True
+                now = time.monotonic()
+                if pending and (waiters or not running or now - last_flush >= self.flush_interval):
+                    self._flush()
+                    pending = False
+                    last_flush = now
+            except OSError as e:
+                self.logger.error(f"Failed to write to {self.path}: {str(e)}")
+            for waiter in waiters:
+                waiter.set()
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _write_batch(self, data: str):
+        encoded = data.encode("utf-8")
+        if self._file is None:
+            self._open()
+        if self._should_rotate(len(encoded)):
+            self._rotate()
+        self._file.write(encoded)
+        self.written += len(encoded)
+
+    def _flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._opened_at = time.time()
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self.max_bytes and self._file.tell() and self._file.tell() + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        self._flush()
+        self._file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+
+def _close_all():
+    for writer in list(_writers):
+        writer.close()
+
+
+atexit.register(_close_all)
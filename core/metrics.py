@@ -0,0 +1,239 @@
+"""
+TinyllamaChatbot - Request Tracing and Metrics
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional
+
+# Upper bounds (seconds) for latency histograms; rates use their own buckets
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+RATE_BUCKETS = [1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500, 1000]
+TOKEN_BUCKETS = [1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus-style cumulative export."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99)
+        }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullTrace:
+    """Trace used while metrics are disabled; every operation is a no-op."""
+
+    def span(self, name: str) -> _NullSpan:
+        return NULL_SPAN
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def finish(self, error: bool = False):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+NULL_TRACE = _NullTrace()
+
+
+class _Span:
+    def __init__(self, trace: "RequestTrace", name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.trace.add(self.name, elapsed)
+        return False
+
+
+class RequestTrace:
+    """Span durations of one request through the generation pipeline."""
+
+    def __init__(self, registry: "MetricsRegistry", kind: str):
+        self.registry = registry
+        self.kind = kind
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add(self, name: str, seconds: float):
+        """Add time measured elsewhere to a span."""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def finish(self, error: bool = False):
+        self.registry._finish_trace(self, time.perf_counter() - self.start, error)
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges, histograms and recent request traces.
+
+    When disabled, ``trace()`` hands out a shared no-op trace and the
+    record methods return immediately, so instrumentation left in the hot
+    path costs a function call and an attribute check.
+    """
+
+    def __init__(self, enabled: bool = True, recent_traces: int = 50):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._recent = deque(maxlen=recent_traces)
+        self._started = time.time()
+
+    def trace(self, kind: str = "request"):
+        """Start tracing a request; call ``finish()`` on the result when it is done."""
+        if not self.enabled:
+            return NULL_TRACE
+        return RequestTrace(self, kind)
+
+    def increment(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        """Record the current value of something that goes up and down, like a queue length."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: Optional[List[float]] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets or LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    def record_generation(self, stats: dict):
+        """Record token counts, TTFT and throughput from a generation's stats dict."""
+        if not self.enabled:
+            return
+        tokens_out = stats.get("completion_tokens", 0)
+        self.increment("tokens_in_total", stats.get("prompt_tokens", 0))
+        self.increment("tokens_out_total", tokens_out)
+        self.increment("tokens_reused_total", stats.get("reused_tokens", 0))
+        self.observe("prompt_tokens", stats.get("prompt_tokens", 0), TOKEN_BUCKETS)
+        self.observe("completion_tokens", tokens_out, TOKEN_BUCKETS)
+        if stats.get("ttft") is not None:
+            self.observe("ttft_seconds", stats["ttft"])
+        decode_time = stats.get("elapsed", 0.0) - (stats.get("ttft") or 0.0)
+        if tokens_out > 1 and decode_time > 0:
+            self.observe("tokens_per_second", (tokens_out - 1) / decode_time, RATE_BUCKETS)
+
+    def _finish_trace(self, trace: RequestTrace, elapsed: float, error: bool):
+        with self._lock:
+            for name, duration in trace.spans.items():
+                histogram = self._histograms.get(f"span_{name}_seconds")
+                if histogram is None:
+                    histogram = self._histograms[f"span_{name}_seconds"] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(duration)
+            self._recent.append({
+                "kind": trace.kind,
+                "started": trace.started,
+                "elapsed": elapsed,
+                "error": error,
+                "spans": dict(trace.spans)
+            })
+        self.increment(f"{trace.kind}s_total")
+        self.observe(f"{trace.kind}_seconds", elapsed)
+        if error:
+            self.increment("errors_total")
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._recent.clear()
+            self._started = time.time()
+
+    def snapshot(self) -> dict:
+        """Return all metrics as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "uptime": time.time() - self._started,
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {name: h.snapshot() for name, h in self._histograms.items()},
+                "recent_traces": list(self._recent)
+            }
+
+    def prometheus(self, prefix: str = "tinyllama") -> str:
+        """Return all counters, gauges and histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                lines.append(f"{prefix}_{name} {value}")
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"{prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,347 @@
+"""
+TinyllamaChatbot - Model Registry and Resident Model Cache
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from .conversation import ConversationContext
+from .fake_model import FakeModel
+from .gguf import GGUFError, inspect_model
+from .metrics import metrics
+from .templates import PromptTemplate, TemplateTokens, detect_template, get_template
+from .utils import total_memory_mb
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..')
+FAKE_MODEL = "fake"
+
+class LoadedModel:
+    """A model resident in memory, with the conversation context evaluated on it."""
+
+    __slots__ = ("name", "model", "context", "identity", "metadata", "memory_mb", "timings", "synced",
+                 "template", "template_tokens", "embedder")
+
+    def __init__(self, name: str, model, identity: str, metadata: Optional[dict], memory_mb: float,
+                 timings: dict, template: PromptTemplate):
+        self.name = name
+        self.model = model
+        self.context = ConversationContext()
+        self.identity = identity
+        self.metadata = metadata
+        self.memory_mb = memory_mb
+        self.timings = timings
+        # Conversation version this model's context was last brought up to date with
+        self.synced = -1
+        self.template = template
+        # Filled in by the chatbot the first time the model is active
+        self.template_tokens: Optional[TemplateTokens] = None
+        # Second instance that embeds messages for the semantic cache, loaded on first use
+        self.embedder = None
+
+
+class ModelRegistry:
+    """Catalog of the GGUF models in ``model_dir`` and an LRU cache of loaded ones.
+
+    ``scan`` reads the header of every .gguf file (no weights are touched),
+    plus the configured ``model_path`` if it lives elsewhere. ``get`` returns
+    a resident model at once and otherwise loads it, first evicting least
+    recently used models until the estimate for the new one fits
+    ``model_memory_budget_mb`` (0 means half the RAM). The active model is
+    never evicted. Every switch is counted, and the model most often
+    switched to next from the new one is preloaded in the background when
+    it fits without evicting anything.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self.model_dir = config.get("model_dir") or os.path.join(PROJECT_ROOT, 'model')
+        budget = config.get("model_memory_budget_mb", 0)
+        if not budget and total_memory_mb():
+            budget = total_memory_mb() / 2
+        self.budget_mb = budget or None
+        self.models: Dict[str, dict] = {}
+        self.resident: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self.active: Optional[str] = None
+        self._loading: Dict[str, threading.Event] = {}
+        self._transitions: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def scan(self) -> List[dict]:
+        """Re-read the model directory and return the available models."""
+        models = {}
+        if self.config.get("backend") == "fake":
+            models[FAKE_MODEL] = {"name": FAKE_MODEL, "path": None, "size": 0, "metadata": None}
+
+        paths = []
+        if os.path.isdir(self.model_dir):
+            paths = [os.path.join(self.model_dir, name) for name in sorted(os.listdir(self.model_dir))
+                     if name.lower().endswith(".gguf")]
+        configured = self.config.get("model_path")
+        if configured and os.path.isfile(configured) and os.path.abspath(configured) not in map(os.path.abspath, paths):
+            paths.insert(0, configured)
+
+        for path in paths:
+            try:
+                metadata = inspect_model(path)
+            except (GGUFError, OSError) as e:
+                self.logger.warning(f"Skipping unreadable model {path}: {str(e)}")
+                continue
+            if metadata is None:
+                continue
+            name = os.path.splitext(os.path.basename(path))[0]
+            models[name] = {"name": name, "path": path, "size": os.path.getsize(path), "metadata": metadata}
+
+        with self._lock:
+            self.models = models
+        self.logger.info(f"Found {len(models)} models: {', '.join(models) or 'none'}")
+        return self.list()
+
+    def list(self) -> List[dict]:
+        """Describe every known model and whether it is resident or active."""
+        with self._lock:
+            entries = list(self.models.values())
+            resident = set(self.resident)
+        result = []
+        for entry in entries:
+            metadata = entry["metadata"] or {}
+            result.append({
+                "name": entry["name"],
+                "path": entry["path"],
+                "size": entry["size"],
+                "architecture": metadata.get("architecture"),
+                "quantization": metadata.get("quantization"),
+                "context_length": metadata.get("context_length"),
+                "template": self.template(entry["name"]).name,
+                "estimated_memory_mb": round(self.estimate_memory_mb(entry["name"]), 1),
+                "resident": entry["name"] in resident,
+                "active": entry["name"] == self.active
+            })
+        return result
+
+    def default_name(self) -> Optional[str]:
+        """The model to start with: the configured one, else the first found."""
+        if self.config.get("backend") == "fake":
+            return FAKE_MODEL
+        configured = self.config.get("model_path")
+        for name, entry in self.models.items():
+            if configured and os.path.abspath(entry["path"]) == os.path.abspath(configured):
+                return name
+        return next(iter(self.models), None)
+
+    def template(self, name: Optional[str] = None) -> PromptTemplate:
+        """The prompt template for a model (the active one by default).
+
+        ``prompt_templates`` maps model names to templates and
+        ``prompt_template`` sets one for all models; "auto" detects it from
+        the GGUF header and file name.
+        """
+        if not self.models:
+            self.scan()
+        name = name or self.active or self.default_name()
+        configured = self.config.get("prompt_templates", {}).get(name) or self.config.get("prompt_template", "auto")
+        if configured != "auto":
+            return get_template(configured)
+        entry = self.models.get(name)
+        return detect_template(name or "", entry["metadata"] if entry else None)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    def identity(self, name: str) -> str:
+        """A string that changes whenever the model file does; part of response cache keys."""
+        entry = self._entry(name)
+        if entry["path"] is None:
+            return FAKE_MODEL
+        stat = os.stat(entry["path"])
+        return f"{os.path.abspath(entry['path'])}:{stat.st_size}:{stat.st_mtime}"
+
+    def estimate_memory_mb(self, name: str) -> float:
+        """Weights plus an f16 KV cache for the configured context length."""
+        entry = self._entry(name)
+        metadata = entry["metadata"] or {}
+        raw = metadata.get("metadata", {})
+        arch = metadata.get("architecture")
+        kv_bytes = 0
+        if arch:
+            layers = raw.get(f"{arch}.block_count", 0)
+            embedding = raw.get(f"{arch}.embedding_length", 0)
+            heads = raw.get(f"{arch}.attention.head_count") or 1
+            kv_heads = raw.get(f"{arch}.attention.head_count_kv") or heads
+            context = self.config.get("context_length") or metadata.get("context_length") or 2048
+            kv_bytes = 2 * layers * context * embedding * kv_heads / heads * 2
+        return (entry["size"] + kv_bytes) / (1024 * 1024)
+
+    def get(self, name: str) -> LoadedModel:
+        """Return model ``name``, loading it (and evicting others) if it isn't resident."""
+        with self._lock:
+            loaded = self.resident.get(name)
+            if loaded is not None:
+                self.resident.move_to_end(name)
+                return loaded
+            self._entry(name)
+            event = self._loading.get(name)
+            owner = event is None
+            if owner:
+                event = self._loading[name] = threading.Event()
+
+        if not owner:
+            # Someone else (e.g. a preload) is already loading it
+            event.wait()
+            with self._lock:
+                if name not in self.resident:
+                    raise RuntimeError(f"Failed to load model {name}")
+                self.resident.move_to_end(name)
+                return self.resident[name]
+
+        try:
+            memory_mb = self.estimate_memory_mb(name)
+            with self._lock:
+                self._make_room(memory_mb)
+            loaded = self._load(name, memory_mb)
+            with self._lock:
+                self.resident[name] = loaded
+            return loaded
+        finally:
+            with self._lock:
+                del self._loading[name]
+            event.set()
+
+    def activated(self, name: str, previous: Optional[str] = None):
+        """Record a switch to ``name`` and preload the model likely to be needed next."""
+        with self._lock:
+            self.active = name
+            if previous and previous != name:
+                self._transitions.setdefault(previous, Counter())[name] += 1
+            followers = self._transitions.get(name)
+            likely = followers.most_common(1)[0][0] if followers else None
+        if likely:
+            self.preload(likely)
+
+    def preload(self, name: str, evict: bool = False) -> bool:
+        """Load a model in the background; without ``evict`` only if it fits as is."""
+        with self._lock:
+            if name not in self.models or name in self.resident or name in self._loading:
+                return False
+            if not evict and not self._fits(self.estimate_memory_mb(name)):
+                return False
+
+        def load():
+            try:
+                self.get(name)
+                metrics.increment("model_preloads_total")
+            except Exception as e:
+                self.logger.warning(f"Preloading {name} failed: {str(e)}")
+
+        threading.Thread(target=load, name=f"preload-{name}", daemon=True).start()
+        return True
+
+    def evict(self, name: str) -> bool:
+        """Drop a resident model (not the active one); its memory is freed once unused."""
+        with self._lock:
+            if name == self.active or name not in self.resident:
+                return False
+            self._evict(name)
+            return True
+
+    def _entry(self, name: str) -> dict:
+        entry = self.models.get(name)
+        if entry is None:
+            raise ValueError(f"Unknown model: {name}")
+        return entry
+
+    def _used_mb(self) -> float:
+        return sum(loaded.memory_mb for loaded in self.resident.values())
+
+    def _fits(self, memory_mb: float) -> bool:
+        return self.budget_mb is None or self._used_mb() + memory_mb <= self.budget_mb
+
+    def _make_room(self, memory_mb: float):
+        """Evict least recently used models until ``memory_mb`` more fits (caller holds the lock)."""
+        for name in list(self.resident):
+            if self._fits(memory_mb):
+                return
+            if name != self.active:
+                self._evict(name)
+        if not self._fits(memory_mb):
+            self.logger.warning(f"Model needs {memory_mb:.0f} MB, over the {self.budget_mb:.0f} MB budget")
+
+    def _evict(self, name: str):
+        loaded = self.resident.pop(name)
+        self.logger.info(f"Evicting model {name} ({loaded.memory_mb:.0f} MB)")
+        metrics.increment("model_evictions_total")
+
+    def embedder(self, loaded: LoadedModel):
+        """A second instance of a resident model, for embedding without resetting its evaluated context.
+
+        The weights are memory-mapped, so it shares their pages with the
+        first instance and only adds its own context (KV cache) to memory.
+        """
+        if loaded.embedder is None:
+            start = time.perf_counter()
+            loaded.embedder, _ = self._open(self._entry(loaded.name), {})
+            self.logger.info(f"Loaded an embedding instance of {loaded.name} in "
+                             f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        return loaded.embedder
+
+    def _load(self, name: str, memory_mb: float) -> LoadedModel:
+        """Load a model's weights; each phase is timed."""
+        entry = self._entry(name)
+        timings = {}
+        model, identity = self._open(entry, timings)
+        metrics.increment("model_loads_total")
+        metrics.observe("model_load_seconds", sum(timings.values()))
+        template = self.template(name)
+        self.logger.info(f"Using the {template.name} prompt template for {name}")
+        return LoadedModel(name, model, identity, entry["metadata"], memory_mb, timings, template)
+
+    def _open(self, entry: dict, timings: dict):
+        """Create a model instance for a catalog entry; returns (model, identity) and fills ``timings``."""
+        name = entry["name"]
+        config = self.config
+        start = time.perf_counter()
+
+        if entry["path"] is None or config.get("backend") == "fake":
+            self.logger.info(f"Loading fake model backend for {name}")
+            model = FakeModel(
+                context_length=config.get("context_length", 2048),
+                token_delay=config.get("fake_token_delay", 0.0),
+                prompt_token_delay=config.get("fake_prompt_token_delay", 0.0),
+                load_delay=config.get("fake_load_delay", 0.0)
+            )
+            timings["load_weights"] = time.perf_counter() - start
+            identity = FAKE_MODEL if entry["path"] is None else f"{FAKE_MODEL}:{name}"
+        else:
+            metadata = entry["metadata"]
+            self.logger.info(
+                f"GGUF v{metadata['version']}: {metadata['architecture']}, {metadata['quantization']}, "
+                f"{metadata['tensor_count']} tensors, trained context {metadata['context_length']}"
+            )
+            # Imported lazily: loading the native library is a large part of cold start
+            from ctransformers import AutoModelForCausalLM
+            timings["import_backend"] = time.perf_counter() - start
+
+            configured = config.get("model_path")
+            is_configured = configured and os.path.abspath(configured) == os.path.abspath(entry["path"])
+            self.logger.info(f"Loading model from: {entry['path']}")
+            start = time.perf_counter()
+            model = AutoModelForCausalLM.from_pretrained(
+                entry["path"],
+                # Other files are detected from their GGUF header
+                model_type=config["model_type"] if is_configured else None,
+                gpu_layers=config["gpu_layers"],
+                temperature=config["temperature"],
+                max_new_tokens=config["max_tokens"],
+                context_length=config.get("context_length") or metadata.get("context_length") or 2048,
+                threads=config.get("threads", -1),
+                batch_size=config.get("batch_size", 8),
+                mmap=config.get("mmap", True),
+                mlock=config.get("mlock", False)
+            )
+            timings["load_weights"] = time.perf_counter() - start
+            identity = self.identity(name)
+        return model, identity
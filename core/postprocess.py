@@ -0,0 +1,109 @@
+"""
+TinyllamaChatbot - Incremental Output Post-Processing
+"""
+
+import re
+from typing import Optional, Sequence
+
+# Control characters except newlines and tabs
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+SENTENCE_ENDINGS = ".!?"
+
+class OutputProcessor:
+    """Filters generated text as it is decoded and says when to stop generating.
+
+    ``feed`` takes each newly decoded piece and returns the text that is
+    safe to show. Control characters are dropped. Text that could be the
+    start of a stop sequence is held back until it can't be. Leading
+    whitespace is skipped. Once a stop sequence appears, or the reply
+    reaches ``max_chars`` characters or ``max_sentences`` sentences,
+    ``finish_reason`` is set and ``cut`` marks where the reply ends, so the
+    caller can stop generating at that token instead of producing text
+    that would be thrown away.
+
+    Positions such as ``cut`` refer to ``text``, the decoded text with
+    control characters removed.
+    """
+
+    def __init__(self, stop: Sequence[str] = (), max_chars: int = 0, max_sentences: int = 0):
+        self.stop = [s for s in stop if s]
+        self.max_chars = max_chars
+        self.max_sentences = max_sentences
+        self.text = ""
+        self.emitted = 0
+        self.started = False
+        self.cut: Optional[int] = None
+        self.finish_reason: Optional[str] = None
+        self._first = 0
+        self._sentences = 0
+        self._scanned = 0
+
+    def feed(self, piece: str) -> str:
+        """Add decoded text and return what can be shown now."""
+        if self.finish_reason:
+            return ""
+        self.text += CONTROL_CHARS.sub("", piece)
+
+        cut = self._find_limit()
+        if cut is not None:
+            self.cut = cut
+            return self._take(cut)
+
+        # Hold back text that could be the start of a stop sequence
+        end = len(self.text)
+        for s in self.stop:
+            for i in range(min(len(s) - 1, len(self.text) - self.emitted), 0, -1):
+                if self.text.endswith(s[:i]):
+                    end = min(end, len(self.text) - i)
+                    break
+        return self._take(end)
+
+    def flush(self) -> str:
+        """Return the text still held back once generation has ended."""
+        if self.finish_reason:
+            return ""
+        return self._take(len(self.text))
+
+    def _find_limit(self) -> Optional[int]:
+        cuts = []
+        hits = [i for i in (self.text.find(s, self.emitted) for s in self.stop) if i != -1]
+        if hits:
+            cuts.append((min(hits), "stop"))
+
+        if self.max_chars:
+            start = self._content_start()
+            if start is not None and len(self.text) - start >= self.max_chars:
+                cuts.append((start + self.max_chars, "length"))
+
+        if self.max_sentences:
+            # A sentence ends at . ! or ? followed by whitespace, so "3.14" doesn't count
+            for i in range(self._scanned, len(self.text) - 1):
+                if self.text[i] in SENTENCE_ENDINGS and self.text[i + 1].isspace():
+                    self._sentences += 1
+                    if self._sentences >= self.max_sentences:
+                        cuts.append((i + 1, "length"))
+                        break
+            self._scanned = max(self._scanned, len(self.text) - 1)
+
+        if not cuts:
+            return None
+        cut, self.finish_reason = min(cuts)
+        return cut
+
+    def _content_start(self) -> Optional[int]:
+        """Where the reply proper starts, once its first non-whitespace character is known."""
+        if self.started:
+            return self._first
+        start = len(self.text) - len(self.text[self.emitted:].lstrip())
+        return start if start < len(self.text) else None
+
+    def _take(self, end: int) -> str:
+        chunk = self.text[self.emitted:end]
+        if not self.started:
+            stripped = chunk.lstrip()
+            if stripped:
+                self.started = True
+                self._first = end - len(stripped)
+            chunk = stripped
+        self.emitted = max(self.emitted, end)
+        return chunk
@@ -1,86 +1,263 @@
-"""
-TinyllamaChatbot - Prompt Management and Logging
-"""
-
-import os
-import json
-import logging
-from datetime import datetime
-from typing import List, Tuple
-
-class PromptManager:
-    """Manages prompt formatting and conversation logging."""
-
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-        self.conversation_history: List[Tuple[str, str]] = []
-        self.log_file = os.path.join(os.path.dirname(__file__), '..', 'logs', 'chat_history.txt')
-        self._ensure_log_directory()
-
-    def _ensure_log_directory(self):
-        """Ensure the logs directory exists."""
-        log_dir = os.path.dirname(self.log_file)
-        os.makedirs(log_dir, exist_ok=True)
-
-    def format_prompt(self, user_input: str) -> str:
-        """Format the user input into a proper prompt for the model."""
-        return f"""Below is an instruction that describes a task. Write a response that appropriately completes the request.
-
-### Instruction:
-{user_input}
-
-### Response:
-"""
-
-    def add_to_history(self, user_input: str, bot_response: str):
-        """Add interaction to in-memory history."""
-        self.conversation_history.append((user_input, bot_response))
-        if len(self.conversation_history) > 50:
-            self.conversation_history = self.conversation_history[-50:]
-
-    def log_interaction(self, user_input: str, bot_response: str):
-        """Log the conversation to file and memory."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # Add to memory
-        self.add_to_history(user_input, bot_response)
-
-        # Write to log file
-        try:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(f"\n[{timestamp}]\n")
-                f.write(f"User: {user_input}\n")
-                f.write(f"Bot: {bot_response}\n")
-                f.write("-" * 50 + "\n")
-        except Exception as e:
-            self.logger.error(f"Failed to write to log file: {str(e)}")
-
-    def get_conversation_history(self) -> List[Tuple[str, str]]:
-        """Get the current conversation history."""
-        return self.conversation_history.copy()
-
-    def clear_history(self):
-        """Clear the conversation history from memory."""
-        self.conversation_history.clear()
-        self.logger.info("Conversation history cleared")
-
-    def export_history(self, filename: str) -> bool:
-        """Export conversation history to a file."""
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write("Tinyllama Chatbot - Conversation Export\n")
-                f.write(f"Exported on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("=" * 50 + "\n\n")
-
-                for i, (user_msg, bot_msg) in enumerate(self.conversation_history, 1):
-                    f.write(f"Conversation {i}:\n")
-                    f.write(f"User: {user_msg}\n")
-                    f.write(f"Bot: {bot_msg}\n")
-                    f.write("-" * 30 + "\n\n")
-
-            self.logger.info(f"History exported to: {filename}")
-            return True
-
-        except Exception as e:
-            self.logger.error(f"Failed to export history: {str(e)}")
-            return False
+"""
+TinyllamaChatbot - Prompt Management and Logging
+"""
+
+import os
+import json
+import hashlib
+import logging
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from .compaction import RollingMemory
+from .conversation_store import ConversationStore
+from .log_writer import AsyncLogWriter
+from .templates import PromptTemplate, get_template
+
+MAX_HISTORY = 50
+# Introduces the passages retrieved from the local documents in a grounded message
+GROUNDING_HEADER = "Use these notes from the local documents if they help:"
+
+class PromptManager:
+    """Manages prompt formatting and conversation logging."""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = config or {}
+        # The chatbot switches to the active model's template; this is the fallback
+        self.template = get_template(self.config.get("prompt_template", "alpaca"))
+        self.system_prompt = self.config.get("system_prompt") or None
+        self.conversation_history = deque(maxlen=MAX_HISTORY)
+        # Older turns condensed by the chatbot's compaction; the prompt only holds the rest verbatim
+        self.memory = RollingMemory(self.config.get("memory_max_tokens", 48))
+        self.log_format = self.config.get("chat_log_format", "text")
+        extension = "jsonl" if self.log_format == "jsonl" else "txt"
+        self.log_file = os.path.join(os.path.dirname(__file__), '..', 'logs', f'chat_history.{extension}')
+        self.log_writer = None
+        self._ensure_log_directory()
+
+        self.store = None
+        self.session_id = None
+        if self.config.get("conversation_store_enabled", False):
+            self.store = ConversationStore(
+                self.config.get("conversation_store_path")
+                or os.path.join(os.path.dirname(__file__), '..', 'data', 'conversations.sqlite3')
+            )
+
+    def _ensure_log_directory(self):
+        """Ensure the logs directory exists."""
+        log_dir = os.path.dirname(self.log_file)
+        os.makedirs(log_dir, exist_ok=True)
+
+    def set_template(self, template: PromptTemplate):
+        """Switch the prompt format, e.g. when another model becomes active."""
+        self.template = template
+
+    def format_prompt(self, user_input: str, passages: Optional[List[str]] = None) -> str:
+        """Format the user input, with any retrieved passages, into a proper prompt for the model."""
+        return self.format_preamble() + self.format_turn(self.format_grounded_input(user_input, passages), first=True)
+
+    def format_grounded_input(self, user_input: str, passages: Optional[List[str]] = None) -> str:
+        """The user's message preceded by passages retrieved from the local documents."""
+        if not passages:
+            return user_input
+        notes = "".join(f"- {passage}\n" for passage in passages)
+        return f"{GROUNDING_HEADER}\n{notes}\n{user_input}"
+
+    def format_preamble(self) -> str:
+        """Return the text that starts every prompt."""
+        return self.template.preamble(self.format_system())
+
+    def format_system(self) -> Optional[str]:
+        """The system prompt with the rolling memory of folded turns, if any."""
+        if not self.memory.text:
+            return self.system_prompt
+        return f"{self.system_prompt or self.template.default_system}\n{self.memory.text}"
+
+    def recent_history(self) -> List[Tuple[str, str]]:
+        """The turns not folded into the memory, which the prompt holds verbatim."""
+        return list(self.conversation_history)[self.memory.folded:]
+
+    def conversation_digest(self) -> str:
+        """Digest of what a reply depends on besides the message: the memory and the turns still in the prompt."""
+        digest = hashlib.blake2b(self.memory.text.encode('utf-8'), digest_size=8)
+        for user_msg, bot_msg in self.recent_history():
+            digest.update(b"\0" + user_msg.encode('utf-8') + b"\0" + bot_msg.encode('utf-8'))
+        return digest.hexdigest()
+
+    def format_turn(self, user_input: str, first: bool = False) -> str:
+        """Format a single user turn, ending with an open response for the model."""
+        return self.template.turn(user_input, first)
+
+    def format_turn_separator(self) -> str:
+        """Return the text that closes a response before the next turn."""
+        return self.template.separator
+
+    def format_exchange(self, user_input: str, bot_response: str, first: bool = False) -> str:
+        """Format a finished turn: the user's message and the reply."""
+        return self.format_turn(user_input, first) + bot_response + self.format_turn_separator()
+
+    def format_messages(self, messages: List[dict], template: Optional[PromptTemplate] = None) -> str:
+        """Format an OpenAI-style list of chat messages into a single prompt.
+
+        A system message replaces the default system prompt; user and
+        assistant turns follow in the template's markup, ending with an
+        open response for the model to complete.
+        """
+        template = template or self.template
+        system = self.system_prompt
+        turns = []
+        for message in messages:
+            role = message.get("role")
+            content = message.get("content") or ""
+            if role == "system":
+                system = content
+            elif role == "assistant":
+                turns.append(content + template.separator)
+            else:
+                turns.append(template.turn(content, first=not turns))
+        return template.preamble(system) + "".join(turns)
+
+    def add_to_history(self, user_input: str, bot_response: str):
+        """Add interaction to in-memory history and the conversation store."""
+        if len(self.conversation_history) == MAX_HISTORY and self.memory.folded:
+            # The oldest turn leaves the history; its note stays in the memory
+            self.memory.folded -= 1
+        self.conversation_history.append((user_input, bot_response))
+        if self.store is not None:
+            try:
+                if self.session_id is None:
+                    self.session_id = self.store.create_session(user_input[:60])
+                self.store.add_turn(self.session_id, user_input, bot_response)
+            except Exception as e:
+                self.logger.error(f"Failed to store conversation: {str(e)}")
+
+    def new_session(self):
+        """Start a new stored session with the next interaction."""
+        self.session_id = None
+
+    def load_session(self, session_id: int) -> List[Tuple[str, str]]:
+        """Continue a stored session, returning its most recent turns as the new history."""
+        messages = self.store.get_messages(session_id, limit=MAX_HISTORY * 2)
+        turns = []
+        for message in messages:
+            if message["role"] == "user":
+                turns.append([message["content"], ""])
+            elif turns:
+                turns[-1][1] = message["content"]
+        self.conversation_history = deque((tuple(turn) for turn in turns), maxlen=MAX_HISTORY)
+        self.memory.clear()
+        self.session_id = session_id
+        return list(self.conversation_history)
+
+    def log_interaction(self, user_input: str, bot_response: str, stats: Optional[dict] = None):
+        """Queue the interaction for the background chat log writer.
+
+        In the "jsonl" format each interaction is one compact JSON record
+        with token counts and latencies from ``stats``; otherwise the
+        readable text format is used.
+        """
+        try:
+            if self.log_format == "jsonl":
+                stats = stats or {}
+                record = {
+                    "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+                    "prompt": user_input,
+                    "response": bot_response,
+                    "prompt_tokens": stats.get("prompt_tokens"),
+                    "completion_tokens": stats.get("completion_tokens"),
+                    "ttft": stats.get("ttft"),
+                    "elapsed": stats.get("elapsed"),
+                    "cached": stats.get("cached", False)
+                }
+                entry = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+            else:
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                entry = f"\n[{timestamp}]\nUser: {user_input}\nBot: {bot_response}\n" + "-" * 50 + "\n"
+            self._get_log_writer().write(entry)
+        except Exception as e:
+            self.logger.error(f"Failed to write to log file: {str(e)}")
+
+    def _get_log_writer(self) -> AsyncLogWriter:
+        """Start the writer thread on first use, so processes that never log don't run one."""
+        if self.log_writer is None:
+            self.log_writer = AsyncLogWriter(
+                self.log_file,
+                max_bytes=self.config.get("chat_log_max_bytes", 10 * 1024 * 1024),
+                backup_count=self.config.get("chat_log_backup_count", 5),
+                rotate_interval=self.config.get("chat_log_rotate_hours", 0) * 3600,
+                flush_interval=self.config.get("chat_log_flush_interval", 1.0),
+                fsync=self.config.get("chat_log_fsync", False)
+            )
+        return self.log_writer
+
+    def close(self):
+        """Write out queued log records and stop the log writer."""
+        if self.log_writer is not None:
+            self.log_writer.close()
+            self.log_writer = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def get_conversation_history(self) -> List[Tuple[str, str]]:
+        """Get the current conversation history."""
+        return list(self.conversation_history)
+
+    def clear_history(self):
+        """Clear the conversation history from memory; the next interaction starts a new stored session."""
+        self.conversation_history.clear()
+        self.memory.clear()
+        self.new_session()
+        self.logger.info("Conversation history cleared")
+
+    def export_history(self, filename: str, all_sessions: bool = False) -> bool:
+        """Export conversation history to a file.
+
+        ``.json`` and ``.jsonl`` files get structured records, streamed from
+        the conversation store when it is enabled (the whole current session,
+        or every session with ``all_sessions``); other extensions get the
+        plain text transcript of the in-memory history.
+        """
+        try:
+            if filename.lower().endswith((".json", ".jsonl")):
+                if self.store is not None and (all_sessions or self.session_id is not None):
+                    count = self.store.export(filename, None if all_sessions else self.session_id)
+                else:
+                    count = self._export_memory_json(filename)
+                self.logger.info(f"History exported to: {filename} ({count} messages)")
+                return True
+
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write("Tinyllama Chatbot - Conversation Export\n")
+                f.write(f"Exported on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                f.write("=" * 50 + "\n\n")
+
+                for i, (user_msg, bot_msg) in enumerate(self.conversation_history, 1):
+                    f.write(f"Conversation {i}:\n")
+                    f.write(f"User: {user_msg}\n")
+                    f.write(f"Bot: {bot_msg}\n")
+                    f.write("-" * 30 + "\n\n")
+
+            self.logger.info(f"History exported to: {filename}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to export history: {str(e)}")
+            return False
+
+    def _export_memory_json(self, filename: str) -> int:
+        """Write the in-memory history in the same record layout as the store export."""
+        jsonl = filename.lower().endswith(".jsonl")
+        records = []
+        for user_msg, bot_msg in self.conversation_history:
+            records.append({"role": "user", "content": user_msg})
+            records.append({"role": "assistant", "content": bot_msg})
+        with open(filename, 'w', encoding='utf-8') as f:
+            if jsonl:
+                f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            else:
+                json.dump({"exported": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), "messages": records},
+                          f, ensure_ascii=False, indent=2)
+        return len(records)
@@ -0,0 +1,146 @@
+"""
+TinyllamaChatbot - Persistent Response Cache
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+class ResponseCache:
+    """On-disk LRU cache of generated responses.
+
+    Entries are kept in memory in LRU order so a hit is a dictionary
+    lookup, and persisted to SQLite so they survive restarts. Writes go to
+    disk immediately; recency updates from hits are batched and written on
+    the next insert or on close. The cache is capped both by entry count
+    and by total response size.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._touched = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        for key, response, size in self._db.execute(
+                "SELECT key, response, size FROM responses ORDER BY last_used"):
+            self._entries[key] = response
+            self._bytes += size
+        self.logger.info(f"Response cache: {len(self._entries)} entries loaded from {self.path}")
+
+    @staticmethod
+    def make_key(prompt: str, temperature: float, max_tokens: int,
+                 stop: List[str], model_identity: str, sampling: Optional[dict] = None) -> str:
+        """Build the cache key for a normalized prompt and its sampling parameters."""
+        fields = [prompt, float(temperature), int(max_tokens), list(stop), model_identity]
+        if sampling:
+            # Only requests that override top_k, seed, ... get a different key than the defaults
+            fields.append(sorted(sampling.items()))
+        raw = json.dumps(fields)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None on a miss."""
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._touched.add(key)
+            self.hits += 1
+            return response
+
+    def put(self, key: str, response: str):
+        """Store a response, evicting least recently used entries over the caps."""
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key).encode('utf-8'))
+            self._entries[key] = response
+            self._bytes += size
+
+            evicted = []
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                old_key, old_response = self._entries.popitem(last=False)
+                self._bytes -= len(old_response.encode('utf-8'))
+                self._touched.discard(old_key)
+                evicted.append((old_key,))
+
+            try:
+                now = time.time()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, response, size, now)
+                )
+                if evicted:
+                    self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                self._flush_touched(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                self.logger.error(f"Failed to write response cache: {str(e)}")
+
+    def _flush_touched(self, now: float):
+        """Persist the recency of entries hit since the last write."""
+        if self._touched:
+            self._db.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(now, key) for key in self._touched]
+            )
+            self._touched.clear()
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._entries.clear()
+            self._touched.clear()
+            self._bytes = 0
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        """Write pending recency updates and close the database."""
+        with self._lock:
+            try:
+                self._flush_touched(time.time())
+                self._db.commit()
+                self._db.close()
+            except sqlite3.Error as e:
+                self.logger.error(f"Failed to close response cache: {str(e)}")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes
+        }
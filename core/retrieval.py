@@ -0,0 +1,505 @@
+"""
+TinyllamaChatbot - Local Document Retrieval
+"""
+
+import os
+import re
+import math
+import mmap
+import time
+import heapq
+import bisect
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..')
+EXTENSIONS = (".txt", ".md", ".markdown")
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# Builds with at least this many files to read parse them in worker processes
+POOL_MIN_FILES = 16
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have how i if in into is it its me my no not of on
+or our so than that the their them then there these they this to was we were what when where which who why
+will with you your
+""".split())
+
+_WORD = re.compile(r"[^\W_]+")
+
+def terms(text: str) -> List[str]:
+    """The indexed terms of ``text``: lowercased words without stopwords or a plural s."""
+    result = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        result.append(word)
+    return result
+
+def split_passages(text: str, max_words: int) -> List[Tuple[int, str]]:
+    """Split a document into (first line, text) passages of at most ``max_words`` words.
+
+    Paragraphs stay together where they fit and a Markdown heading always
+    starts a new passage, so it is kept with the text below it.
+    """
+    passages = []
+    current: List[str] = []
+    start = 1
+    for line, paragraph in _paragraphs(text):
+        words = paragraph.split()
+        if current and (paragraph.startswith("#") or len(current) + len(words) > max_words):
+            passages.append((start, " ".join(current)))
+            current = []
+        if not current:
+            start = line
+        current.extend(words)
+        if len(current) > max_words:
+            cut = len(current) - len(current) % max_words
+            passages.extend((start, " ".join(current[i:i + max_words])) for i in range(0, cut, max_words))
+            current = current[cut:]
+    if current:
+        passages.append((start, " ".join(current)))
+    return passages
+
+def _paragraphs(text: str):
+    lines = []
+    start = 1
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            if not lines:
+                start = number
+            lines.append(line.strip())
+        elif lines:
+            yield start, " ".join(lines)
+            lines = []
+    if lines:
+        yield start, " ".join(lines)
+
+def read_documents(docs_dir: str, files: List[Tuple[str, Optional[str]]], max_words: int):
+    """Read and split a batch of files; runs in the worker processes of a build.
+
+    ``files`` are (path, digest at the last build) pairs. Returns the
+    (path, digest, passages) of each file, passages being (line, text,
+    length in terms), or None if the content still has the known digest;
+    the digest is None if the file can't be read. With them come the
+    batch's postings: for every term, the numbers of the passages holding
+    it, counted across the batch, and its frequency in each, so the build
+    only has to offset them.
+    """
+    results = []
+    postings: Dict[str, Tuple[array, array]] = {}
+    number = 0
+    for path, known_digest in files:
+        try:
+            with open(os.path.join(docs_dir, path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            results.append((path, None, None))
+            continue
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == known_digest:
+            results.append((path, digest, None))
+            continue
+        passages = []
+        for line, passage in split_passages(data.decode('utf-8', errors='replace'), max_words):
+            words = terms(passage)
+            if not words:
+                continue
+            for term, count in Counter(words).items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = (array("I"), array("H"))
+                entry[0].append(number)
+                entry[1].append(count)
+            passages.append((line, passage, len(words)))
+            number += 1
+        results.append((path, digest, passages))
+    return results, postings
+
+def open_index(config: dict) -> "DocumentIndex":
+    """The index at retrieval_index_path (default data/index)."""
+    return DocumentIndex(
+        config.get("retrieval_index_path") or os.path.join(PROJECT_ROOT, 'data', 'index'),
+        passage_words=config.get("retrieval_passage_words", 60)
+    )
+
+def docs_path(config: dict) -> str:
+    """The folder indexed by default, retrieval_docs_path (default data/docs)."""
+    return config.get("retrieval_docs_path") or os.path.join(PROJECT_ROOT, 'data', 'docs')
+
+
+class DocumentIndex:
+    """BM25 index over the passages of a folder of text and Markdown files, kept on disk.
+
+    Each build writes one postings file: the passage ids of every term
+    back to back (uint32), then their term frequencies (uint16), then the
+    length of every passage (uint16), memory-mapped for queries. SQLite
+    next to it holds each term's document frequency and offset, the
+    passages' text and the indexed files with their mtime, size and SHA-1.
+    A build only reads files whose mtime or size changed and only
+    re-indexes those whose content did, in a process pool when there are
+    many; the postings of every other file are copied over unchanged, as
+    new passages always get higher ids than the ones kept. Queries see the
+    last finished build, also while another process is writing the next.
+    """
+
+    def __init__(self, directory: str, passage_words: int = 60):
+        self.directory = directory
+        self.passage_words = passage_words
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._generation = None
+        self._mmap = None
+        self._mmap_file = None
+        self._views: List[memoryview] = []
+        self._norms = array("d")
+        self._passage_count = 0
+        self._postings = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Transactions are explicit, so a query reads terms and postings of one build
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, digest TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS passages (id INTEGER PRIMARY KEY, path TEXT NOT NULL, "
+            "line INTEGER NOT NULL, text TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS passages_path ON passages (path)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL, "
+            "offset INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _meta(self) -> Dict[str, str]:
+        return dict(self._db.execute("SELECT key, value FROM meta"))
+
+    def _postings_path(self, generation) -> str:
+        return os.path.join(self.directory, f"postings-{generation}.bin")
+
+    def build(self, docs_dir: str, workers: Optional[int] = None, rebuild: bool = False) -> dict:
+        """Bring the index up to date with ``docs_dir`` and report what was done and how long it took.
+
+        Everything is re-indexed with ``rebuild``, or when the folder or
+        passage size differ from the last build.
+        """
+        with self._lock:
+            timings = {}
+            start = time.perf_counter()
+            docs_dir = os.path.abspath(docs_dir)
+            if not os.path.isdir(docs_dir):
+                raise FileNotFoundError(f"Documents folder not found: {docs_dir}")
+            meta = self._meta()
+            fresh = (rebuild or meta.get("docs") != docs_dir
+                     or meta.get("passage_words") != str(self.passage_words))
+            known = {} if fresh else {
+                path: (mtime_ns, size, digest)
+                for path, mtime_ns, size, digest in self._db.execute("SELECT path, mtime_ns, size, digest FROM files")
+            }
+
+            found = {}
+            for root, _, names in os.walk(docs_dir):
+                for name in names:
+                    if name.lower().endswith(EXTENSIONS):
+                        full = os.path.join(root, name)
+                        stat = os.stat(full)
+                        found[os.path.relpath(full, docs_dir).replace(os.sep, "/")] = (stat.st_mtime_ns, stat.st_size)
+            removed = [path for path in known if path not in found]
+            candidates = sorted(path for path, stat in found.items() if path not in known or known[path][:2] != stat)
+            timings["scan"] = time.perf_counter() - start
+
+            phase = time.perf_counter()
+            workers = workers or os.cpu_count() or 1
+            changed, touched, unreadable = {}, [], 0
+            batches = self._read(docs_dir, candidates, known, workers)
+            for results, _ in batches:
+                for path, digest, passages in results:
+                    if digest is None:
+                        self.logger.warning(f"Could not read {path}, leaving it out of the index")
+                        unreadable += 1
+                        if path in known:
+                            removed.append(path)
+                    elif passages is None:
+                        touched.append((*found[path], digest, path))
+                    else:
+                        changed[path] = (*found[path], digest)
+            timings["parse"] = time.perf_counter() - phase
+
+            report = {
+                "files": len(found), "indexed": len(changed), "unchanged": len(found) - len(changed) - unreadable,
+                "removed": len(removed), "workers": workers if len(candidates) >= POOL_MIN_FILES else 1
+            }
+            if changed or removed or fresh or "generation" not in meta:
+                self._merge(meta, docs_dir, fresh, batches, changed, removed, touched, timings)
+            elif touched:
+                self._db.executemany("UPDATE files SET mtime_ns = ?, size = ?, digest = ? WHERE path = ?", touched)
+            timings["total"] = time.perf_counter() - start
+            report.update(self.stats())
+            report["timings"] = timings
+            self.logger.info(
+                f"Index built in {timings['total']:.2f}s: {report['indexed']} files indexed, "
+                f"{report['unchanged']} unchanged, {report['removed']} removed"
+            )
+            return report
+
+    def _read(self, docs_dir: str, paths: List[str], known: dict, workers: int) -> list:
+        files = [(path, known.get(path, (0, 0, None))[2]) for path in paths]
+        if workers > 1 and len(files) >= POOL_MIN_FILES:
+            size = -(-len(files) // (workers * 4))
+            batches = [files[i:i + size] for i in range(0, len(files), size)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(read_documents, [docs_dir] * len(batches), batches,
+                                     [self.passage_words] * len(batches)))
+        return [read_documents(docs_dir, files, self.passage_words)]
+
+    def _merge(self, meta: dict, docs_dir: str, fresh: bool, batches: list, changed: dict,
+               removed: List[str], touched: list, timings: dict):
+        """Write the postings of the kept and the new passages as the next build (caller holds the lock)."""
+        phase = time.perf_counter()
+        stale = removed + [path for path in changed if not fresh]
+        deleted, affected = set(), set()
+        if not fresh:
+            self._refresh()
+            for path in stale:
+                for passage_id, text in self._db.execute("SELECT id, text FROM passages WHERE path = ?", (path,)):
+                    deleted.add(passage_id)
+                    affected.update(terms(text))
+
+        ids, frequencies = array("I"), array("H")
+        lengths = array("H")
+        if not fresh and self._mmap is not None:
+            lengths.frombytes(self._views[0][6 * self._postings:])
+        for passage_id in deleted:
+            lengths[passage_id] = 0
+        rows = []
+        new_postings: Dict[str, Tuple[array, array]] = {}
+        for results, postings in batches:
+            base = len(lengths)
+            for path, digest, passages in results:
+                for line, text, length in passages or ():
+                    rows.append((len(lengths), path, line, text))
+                    lengths.append(min(length, 0xFFFF))
+            for term, (numbers, counts) in postings.items():
+                entry = new_postings.get(term)
+                if entry is None:
+                    entry = new_postings[term] = (array("I"), array("H"))
+                entry[0].extend(map(base.__add__, numbers))
+                entry[1].extend(counts)
+
+        old_terms = {}
+        if not fresh and self._mmap is not None:
+            old_terms = {term: (df, offset) for term, df, offset in self._db.execute("SELECT term, df, offset FROM terms")}
+        def copy(start: int, end: int):
+            # Byte ranges of the mapped postings, copied without unpacking them
+            data = self._views[0]
+            ids.frombytes(data[4 * start:4 * end])
+            frequencies.frombytes(data[4 * self._postings + 2 * start:4 * self._postings + 2 * end])
+
+        deleted = sorted(deleted)
+        lexicon = []
+        for term in sorted(old_terms.keys() | new_postings.keys()):
+            offset = len(ids)
+            if term in old_terms:
+                df, old_offset = old_terms[term]
+                if term in affected:
+                    # Postings are sorted by passage id, so the deleted ones are found by bisection
+                    with self._views[1][old_offset:old_offset + df] as old_ids:
+                        kept = 0
+                        for passage_id in deleted:
+                            position = bisect.bisect_left(old_ids, passage_id, kept)
+                            if position < df and old_ids[position] == passage_id:
+                                copy(old_offset + kept, old_offset + position)
+                                kept = position + 1
+                    copy(old_offset + kept, old_offset + df)
+                else:
+                    copy(old_offset, old_offset + df)
+            if term in new_postings:
+                ids.extend(new_postings[term][0])
+                frequencies.extend(new_postings[term][1])
+            if len(ids) > offset:
+                lexicon.append((term, len(ids) - offset, offset))
+        timings["merge"] = time.perf_counter() - phase
+
+        phase = time.perf_counter()
+        generation = int(meta.get("generation", 0)) + 1
+        with open(self._postings_path(generation), 'wb') as f:
+            f.write(ids.tobytes())
+            f.write(frequencies.tobytes())
+            f.write(lengths.tobytes())
+
+        live_lengths = [length for length in lengths if length]
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if fresh:
+                self._db.execute("DELETE FROM files")
+                self._db.execute("DELETE FROM passages")
+            else:
+                self._db.executemany("DELETE FROM passages WHERE path = ?", [(path,) for path in stale])
+                self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+            self._db.executemany("INSERT INTO passages (id, path, line, text) VALUES (?, ?, ?, ?)", rows)
+            self._db.executemany("INSERT OR REPLACE INTO files (mtime_ns, size, digest, path) VALUES (?, ?, ?, ?)",
+                                 touched + [(*stat, path) for path, stat in changed.items()])
+            self._db.execute("DELETE FROM terms")
+            self._db.executemany("INSERT INTO terms (term, df, offset) VALUES (?, ?, ?)", lexicon)
+            self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("generation", str(generation)), ("docs", docs_dir), ("passage_words", str(self.passage_words)),
+                ("postings", str(len(ids))), ("passages", str(len(live_lengths))),
+                ("total_length", str(sum(live_lengths))), ("built_at", str(time.time()))
+            ])
+            self._db.execute("COMMIT")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            os.remove(self._postings_path(generation))
+            raise
+        timings["write"] = time.perf_counter() - phase
+
+        self._close_postings()
+        for name in os.listdir(self.directory):
+            if name.startswith("postings-") and name != os.path.basename(self._postings_path(generation)):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Still mapped by a reader (Windows); removed by a later build
+                    pass
+
+    def _refresh(self) -> bool:
+        """Map the postings of the latest build if they changed; False if nothing is indexed (caller holds the lock)."""
+        meta = self._meta()
+        generation = meta.get("generation")
+        if generation != self._generation:
+            self._close_postings()
+            if generation is not None:
+                postings = int(meta["postings"])
+                self._mmap_file = open(self._postings_path(generation), 'rb')
+                if os.fstat(self._mmap_file.fileno()).st_size:
+                    self._mmap = mmap.mmap(self._mmap_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = memoryview(self._mmap)
+                    self._views = [
+                        data,
+                        data[:4 * postings].cast("I"),
+                        data[4 * postings:6 * postings].cast("H"),
+                        data[6 * postings:].cast("H")
+                    ]
+                    passages = int(meta["passages"])
+                    average = int(meta["total_length"]) / passages if passages else 1.0
+                    # Length normalization of BM25 per passage, computed once per build
+                    self._norms = array("d", (K1 * (1 - B + B * length / average) for length in self._views[3]))
+                    self._passage_count = passages
+                    self._postings = postings
+            self._generation = generation
+        return self._mmap is not None
+
+    def _close_postings(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._mmap_file is not None:
+            self._mmap_file.close()
+            self._mmap_file = None
+        self._generation = None
+
+    def generation(self) -> Optional[str]:
+        """Identifies the current build; changes whenever the index does."""
+        with self._lock:
+            return self._meta().get("generation")
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.0) -> List[dict]:
+        """The ``k`` best passages for ``query`` scoring at least ``min_score``, best first.
+
+        Each is a dict with the BM25 score, the file's path relative to
+        the documents folder, the passage's first line and its text.
+        """
+        query_terms = sorted(set(terms(query)))
+        if not query_terms:
+            return []
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                if not self._refresh():
+                    return []
+                rows = self._db.execute(
+                    f"SELECT df, offset FROM terms WHERE term IN ({', '.join('?' * len(query_terms))})", query_terms
+                ).fetchall()
+                # Rarest terms first; once the terms left can't lift a passage that none of the
+                # terms so far matched into the results, they only add to the passages found
+                rows.sort()
+                count = self._passage_count
+                weights = [math.log(1 + (count - df + 0.5) / (df + 0.5)) * (K1 + 1) for df, _ in rows]
+                remaining = sum(weights)
+                scores: Dict[int, float] = {}
+                norms = self._norms
+                for (df, offset), weight in zip(rows, weights):
+                    ids = self._views[1][offset:offset + df]
+                    frequencies = self._views[2][offset:offset + df]
+                    threshold = min_score
+                    if len(scores) >= k:
+                        threshold = max(threshold, heapq.nlargest(k, scores.values())[-1])
+                    if remaining >= threshold:
+                        for passage_id, frequency in zip(ids, frequencies):
+                            scores[passage_id] = (scores.get(passage_id, 0.0)
+                                                  + weight * frequency / (frequency + norms[passage_id]))
+                    elif not scores:
+                        break
+                    elif len(scores) * df.bit_length() < df:
+                        for passage_id in scores:
+                            position = bisect.bisect_left(ids, passage_id)
+                            if position < df and ids[position] == passage_id:
+                                frequency = frequencies[position]
+                                scores[passage_id] += weight * frequency / (frequency + norms[passage_id])
+                    else:
+                        for passage_id, frequency in zip(ids, frequencies):
+                            if passage_id in scores:
+                                scores[passage_id] += weight * frequency / (frequency + norms[passage_id])
+                    remaining -= weight
+                best = [(passage_id, score) for passage_id, score in
+                        heapq.nlargest(k, scores.items(), key=lambda item: item[1]) if score >= min_score]
+                results = []
+                for passage_id, score in best:
+                    path, line, text = self._db.execute(
+                        "SELECT path, line, text FROM passages WHERE id = ?", (passage_id,)
+                    ).fetchone()
+                    results.append({"score": score, "path": path, "line": line, "text": text})
+                return results
+            finally:
+                self._db.execute("COMMIT")
+
+    def stats(self) -> dict:
+        """Return the size of the index on disk and when it was built."""
+        with self._lock:
+            meta = self._meta()
+            size = 0
+            for name in os.listdir(self.directory):
+                if name.startswith("index.sqlite3") or name == f"postings-{meta.get('generation')}.bin":
+                    size += os.path.getsize(os.path.join(self.directory, name))
+            return {
+                "docs": meta.get("docs"),
+                "files": self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                "passages": int(meta.get("passages", 0)),
+                "terms": self._db.execute("SELECT COUNT(*) FROM terms").fetchone()[0],
+                "postings": int(meta.get("postings", 0)),
+                "bytes": size,
+                "built_at": float(meta["built_at"]) if "built_at" in meta else None
+            }
+
+    def close(self):
+        """Unmap the postings and close the database."""
+        with self._lock:
+            self._close_postings()
+            self._db.close()
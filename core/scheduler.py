@@ -0,0 +1,194 @@
+"""
+TinyllamaChatbot - Request Scheduler
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, Optional
+
+from .metrics import metrics
+
+# Lanes in priority order: a request waiting in a lane goes before every request in the lanes after it
+LANES = ("interactive", "batch")
+
+class SchedulerFullError(RuntimeError):
+    """A lane already has as many requests waiting as it admits."""
+
+
+class Slot:
+    """A request's place at the model: queued until granted, then held until released."""
+
+    def __init__(self, scheduler: "RequestScheduler", lane: str, session: str):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.session = session
+        self.enqueued = time.perf_counter()
+        self.granted_at: Optional[float] = None
+        self.wait_seconds = 0.0
+        self.yields = 0
+
+    def should_yield(self) -> bool:
+        """True if a request in a higher priority lane is waiting for the model."""
+        return self.scheduler.waiting_above(self.lane)
+
+    def yield_model(self):
+        """Let the waiting requests of higher lanes run, then hold the model again."""
+        self.scheduler.yield_slot(self)
+
+
+class RequestScheduler:
+    """Decides which request gets the model next.
+
+    Requests run one at a time holding ``model_lock``. The next one comes
+    from the first lane in LANES with requests waiting; within a lane each
+    session has its own queue and sessions take turns, so one client
+    sending many requests can't hold up another. A lane admits at most
+    ``max_queued[lane]`` waiting requests (0 = no limit); past that
+    ``acquire`` raises SchedulerFullError right away. A request in a lower
+    lane can ``yield_model`` between tokens when ``should_yield``: it goes
+    back to the front of its lane and resumes once the higher lanes are
+    empty. Short model operations (switching models, warm-up, compaction)
+    take ``model_lock`` directly and are not queued.
+    """
+
+    def __init__(self, model_lock: threading.Lock, max_queued: Optional[Dict[str, int]] = None):
+        self.model_lock = model_lock
+        self.max_queued = {lane: (max_queued or {}).get(lane, 0) for lane in LANES}
+        self.logger = logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        # Per lane: session -> its waiting slots, in the order sessions take turns
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {lane: OrderedDict() for lane in LANES}
+        self._queued = {lane: 0 for lane in LANES}
+        self._running: Optional[Slot] = None
+        self._granted = set()
+        self._started = time.perf_counter()
+        self._counts = {lane: {"admitted": 0, "rejected": 0, "yields": 0, "busy_seconds": 0.0} for lane in LANES}
+
+    @contextmanager
+    def slot(self, lane: str = LANES[0], session: Optional[str] = None) -> Iterator[Slot]:
+        """Hold the model for the duration of a ``with`` block, queueing for it first."""
+        slot = self.acquire(lane, session)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def acquire(self, lane: str = LANES[0], session: Optional[str] = None) -> Slot:
+        """Queue for the model and block until it is this request's turn."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown priority {lane!r}, expected one of {', '.join(LANES)}")
+        slot = Slot(self, lane, session or "default")
+        with self._cond:
+            limit = self.max_queued[lane]
+            if limit and self._queued[lane] >= limit:
+                self._counts[lane]["rejected"] += 1
+                metrics.increment(f"scheduler_{lane}_rejected_total")
+                self.logger.warning(f"Turned away a {lane} request: {limit} already waiting")
+                raise SchedulerFullError(f"Too many {lane} requests waiting ({limit})")
+            self._counts[lane]["admitted"] += 1
+            metrics.increment(f"scheduler_{lane}_admitted_total")
+            self._enqueue(slot)
+            self._wait_for_turn(slot)
+        slot.wait_seconds = slot.granted_at - slot.enqueued
+        metrics.observe(f"scheduler_{lane}_wait_seconds", slot.wait_seconds)
+        self.model_lock.acquire()
+        return slot
+
+    def release(self, slot: Slot):
+        """Give up the model; the next request in line gets it."""
+        self.model_lock.release()
+        with self._cond:
+            self._finish_turn(slot)
+            self._dispatch()
+
+    def yield_slot(self, slot: Slot):
+        """Hand the model to the waiting requests and queue again at the front of the lane."""
+        self.model_lock.release()
+        with self._cond:
+            self._finish_turn(slot)
+            slot.yields += 1
+            self._counts[slot.lane]["yields"] += 1
+            metrics.increment(f"scheduler_{slot.lane}_yields_total")
+            self._enqueue(slot, front=True)
+            yielded_at = time.perf_counter()
+            self._wait_for_turn(slot)
+        metrics.observe(f"scheduler_{slot.lane}_yield_seconds", slot.granted_at - yielded_at)
+        self.model_lock.acquire()
+
+    def waiting_above(self, lane: str) -> bool:
+        """True if any lane before ``lane`` has requests waiting."""
+        # Read without the condition's lock: it's checked between tokens, and a stale answer only delays a yield by one
+        for other in LANES:
+            if other == lane:
+                return False
+            if self._queued[other]:
+                return True
+        return False
+
+    def _enqueue(self, slot: Slot, front: bool = False):
+        sessions = self._queues[slot.lane]
+        queue = sessions.get(slot.session)
+        if queue is None:
+            queue = sessions[slot.session] = deque()
+        if front:
+            queue.appendleft(slot)
+            sessions.move_to_end(slot.session, last=False)
+        else:
+            queue.append(slot)
+        self._queued[slot.lane] += 1
+        metrics.set_gauge(f"scheduler_{slot.lane}_queued", self._queued[slot.lane])
+
+    def _wait_for_turn(self, slot: Slot):
+        """Block until ``slot`` is granted the model (caller holds the condition)."""
+        self._dispatch()
+        while slot not in self._granted:
+            self._cond.wait()
+        self._granted.discard(slot)
+
+    def _dispatch(self):
+        """Grant the model to the next request if it is free (caller holds the condition)."""
+        if self._running is not None:
+            return
+        for lane in LANES:
+            sessions = self._queues[lane]
+            if not sessions:
+                continue
+            session, queue = next(iter(sessions.items()))
+            slot = queue.popleft()
+            if queue:
+                # The session's next request waits until the other sessions have had a turn
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            self._queued[lane] -= 1
+            metrics.set_gauge(f"scheduler_{lane}_queued", self._queued[lane])
+            metrics.set_gauge(f"scheduler_{lane}_running", 1)
+            slot.granted_at = time.perf_counter()
+            self._running = slot
+            self._granted.add(slot)
+            self._cond.notify_all()
+            return
+
+    def _finish_turn(self, slot: Slot):
+        busy = time.perf_counter() - slot.granted_at
+        self._counts[slot.lane]["busy_seconds"] += busy
+        metrics.increment(f"scheduler_{slot.lane}_busy_seconds_total", busy)
+        metrics.set_gauge(f"scheduler_{slot.lane}_running", 0)
+        self._running = None
+
+    def stats(self) -> dict:
+        """Per lane: requests waiting and running, admitted, rejected, yields and the share of time it held the model."""
+        with self._cond:
+            uptime = time.perf_counter() - self._started
+            return {
+                lane: {
+                    "queued": self._queued[lane],
+                    "running": self._running is not None and self._running.lane == lane,
+                    **counts,
+                    "occupancy": counts["busy_seconds"] / uptime if uptime else 0.0
+                }
+                for lane, counts in ((lane, dict(self._counts[lane])) for lane in LANES)
+            }
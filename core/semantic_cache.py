@@ -0,0 +1,335 @@
+"""
+TinyllamaChatbot - Semantic Response Cache
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Up to this many entries every lookup compares against all of them
+BRUTE_FORCE_LIMIT = 4096
+# Past it, entries are split into this many clusters and a lookup scans the closest few
+CLUSTERS = 256
+PROBES = 4
+KMEANS_ITERATIONS = 8
+
+class SemanticCache:
+    """Cache of responses looked up by embedding similarity instead of exact text.
+
+    Vectors are projected to ``dim`` dimensions (a fixed random projection,
+    so cosine similarity is roughly preserved), normalized and kept in a
+    memory-mapped float32 matrix of ``capacity`` rows in ``vectors.npy``;
+    prompts, responses and recency live in SQLite next to it, so the cache
+    survives restarts. Only entries of the same ``scope`` (model and
+    sampling parameters) are compared. A lookup is a matrix-vector product
+    over the candidates: all entries while there are few, and once there
+    are more than BRUTE_FORCE_LIMIT, only those in the PROBES clusters
+    closest to the query. The clusters are trained by k-means on a
+    background thread once that size is reached; lookups and inserts scan
+    every entry until it is done. When full, the least recently used entry
+    is replaced, and a scope is forgotten with its last entry.
+    """
+
+    def __init__(self, directory: str, capacity: int = 10000, threshold: float = 0.92, dim: int = 128):
+        self.directory = directory
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._projections: Dict[int, Optional[np.ndarray]] = {}
+        self._scope_ids: Dict[str, int] = {}
+        # Entries per scope id; a scope's id is dropped when its last entry goes
+        self._scope_refs: Dict[int, int] = {}
+        self._scope_names: Dict[int, str] = {}
+        self._next_scope_id = 0
+        # Per slot: scope id (-1 = empty), last use and cluster
+        self._scopes = np.full(capacity, -1, dtype=np.int32)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._clusters = np.full(capacity, -1, dtype=np.int32)
+        self._responses: List[Optional[str]] = [None] * capacity
+        self._members: Dict[int, set] = {}
+        self._member_arrays: Dict[int, np.ndarray] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._high = 0
+        self._count = 0
+        self._touched = set()
+        self._trainer: Optional[threading.Thread] = None
+        # Bumped by clear(), so clusters trained on entries cleared since are thrown away
+        self._epoch = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "entries.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (slot INTEGER PRIMARY KEY, scope TEXT NOT NULL, "
+            "prompt TEXT NOT NULL, response TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        """Open the vector file and the entries, starting over if the shape changed."""
+        vectors_path = os.path.join(self.directory, "vectors.npy")
+        centroids_path = os.path.join(self.directory, "centroids.npy")
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        shape = (self.capacity, self.dim)
+        if os.path.exists(vectors_path) and meta.get("shape") == f"{self.capacity}x{self.dim}":
+            self.vectors = np.lib.format.open_memmap(vectors_path, mode="r+")
+        else:
+            if meta:
+                self.logger.info("Semantic cache capacity or dimension changed, starting a new cache")
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shape', ?)",
+                             (f"{self.capacity}x{self.dim}",))
+            self._db.commit()
+            if os.path.exists(centroids_path):
+                os.remove(centroids_path)
+            self.vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=shape)
+
+        for slot, scope, response, last_used in self._db.execute(
+                "SELECT slot, scope, response, last_used FROM entries"):
+            self._scopes[slot] = self._acquire_scope(scope)
+            self._responses[slot] = response
+            self._last_used[slot] = last_used
+            self._count += 1
+            self._high = max(self._high, slot + 1)
+
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+            self._assign(np.flatnonzero(self._scopes[:self._high] >= 0))
+        elif self._count > BRUTE_FORCE_LIMIT:
+            self._start_training()
+        self.logger.info(f"Semantic cache: {self._count} entries loaded from {self.directory}")
+
+    def _acquire_scope(self, scope: str) -> int:
+        """The id of ``scope`` for one more entry, assigning one if it is new."""
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = self._scope_ids[scope] = self._next_scope_id
+            self._scope_names[scope_id] = scope
+            self._next_scope_id += 1
+        self._scope_refs[scope_id] = self._scope_refs.get(scope_id, 0) + 1
+        return scope_id
+
+    def _release_scope(self, scope_id: int):
+        """Drop an entry's hold on its scope id, forgetting the scope with its last entry."""
+        remaining = self._scope_refs.get(scope_id, 0) - 1
+        if remaining > 0:
+            self._scope_refs[scope_id] = remaining
+            return
+        self._scope_refs.pop(scope_id, None)
+        self._scope_ids.pop(self._scope_names.pop(scope_id, None), None)
+
+    def _project(self, embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        source_dim = vector.shape[0]
+        if source_dim not in self._projections:
+            projection = None
+            if source_dim != self.dim:
+                # Seeded by the input size, so the same model always maps to the same space
+                rng = np.random.default_rng(source_dim)
+                projection = rng.standard_normal((source_dim, self.dim)).astype(np.float32)
+            self._projections[source_dim] = projection
+        projection = self._projections[source_dim]
+        if projection is not None:
+            vector = vector @ projection
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def search(self, embedding: Sequence[float], scope: str, k: int = 1) -> List[Tuple[float, str]]:
+        """The ``k`` most similar cached (similarity, response) pairs in ``scope``, best first."""
+        with self._lock:
+            return [(similarity, self._responses[slot]) for similarity, slot in self._search(embedding, scope, k)]
+
+    def _search(self, embedding: Sequence[float], scope: str, k: int) -> List[Tuple[float, int]]:
+        """(similarity, slot) of the ``k`` closest entries (caller holds the lock)."""
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None or not self._count:
+            return []
+        query = self._project(embedding)
+        if self._centroids is None:
+            candidates = np.flatnonzero(self._scopes[:self._high] == scope_id)
+        else:
+            nearest = np.argpartition(self._centroids @ query, -PROBES)[-PROBES:]
+            candidates = np.concatenate([self._member_array(c) for c in nearest])
+            candidates = candidates[self._scopes[candidates] == scope_id]
+        if not len(candidates):
+            return []
+        similarities = self.vectors[candidates] @ query
+        top = np.argsort(similarities)[::-1][:k] if k > 1 else [int(np.argmax(similarities))]
+        return [(float(similarities[i]), int(candidates[i])) for i in top]
+
+    def get(self, embedding: Sequence[float], scope: str) -> Optional[Tuple[float, str]]:
+        """Return (similarity, response) of the closest entry at or above the threshold."""
+        with self._lock:
+            best = self._search(embedding, scope, 1)
+            if not best or best[0][0] < self.threshold:
+                self.misses += 1
+                return None
+            similarity, slot = best[0]
+            self._last_used[slot] = time.time()
+            self._touched.add(slot)
+            self.hits += 1
+            return similarity, self._responses[slot]
+
+    def record_saving(self, seconds: float):
+        """Add the generation time a hit avoided."""
+        self.saved_seconds += max(seconds, 0.0)
+
+    def put(self, embedding: Sequence[float], scope: str, prompt: str, response: str):
+        """Store a response under its prompt's embedding, replacing the oldest entry when full."""
+        vector = self._project(embedding)
+        with self._lock:
+            if self._count < self.capacity:
+                slot = self._high if self._high < self.capacity else int(np.argmin(self._scopes >= 0))
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._remove_member(slot)
+                self._release_scope(int(self._scopes[slot]))
+                self._count -= 1
+            now = time.time()
+            self.vectors[slot] = vector
+            self._scopes[slot] = self._acquire_scope(scope)
+            self._responses[slot] = response
+            self._last_used[slot] = now
+            self._count += 1
+            self._high = max(self._high, slot + 1)
+            if self._centroids is not None:
+                self._assign(np.array([slot]))
+            elif self._count > BRUTE_FORCE_LIMIT:
+                self._start_training()
+
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (slot, scope, prompt, response, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (slot, scope, prompt, response, now)
+                )
+                self._flush_touched()
+                self._db.commit()
+            except sqlite3.Error as e:
+                self.logger.error(f"Failed to write semantic cache: {str(e)}")
+
+    def _start_training(self):
+        """Train the clusters on a background thread unless that is already running (caller holds the lock)."""
+        if self._trainer is not None and self._trainer.is_alive():
+            return
+        self._trainer = threading.Thread(target=self._train, name="semantic-cache-kmeans", daemon=True)
+        self._trainer.start()
+
+    def _train(self):
+        """Cluster the stored vectors with k-means so lookups only scan nearby entries.
+
+        Runs on the trainer thread over a copy of the vectors, so lookups
+        and inserts carry on meanwhile; entries added during training are
+        assigned to a cluster when the result is installed.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            epoch = self._epoch
+            data = np.array(self.vectors[np.flatnonzero(self._scopes[:self._high] >= 0)])
+        if len(data) < CLUSTERS:
+            return
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(data), CLUSTERS, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            for c in range(CLUSTERS):
+                members = data[labels == c]
+                if len(members):
+                    mean = members.sum(axis=0)
+                    centroids[c] = mean / (np.linalg.norm(mean) or 1.0)
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._centroids = centroids.astype(np.float32)
+            np.save(os.path.join(self.directory, "centroids.npy"), self._centroids)
+            self._members.clear()
+            self._member_arrays.clear()
+            self._assign(np.flatnonzero(self._scopes[:self._high] >= 0))
+        self.logger.info(f"Semantic cache: clustered {len(data)} entries in {time.perf_counter() - start:.2f}s")
+
+    def _assign(self, slots: np.ndarray):
+        if not len(slots):
+            return
+        labels = np.argmax(np.asarray(self.vectors[slots]) @ self._centroids.T, axis=1)
+        for slot, label in zip(slots.tolist(), labels.tolist()):
+            self._clusters[slot] = label
+            self._members.setdefault(label, set()).add(slot)
+            self._member_arrays.pop(label, None)
+
+    def _remove_member(self, slot: int):
+        label = int(self._clusters[slot])
+        if label >= 0:
+            self._members[label].discard(slot)
+            self._member_arrays.pop(label, None)
+            self._clusters[slot] = -1
+
+    def _member_array(self, label: int) -> np.ndarray:
+        array = self._member_arrays.get(label)
+        if array is None:
+            array = self._member_arrays[label] = np.fromiter(self._members.get(label, ()), dtype=np.int64)
+        return array
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE entries SET last_used = ? WHERE slot = ?",
+                [(float(self._last_used[slot]), slot) for slot in self._touched]
+            )
+            self._touched.clear()
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._scopes[:] = -1
+            self._clusters[:] = -1
+            self._responses = [None] * self.capacity
+            self._members.clear()
+            self._member_arrays.clear()
+            self._centroids = None
+            self._high = self._count = 0
+            self._touched.clear()
+            self._scope_ids.clear()
+            self._scope_refs.clear()
+            self._scope_names.clear()
+            self._epoch += 1
+            centroids_path = os.path.join(self.directory, "centroids.npy")
+            if os.path.exists(centroids_path):
+                os.remove(centroids_path)
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def close(self):
+        """Flush the vectors and pending recency updates to disk."""
+        if self._trainer is not None:
+            self._trainer.join()
+        with self._lock:
+            try:
+                self.vectors.flush()
+                self._flush_touched()
+                self._db.commit()
+                self._db.close()
+            except (sqlite3.Error, OSError) as e:
+                self.logger.error(f"Failed to close semantic cache: {str(e)}")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters, the time hits saved and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "entries": self._count,
+            "clustered": self._centroids is not None
+        }
@@ -0,0 +1,42 @@
+"""
+TinyllamaChatbot - Prompt Lookup Drafting for Speculative Decoding
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+class PromptLookupDrafter:
+    """Proposes the next tokens by finding the current n-gram earlier in the context.
+
+    Replies often copy spans of the prompt or earlier turns (names, code,
+    quoted text). When the last ``n`` tokens (longest ``n`` first, down to
+    ``min_ngram``) occurred before, the tokens that followed that occurrence
+    are a cheap guess for what comes next. For every n the index maps an
+    n-gram to the end of its latest occurrence. The n-grams ending at the
+    newest token are only indexed once the next token arrives, so a lookup
+    never finds the suffix it is looking for.
+    """
+
+    def __init__(self, tokens: Sequence[int], max_ngram: int = 3, min_ngram: int = 1):
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        self.tokens: List[int] = []
+        self._index: Dict[Tuple[int, ...], int] = {}
+        for token in tokens:
+            self.append(token)
+
+    def append(self, token: int):
+        """Add a token to the context."""
+        end = len(self.tokens)
+        for n in range(self.min_ngram, min(self.max_ngram, end) + 1):
+            self._index[tuple(self.tokens[end - n:end])] = end
+        self.tokens.append(token)
+
+    def draft(self, count: int) -> List[int]:
+        """Return up to ``count`` tokens that followed the latest match of the context's suffix."""
+        if count <= 0:
+            return []
+        for n in range(min(self.max_ngram, len(self.tokens)), self.min_ngram - 1, -1):
+            end = self._index.get(tuple(self.tokens[-n:]))
+            if end is not None:
+                return self.tokens[end:end + count]
+        return []
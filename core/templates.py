@@ -0,0 +1,162 @@
+"""
+TinyllamaChatbot - Prompt Templates
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+ALPACA_SYSTEM = "Below is an instruction that describes a task. Write a response that appropriately completes the request."
+DEFAULT_SYSTEM = "You are a helpful assistant."
+# Preambles change with the conversation memory, so only the most recent fragments are kept
+FRAGMENT_CACHE_SIZE = 32
+# User texts that exercise the fragment boundaries: leading space, punctuation, digits, non-ASCII, newlines
+BOUNDARY_PROBES = ["Hello there", " hi", "What is 2+2?", "é ok.", "line\nbreak\n", "#1:"]
+
+class PromptTemplate:
+    """How a model expects the system prompt, user turns and its own replies to be marked up.
+
+    A prompt is ``preamble`` followed by turns. Each turn is
+    ``turn_prefix + user text + turn_suffix``, the model's reply and then
+    ``separator``. ``first_turn_prefix`` replaces the prefix of the
+    opening turn for formats that open it inside the preamble (Llama-2).
+    ``stop`` lists the strings that end a reply.
+    """
+
+    def __init__(self, name: str, system_format: str, default_system: str, turn_prefix: str,
+                 turn_suffix: str, separator: str, stop: List[str], first_turn_prefix: Optional[str] = None):
+        self.name = name
+        self.system_format = system_format
+        self.default_system = default_system
+        self.turn_prefix = turn_prefix
+        self.turn_suffix = turn_suffix
+        self.separator = separator
+        self.stop = stop
+        self.first_turn_prefix = turn_prefix if first_turn_prefix is None else first_turn_prefix
+
+    def preamble(self, system: Optional[str] = None) -> str:
+        return self.system_format.format(system=system or self.default_system)
+
+    def prefix(self, first: bool = False) -> str:
+        return self.first_turn_prefix if first else self.turn_prefix
+
+    def turn(self, user_input: str, first: bool = False) -> str:
+        """A user turn, ending with an open reply for the model."""
+        return self.prefix(first) + user_input + self.turn_suffix
+
+
+TEMPLATES: Dict[str, PromptTemplate] = {
+    "alpaca": PromptTemplate(
+        "alpaca", "{system}\n\n", ALPACA_SYSTEM,
+        "### Instruction:\n", "\n\n### Response:\n", "\n\n",
+        ["Human:", "User:", "\n\n"]
+    ),
+    "chatml": PromptTemplate(
+        "chatml", "<|im_start|>system\n{system}<|im_end|>\n", DEFAULT_SYSTEM,
+        "<|im_start|>user\n", "<|im_end|>\n<|im_start|>assistant\n", "<|im_end|>\n",
+        ["<|im_end|>", "<|im_start|>"]
+    ),
+    "zephyr": PromptTemplate(
+        "zephyr", "<|system|>\n{system}</s>\n", DEFAULT_SYSTEM,
+        "<|user|>\n", "</s>\n<|assistant|>\n", "</s>\n",
+        ["</s>", "<|user|>"]
+    ),
+    "llama2": PromptTemplate(
+        "llama2", "[INST] <<SYS>>\n{system}\n<</SYS>>\n\n", DEFAULT_SYSTEM,
+        "[INST] ", " [/INST]", " </s>",
+        ["</s>", "[INST]"],
+        first_turn_prefix=""
+    )
+}
+
+# Substrings of a GGUF chat template or model name that identify the format
+_CHAT_TEMPLATE_MARKERS = [("<|im_start|>", "chatml"), ("<|user|>", "zephyr"), ("[INST]", "llama2")]
+_NAME_MARKERS = [("zephyr", "zephyr"), ("chatml", "chatml"), ("openhermes", "chatml"), ("dolphin", "chatml"),
+                 ("qwen", "chatml"), ("llama-2", "llama2"), ("llama2", "llama2"), ("tinyllama-1.1b-chat", "zephyr")]
+
+def get_template(name: str) -> PromptTemplate:
+    """Look a template up by name, falling back to Alpaca."""
+    return TEMPLATES.get((name or "").lower().replace("-", ""), TEMPLATES["alpaca"])
+
+def detect_template(model_name: str = "", metadata: Optional[dict] = None) -> PromptTemplate:
+    """Guess a model's template from the chat template in its GGUF header, then from its name."""
+    raw = (metadata or {}).get("metadata", {})
+    chat_template = raw.get("tokenizer.chat_template") or ""
+    for marker, name in _CHAT_TEMPLATE_MARKERS:
+        if marker in chat_template:
+            return TEMPLATES[name]
+    names = f"{model_name} {(metadata or {}).get('name') or ''}".lower()
+    for marker, name in _NAME_MARKERS:
+        if marker in names:
+            return TEMPLATES[name]
+    return TEMPLATES["alpaca"]
+
+
+class TemplateTokens:
+    """Token ids of a template's fixed fragments, tokenized once per model.
+
+    Per request only the user's text needs tokenizing; the preamble, turn
+    markers and separator come from a small LRU cache. Splicing the
+    markers' tokens around the user's is only right if the tokenizer gives
+    the same ids as for the whole turn. SentencePiece tokenizers, for one,
+    add a leading-space piece to every call and merge across the
+    boundaries. So the first turn built checks this on BOUNDARY_PROBES, and
+    if any probe differs, every turn is tokenized as one string. The counts
+    of the last built turn are kept in ``last_counts``.
+    """
+
+    def __init__(self, template: PromptTemplate, tokenize: Callable[..., List[int]],
+                 system: Optional[str] = None):
+        self.template = template
+        self.tokenize = tokenize
+        self.system = system
+        self.logger = logging.getLogger(__name__)
+        self._cache: "OrderedDict[tuple, List[int]]" = OrderedDict()
+        self.splice_turns: Optional[bool] = None
+        self.last_counts = {"template_tokens": 0, "user_tokens": 0}
+
+    def fragment(self, text: str, bos: bool = False) -> List[int]:
+        key = (text, bos)
+        tokens = self._cache.get(key)
+        if tokens is None:
+            tokens = self._cache[key] = self.tokenize(text, bos=bos) if text else []
+            if len(self._cache) > FRAGMENT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return tokens
+
+    def _splice_matches(self) -> bool:
+        """True if fragment tokens spliced around the user's equal the tokens of the whole turn."""
+        for probe in BOUNDARY_PROBES:
+            for first in (True, False):
+                spliced = (self.fragment(self.template.prefix(first)) + self.tokenize(probe)
+                           + self.fragment(self.template.turn_suffix))
+                if spliced != self.tokenize(self.template.turn(probe, first=first)):
+                    return False
+        return True
+
+    def preamble(self, system: Optional[str] = None) -> List[int]:
+        """Tokens of the preamble, with ``system`` instead of the default system prompt if given."""
+        return self.fragment(self.template.preamble(system or self.system), bos=True)
+
+    def separator(self) -> List[int]:
+        return self.fragment(self.template.separator)
+
+    def turn(self, user_input: str, first: bool = False) -> List[int]:
+        """Tokens of a user turn; only ``user_input`` is tokenized when the tokenizer allows it."""
+        if self.splice_turns is None:
+            self.splice_turns = self._splice_matches()
+            if not self.splice_turns:
+                self.logger.info(f"Tokenizer merges across the {self.template.name} turn markers; "
+                                 f"tokenizing each turn as a whole")
+        template_tokens = len(self.fragment(self.template.prefix(first))) + len(self.fragment(self.template.turn_suffix))
+        if not self.splice_turns:
+            tokens = self.tokenize(self.template.turn(user_input, first=first))
+            # Approximate split: the markers may share a token with the user's text
+            self.last_counts = {"template_tokens": template_tokens,
+                                "user_tokens": max(len(tokens) - template_tokens, 0)}
+            return tokens
+        user = self.tokenize(user_input)
+        self.last_counts = {"template_tokens": template_tokens, "user_tokens": len(user)}
+        return self.fragment(self.template.prefix(first)) + user + self.fragment(self.template.turn_suffix)
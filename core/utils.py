@@ -5,8 +5,18 @@ TinyllamaChatbot - Utility Functions
 
 import os
 import re
+import json
+import queue
+import atexit
 import logging
-from typing import Optional
+import logging.handlers
+import platform
+from typing import List, Optional
+
+from .gguf import GGUFError, read_gguf_metadata
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'config')
+PROFILES_DIR = os.path.join(CONFIG_DIR, 'profiles')
 
 def clean_text(text: str) -> str:
     """Clean and normalize text input/output."""
@@ -25,21 +35,84 @@ def clean_text(text: str) -> str:
     
     return text
 
-def setup_logging():
-    """Setup logging configuration."""
+def host_profile_path(host: Optional[str] = None) -> str:
+    """Path of the tuned settings profile for this (or the given) host."""
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', host or platform.node() or "default")
+    return os.path.join(PROFILES_DIR, f"{name}.json")
+
+def load_host_profile() -> dict:
+    """Settings from this host's profile written by ``main.py tune``, or {} if there is none."""
+    path = host_profile_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("settings", {})
+    except (OSError, ValueError, AttributeError) as e:
+        logging.getLogger(__name__).warning(f"Ignoring unreadable host profile {path}: {str(e)}")
+        return {}
+
+def load_config() -> dict:
+    """Load configuration from config/settings.json, falling back to defaults.
+
+    Unless ``use_host_profile`` is false, the tuned settings of this host's
+    profile are applied on top.
+    """
+    config_path = os.path.join(CONFIG_DIR, 'settings.json')
+    try:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        logging.getLogger(__name__).warning("Config file not found, using defaults")
+        config = {
+            "model_path": "C:\\Users\\Blakka\\Documents\\CHATBOT\\model\\Tinyllama-1B-miniguanaco.Q2_K.gguf",
+            "model_type": "tinyllama",
+            "temperature": 0.7,
+            "max_tokens": 256,
+            "gpu_layers": 0,
+            "logging_enabled": True
+        }
+    if config.get("use_host_profile", True):
+        config.update(load_host_profile())
+    return config
+
+def setup_logging(config: Optional[dict] = None, console: bool = True):
+    """Setup logging configuration.
+
+    Records are handed to a queue and written by a listener thread, so
+    logging never blocks on file I/O. application.log is rotated once it
+    reaches ``log_max_bytes``, keeping ``log_backup_count`` old files; the
+    listener is drained at exit. Without ``console`` nothing is echoed to
+    stderr, e.g. when the terminal is the chat.
+    """
+    config = config if config is not None else load_config()
     log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
     os.makedirs(log_dir, exist_ok=True)
     
     log_file = os.path.join(log_dir, 'application.log')
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=config.get("log_max_bytes", 10 * 1024 * 1024),
+        backupCount=config.get("log_backup_count", 5),
+        encoding='utf-8'
     )
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # The queue handler only merges the message arguments; the listener's handlers format
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 
 def validate_model_file(model_path: str) -> bool:
     """Validate that the model file exists and is accessible."""
@@ -53,13 +126,11 @@ def validate_model_file(model_path: str) -> bool:
     if not model_path.lower().endswith('.gguf'):
         return False
     
-    # Check if file is readable
+    # Check that the GGUF header and metadata parse, without loading weights
     try:
-        with open(model_path, 'rb') as f:
-            # Read first few bytes to ensure it's accessible
-            f.read(4)
+        read_gguf_metadata(model_path)
         return True
-    except (IOError, OSError):
+    except GGUFError:
         return False
 
 def format_file_size(size_bytes: int) -> str:
@@ -89,6 +160,23 @@ def get_model_info(model_path: str) -> dict:
         "path": model_path
     }
 
+def total_memory_mb() -> Optional[float]:
+    """Physical memory of the host in MB, or None if it can't be determined."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the pct-th percentile (0-100) of values using linear interpolation."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
 def truncate_text(text: str, max_length: int = 100) -> str:
     """Truncate text to specified length with ellipsis."""
     if len(text) <= max_length:
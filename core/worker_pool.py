@@ -0,0 +1,412 @@
+"""
+TinyllamaChatbot - Multi-process Model Worker Pool
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from typing import Iterator, List, Optional, Tuple
+
+from .metrics import metrics
+from .model_registry import ModelRegistry
+from .prompt_manager import PromptManager
+from .utils import clean_text, load_config
+
+# How often an idle worker's dispatcher checks that its process is still running
+WORKER_CHECK_INTERVAL = 1.0
+
+def _worker_main(conn, worker_id: int, config_overrides: dict):
+    """Entry point of a worker process: load a model and serve requests from the pipe."""
+    from core.chatbot import TinyllamaChatbot
+
+    chatbot = TinyllamaChatbot(config_overrides)
+    if not chatbot.load_model():
+        conn.send(("failed", None, f"Worker {worker_id} failed to load model"))
+        return
+    conn.send(("ready", None, os.getpid()))
+
+    clear_pending = False
+    while True:
+        message = conn.recv()
+        command, request_id = message[0], message[1]
+        if command == "stop":
+            break
+        if command == "clear":
+            chatbot.clear_history()
+            continue
+        if command != "generate":
+            continue
+
+        _, _, kind, text, overrides = message
+        stats = {}
+        try:
+            if kind == "chat":
+                chunks = chatbot.stream_response(text, stats, **overrides)
+            else:
+                chunks = chatbot.stream_completion(text, stats, **overrides)
+            for chunk in chunks:
+                # Between tokens, stop the request if it was cancelled; the
+                # generation then ends at its next token with the partial text
+                while conn.poll():
+                    control = conn.recv()
+                    if control[0] == "cancel" and control[1] == request_id:
+                        chatbot.cancel()
+                    elif control[0] == "clear":
+                        clear_pending = True
+                conn.send(("chunk", request_id, chunk))
+            conn.send(("done", request_id, stats))
+        except Exception as e:
+            conn.send(("error", request_id, str(e)))
+
+        if clear_pending:
+            chatbot.clear_history()
+            clear_pending = False
+
+
+class PoolRequest:
+    """A request waiting for, or running on, a pool worker."""
+
+    def __init__(self, request_id: int, kind: str, text: str, overrides: dict):
+        self.request_id = request_id
+        self.kind = kind
+        self.text = text
+        self.overrides = overrides
+        self.chunks: queue.Queue = queue.Queue()
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+
+
+class ModelWorkerPool:
+    """Runs N worker processes, each with its own model instance, behind the chatbot interface.
+
+    Requests are handed to whichever worker is free first. Conversation
+    turns (``stream_response``) are pinned to one worker so its prefix
+    reuse and history keep working; one-shot completions go to any worker.
+    When a worker process dies, the turns queued for it fail and the
+    conversation carries on, without its earlier turns, on the next worker;
+    once no worker is left every queued request fails. Model weights are memory-mapped, so the OS shares their pages between
+    workers.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+
+        self.config = load_config()
+        self.prompt_manager = PromptManager(self.config)
+        # Only read for the model list; each worker loads models through its own registry
+        self.registry = ModelRegistry(self.config)
+        self.session_model = None
+        metrics.enabled = self.config.get("metrics_enabled", True)
+
+        cpus = os.cpu_count() or 1
+        self.num_workers = num_workers or self.config.get("pool_workers") or 1
+        self.threads_per_worker = (threads_per_worker or self.config.get("pool_threads_per_worker")
+                                   or max(1, cpus // self.num_workers))
+
+        self._cond = threading.Condition()
+        self._shared = deque()
+        self._pinned: List[deque] = []
+        self._workers = []
+        self._next_id = 0
+        self._started = time.perf_counter()
+        self._closed = False
+
+    def load_model(self) -> bool:
+        """Start the worker processes and wait until each has loaded its model."""
+        context = multiprocessing.get_context("spawn")
+        overrides = {
+            "threads": self.threads_per_worker,
+            # Interactions are logged once by the pool; per-process response
+            # caches on the same SQLite file would only diverge
+            "logging_enabled": False,
+            "response_cache_enabled": False,
+            "semantic_cache_enabled": False,
+            "conversation_store_enabled": False
+        }
+
+        for worker_id in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main, args=(child_conn, worker_id, overrides), daemon=True
+            )
+            process.start()
+            # Drop the parent's copy so recv() sees EOF if the worker dies
+            child_conn.close()
+            self._workers.append({
+                "id": worker_id, "process": process, "conn": parent_conn, "pid": process.pid,
+                "ready": False, "requests": 0, "tokens": 0, "busy": 0.0, "current": None,
+                "send_lock": threading.Lock()
+            })
+            self._pinned.append(deque())
+
+        self.logger.info(f"Starting {self.num_workers} workers with {self.threads_per_worker} threads each")
+        for worker in self._workers:
+            try:
+                status, _, detail = worker["conn"].recv()
+            except EOFError:
+                status, detail = "failed", f"Worker {worker['id']} exited during startup"
+            if status == "ready":
+                worker["ready"] = True
+                threading.Thread(target=self._dispatch, args=(worker,), daemon=True).start()
+            else:
+                self.logger.error(detail)
+
+        # Workers format turns themselves; this copy is for the server's chat requests
+        self.prompt_manager.set_template(self.registry.template(self.session_model))
+        ready = sum(1 for worker in self._workers if worker["ready"])
+        self.logger.info(f"{ready}/{self.num_workers} workers ready")
+        return ready > 0
+
+    def is_model_loaded(self) -> bool:
+        """Check if at least one worker is ready."""
+        return any(worker["ready"] for worker in self._workers)
+
+    def generate_response(self, user_input: str) -> str:
+        """Generate a response to user input."""
+        return clean_text("".join(self.stream_response(user_input)))
+
+    def stream_response(self, user_input: str, stats: Optional[dict] = None, **overrides) -> Iterator[str]:
+        """Generate the next conversation turn on the conversation's pinned worker."""
+        if not self.is_model_loaded():
+            yield "Error: Model not loaded"
+            return
+
+        stats = {} if stats is None else stats
+        if self.session_model:
+            overrides.setdefault("model", self.session_model)
+        chunks = []
+        try:
+            for chunk in self._submit("chat", user_input, overrides, stats, pinned=self._chat_worker()):
+                chunks.append(chunk)
+                yield chunk
+        except RuntimeError as e:
+            self.logger.error(f"Error generating response: {str(e)}")
+            yield f"Error: {str(e)}"
+            return
+
+        cleaned_input, response = clean_text(user_input), clean_text("".join(chunks))
+        self.prompt_manager.add_to_history(cleaned_input, response)
+        if self.config.get("logging_enabled", True):
+            self.prompt_manager.log_interaction(cleaned_input, response, stats)
+
+    def cancel(self):
+        """Stop every queued and running request; running ones end with their partial text."""
+        with self._cond:
+            for request in self._shared:
+                request.cancelled = True
+            for pinned in self._pinned:
+                for request in pinned:
+                    request.cancelled = True
+        for worker in self._workers:
+            request = worker["current"]
+            if request is not None:
+                request.cancelled = True
+
+    def stream_completion(self, prompt: str, stats: Optional[dict] = None, **overrides) -> Iterator[str]:
+        """Stream a completion of a formatted prompt on the first free worker."""
+        if not self.is_model_loaded():
+            raise RuntimeError("Model not loaded")
+        yield from self._submit("completion", prompt, overrides, stats)
+
+    def list_models(self) -> List[dict]:
+        """The models found in the model directory."""
+        if not self.registry.models:
+            self.registry.scan()
+        return self.registry.list()
+
+    def select_model(self, name: str) -> bool:
+        """Run this session's turns on model ``name``; the worker switches on the next turn."""
+        if name not in self.registry:
+            self.registry.scan()
+        if name not in self.registry:
+            self.logger.error(f"Failed to switch to model {name}: Unknown model")
+            return False
+        self.session_model = name
+        self.prompt_manager.set_template(self.registry.template(name))
+        return True
+
+    def clear_history(self):
+        """Forget the conversation so far."""
+        worker = self._chat_worker()
+        if worker is not None:
+            with worker["send_lock"]:
+                worker["conn"].send(("clear", None))
+        self.prompt_manager.clear_history()
+
+    def resume_session(self, session_id: int) -> List[Tuple[str, str]]:
+        """Continue a stored conversation; the pinned worker starts from an empty context."""
+        self.clear_history()
+        return self.prompt_manager.load_session(session_id)
+
+    def _chat_worker(self) -> Optional[dict]:
+        return next((worker for worker in self._workers if worker["ready"]), None)
+
+    def _submit(self, kind: str, text: str, overrides: dict, stats: Optional[dict],
+                pinned: Optional[dict] = None) -> Iterator[str]:
+        with self._cond:
+            if pinned is not None and not pinned["ready"]:
+                # The worker died after it was picked
+                pinned = self._chat_worker()
+            if not self.is_model_loaded():
+                raise RuntimeError("No pool worker is running")
+            self._next_id += 1
+            request = PoolRequest(self._next_id, kind, text, overrides)
+            if pinned is not None:
+                self._pinned[pinned["id"]].append(request)
+            else:
+                self._shared.append(request)
+            self._cond.notify_all()
+
+        finished = False
+        try:
+            while True:
+                kind, payload = request.chunks.get()
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    if stats is not None:
+                        stats.update(payload)
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise RuntimeError(payload)
+        finally:
+            if not finished:
+                request.cancelled = True
+
+    def _next_request(self, worker: dict) -> Optional[PoolRequest]:
+        """The worker's next request, or None once the pool is closed or the worker's process has exited."""
+        pinned = self._pinned[worker["id"]]
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if not worker["process"].is_alive():
+                    self._worker_died(worker, f"Worker {worker['id']} exited (code {worker['process'].exitcode})")
+                    return None
+                if pinned or self._shared:
+                    return pinned.popleft() if pinned else self._shared.popleft()
+                self._cond.wait(WORKER_CHECK_INTERVAL)
+
+    def _worker_died(self, worker: dict, reason: str):
+        """Take a dead worker out of the pool and fail the requests only it could run (caller holds the condition)."""
+        worker["ready"] = False
+        self.logger.error(reason)
+        metrics.increment("pool_worker_deaths_total")
+        # The conversation's context lived in that process, so its queued turns can't run elsewhere as they are
+        pinned = self._pinned[worker["id"]]
+        while pinned:
+            pinned.popleft().chunks.put(("error", f"{reason}; the conversation continues on another worker "
+                                                  f"without its earlier turns"))
+        if not self.is_model_loaded():
+            while self._shared:
+                self._shared.popleft().chunks.put(("error", f"{reason}; no pool worker is left"))
+        self._cond.notify_all()
+
+    def _dispatch(self, worker: dict):
+        """Feed requests to one worker process and relay its output back to the caller."""
+        conn = worker["conn"]
+        while True:
+            request = self._next_request(worker)
+            if request is None:
+                break
+            start = time.perf_counter()
+            wait = start - request.submitted
+            timeout = request.overrides.get("timeout")
+            if request.cancelled or (timeout and wait >= timeout):
+                reason = "cancelled" if request.cancelled else "deadline"
+                request.chunks.put(("done", {"finish_reason": reason, "queue_wait": wait, "completion_tokens": 0}))
+                continue
+
+            worker["current"] = request
+            overrides = dict(request.overrides)
+            if timeout:
+                # The worker counts the deadline from when it starts the request
+                overrides["timeout"] = timeout - wait
+            with worker["send_lock"]:
+                conn.send(("generate", request.request_id, request.kind, request.text, overrides))
+
+            cancel_sent = False
+            try:
+                while True:
+                    if request.cancelled and not cancel_sent:
+                        with worker["send_lock"]:
+                            conn.send(("cancel", request.request_id))
+                        cancel_sent = True
+                    if not conn.poll(0.05):
+                        continue
+                    status, _, payload = conn.recv()
+                    if status == "chunk":
+                        request.chunks.put(("chunk", payload))
+                    elif status == "done":
+                        payload["queue_wait"] = wait
+                        payload["worker"] = worker["id"]
+                        worker["tokens"] += payload.get("completion_tokens", 0)
+                        metrics.observe("pool_queue_wait_seconds", wait)
+                        metrics.record_generation(payload)
+                        request.chunks.put(("done", payload))
+                        break
+                    else:
+                        metrics.increment("errors_total")
+                        request.chunks.put(("error", payload))
+                        break
+            except (EOFError, OSError) as e:
+                reason = f"Worker {worker['id']} died: {str(e) or type(e).__name__}"
+                request.chunks.put(("error", reason))
+                with self._cond:
+                    self._worker_died(worker, reason)
+                break
+            finally:
+                worker["busy"] += time.perf_counter() - start
+                worker["requests"] += 1
+                worker["current"] = None
+
+    def get_worker_stats(self) -> List[dict]:
+        """Return per-worker request counts, throughput and utilization since start."""
+        uptime = max(time.perf_counter() - self._started, 1e-9)
+        return [{
+            "worker": worker["id"],
+            "pid": worker["pid"],
+            "ready": worker["ready"],
+            "busy": worker["current"] is not None,
+            "requests": worker["requests"],
+            "tokens": worker["tokens"],
+            "tokens_per_second": worker["tokens"] / worker["busy"] if worker["busy"] else 0.0,
+            "utilization": min(worker["busy"] / uptime, 1.0)
+        } for worker in self._workers]
+
+    def get_model_info(self) -> dict:
+        """Return model configuration and pool status."""
+        return {
+            "model": self.session_model,
+            "model_path": self.config.get("model_path"),
+            "model_type": self.config.get("model_type"),
+            "temperature": self.config.get("temperature"),
+            "max_tokens": self.config.get("max_tokens"),
+            "gpu_layers": self.config.get("gpu_layers"),
+            "is_loaded": self.is_model_loaded(),
+            "response_cache": None,
+            "semantic_cache": None,
+            "retrieval": None,
+            "scheduler": None,
+            "workers": self.get_worker_stats()
+        }
+
+    def close(self):
+        """Stop all worker processes."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            try:
+                with worker["send_lock"]:
+                    worker["conn"].send(("stop", None))
+            except (OSError, EOFError):
+                pass
+            worker["process"].join(timeout=5)
+        self.prompt_manager.close()
@@ -0,0 +1,193 @@
+"""
+Windowed chat display for TinyllamaChatbot
+"""
+
+import tkinter as tk
+from tkinter import scrolledtext
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List
+
+SPEAKERS = {"user": "You: ", "assistant": "Assistant: ", "system": "System: "}
+
+class ChatMessage:
+    """One entry of the chat; ``text`` grows while a reply streams in."""
+
+    __slots__ = ("role", "timestamp", "text")
+
+    def __init__(self, role: str, text: str = ""):
+        self.role = role
+        self.timestamp = datetime.now().strftime("%H:%M:%S")
+        self.text = text
+
+
+class ChatView:
+    """Chat display that keeps only a window of messages in the Text widget.
+
+    Every message lives in ``messages``; only ``messages[first:last]`` is
+    rendered, at most ``window`` of them plus one ``page`` being scrolled
+    in. Scrolling to the top or bottom edge of the rendered part pages
+    neighbouring messages in and drops as many from the other end, so the
+    widget's size, and with it insert and scroll latency, stays the same
+    however long the session gets. Each rendered message starts at a mark
+    named ``m<index>`` (right gravity, so text inserted in front of a
+    message pushes its mark along), which makes dropping a range a single
+    delete.
+
+    Only the widget is bounded: ``messages`` itself keeps the text of every
+    message of the session in memory until ``clear()``, so a session of
+    many thousands of long replies still grows the process by their size.
+    Sessions that long are better read back page by page from the
+    conversation store's history browser.
+
+    Edits done inside ``batch()`` share one NORMAL/DISABLED state toggle
+    and one scroll to the end.
+    """
+
+    def __init__(self, parent, window: int = 200, page: int = 50, **text_options):
+        self.window = max(window, page * 2)
+        self.page = page
+        self.messages: List[ChatMessage] = []
+        self.first = 0
+        self.last = 0
+        self._depth = 0
+        self._scroll_to_end = False
+        self._paging = False
+
+        self.text = scrolledtext.ScrolledText(parent, state=tk.DISABLED, **text_options)
+        self.text.config(yscrollcommand=self.on_scroll)
+
+    # Editing
+
+    @contextmanager
+    def batch(self):
+        """Group edits into a single state toggle and scroll"""
+        if self._depth == 0:
+            self.text.config(state=tk.NORMAL)
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self.text.config(state=tk.DISABLED)
+                if self._scroll_to_end:
+                    self._scroll_to_end = False
+                    self.text.see(tk.END)
+
+    def add(self, role: str, text: str = "") -> ChatMessage:
+        """Append a message and scroll to it"""
+        message = ChatMessage(role, text)
+        with self.batch():
+            if self.last < len(self.messages):
+                # Scrolled away from the newest messages: jump back to them
+                self._render_tail()
+            self.messages.append(message)
+            self._render(len(self.messages) - 1, tk.END)
+            self.last = len(self.messages)
+            self._trim_top()
+            self._scroll_to_end = True
+        return message
+
+    def append_text(self, text: str):
+        """Extend the last message, e.g. with newly streamed text"""
+        if not self.messages:
+            return
+        with self.batch():
+            if self.last < len(self.messages):
+                self._render_tail()
+            self.messages[-1].text += text
+            self.text.insert(tk.END, text)
+            self._scroll_to_end = True
+
+    def clear(self):
+        """Remove every message"""
+        with self.batch():
+            self.text.delete("1.0", tk.END)
+            for index in range(self.first, self.last):
+                self.text.mark_unset(f"m{index}")
+        self.messages.clear()
+        self.first = self.last = 0
+
+    # Rendering
+
+    def _render(self, index: int, position: str):
+        """Insert message ``index`` at ``position`` (END or the start of another message)"""
+        message = self.messages[index]
+        start = self.text.index(position if position != tk.END else "end-1c")
+        self.text.insert(position, f"[{message.timestamp}] ", "timestamp",
+                         SPEAKERS.get(message.role, ""), message.role,
+                         message.text, ())
+        self.text.mark_set(f"m{index}", start)
+
+    def _render_tail(self):
+        """Re-render the newest messages"""
+        self.text.delete("1.0", tk.END)
+        for index in range(self.first, self.last):
+            self.text.mark_unset(f"m{index}")
+        self.first = max(0, len(self.messages) - self.window)
+        for index in range(self.first, len(self.messages)):
+            self._render(index, tk.END)
+        self.last = len(self.messages)
+
+    def _trim_top(self):
+        excess = (self.last - self.first) - self.window
+        if excess <= 0:
+            return
+        cut = self.first + excess
+        self.text.delete("1.0", f"m{cut}")
+        for index in range(self.first, cut):
+            self.text.mark_unset(f"m{index}")
+        self.first = cut
+
+    def _trim_bottom(self):
+        excess = (self.last - self.first) - self.window
+        if excess <= 0:
+            return
+        cut = self.last - excess
+        self.text.delete(f"m{cut}", tk.END)
+        for index in range(cut, self.last):
+            self.text.mark_unset(f"m{index}")
+        self.last = cut
+
+    # Paging
+
+    def on_scroll(self, first: str, last: str):
+        """Scrollbar callback: page older or newer messages in at the edges"""
+        self.text.vbar.set(first, last)
+        if self._paging:
+            return
+        if float(first) <= 0.0 and self.first > 0:
+            self._paging = True
+            self.text.after_idle(self.page_older)
+        elif float(last) >= 1.0 and self.last < len(self.messages):
+            self._paging = True
+            self.text.after_idle(self.page_newer)
+
+    def page_older(self):
+        """Render the page of messages above the window, keeping the view in place"""
+        self._paging = False
+        if self.first == 0:
+            return
+        start = max(0, self.first - self.page)
+        self.text.mark_set("view", "@0,0")
+        with self.batch():
+            for index in range(self.first - 1, start - 1, -1):
+                self._render(index, f"m{index + 1}")
+            self.first = start
+            self._trim_bottom()
+        self.text.yview("view")
+
+    def page_newer(self):
+        """Render the page of messages below the window, keeping the view in place"""
+        self._paging = False
+        if self.last >= len(self.messages):
+            return
+        end = min(len(self.messages), self.last + self.page)
+        self.text.mark_set("view", "@0,0")
+        with self.batch():
+            for index in range(self.last, end):
+                self._render(index, tk.END)
+            self.last = end
+            self._trim_top()
+        self.text.yview("view")
@@ -0,0 +1,180 @@
+"""
+Conversation history browser for TinyllamaChatbot
+"""
+
+import tkinter as tk
+from tkinter import ttk, scrolledtext
+from datetime import datetime
+from typing import Callable, Optional
+
+# Sessions and messages are loaded from the store in pages of this size
+PAGE_SIZE = 50
+
+class HistoryBrowser:
+    """Window listing stored sessions, with full-text search and paged message loading.
+
+    Nothing is loaded up front: the session list grows a page at a time as
+    it is scrolled to the bottom, and a session's messages are read from
+    the newest page backwards as the transcript is scrolled to the top.
+    """
+
+    def __init__(self, root: tk.Tk, store, on_resume: Optional[Callable[[int], None]] = None):
+        self.store = store
+        self.on_resume = on_resume
+        self.sessions = []
+        self.sessions_exhausted = False
+        self.session_id = None
+        self.oldest_message_id = None
+        self.messages_exhausted = False
+        self.load_pending = False
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Conversation History")
+        self.window.geometry("760x520")
+        self.setup_widgets()
+        self.load_more_sessions()
+
+    def setup_widgets(self):
+        """Create the search bar, session list and transcript panes"""
+        self.window.columnconfigure(1, weight=1)
+        self.window.rowconfigure(1, weight=1)
+
+        search_frame = ttk.Frame(self.window, padding=(5, 5))
+        search_frame.grid(row=0, column=0, columnspan=2, sticky="ew")
+        search_frame.columnconfigure(0, weight=1)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        search_entry.grid(row=0, column=0, sticky="ew")
+        search_entry.bind('<Return>', lambda event: self.search())
+        ttk.Button(search_frame, text="Search", command=self.search).grid(row=0, column=1, padx=(5, 0))
+        ttk.Button(search_frame, text="All Sessions", command=self.show_sessions).grid(row=0, column=2, padx=(5, 0))
+
+        list_frame = ttk.Frame(self.window, padding=(5, 0))
+        list_frame.grid(row=1, column=0, sticky="ns")
+        list_frame.rowconfigure(0, weight=1)
+        self.session_list = tk.Listbox(list_frame, width=34, exportselection=False)
+        self.session_list.grid(row=0, column=0, sticky="ns")
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.session_list.yview)
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.session_list.config(yscrollcommand=lambda first, last: self.on_list_scroll(scrollbar, first, last))
+        self.session_list.bind('<<ListboxSelect>>', self.on_select)
+
+        self.transcript = scrolledtext.ScrolledText(self.window, wrap=tk.WORD, state=tk.DISABLED,
+                                                    font=("Consolas", 10))
+        self.transcript.grid(row=1, column=1, sticky="nsew", padx=(0, 5))
+        self.transcript.config(yscrollcommand=self.on_transcript_scroll)
+
+        button_frame = ttk.Frame(self.window, padding=(5, 5))
+        button_frame.grid(row=2, column=0, columnspan=2, sticky="ew")
+        self.resume_button = ttk.Button(button_frame, text="Resume Conversation",
+                                        command=self.resume, state=tk.DISABLED)
+        self.resume_button.pack(side=tk.RIGHT)
+        self.status_var = tk.StringVar()
+        ttk.Label(button_frame, textvariable=self.status_var).pack(side=tk.LEFT)
+
+    def show_sessions(self):
+        """Go back from search results to the session list"""
+        self.sessions = []
+        self.sessions_exhausted = False
+        self.session_list.delete(0, tk.END)
+        self.load_more_sessions()
+
+    def load_more_sessions(self):
+        """Append the next page of sessions to the list"""
+        if self.sessions_exhausted:
+            return
+        last = self.sessions[-1] if self.sessions else None
+        before = (last["updated"], last["id"]) if last else None
+        page = self.store.list_sessions(limit=PAGE_SIZE, before=before)
+        self.sessions_exhausted = len(page) < PAGE_SIZE
+        for session in page:
+            self.sessions.append(session)
+            day = datetime.fromtimestamp(session["updated"]).strftime("%Y-%m-%d %H:%M")
+            self.session_list.insert(tk.END, f"{day}  {session['title']} ({session['messages']})")
+        self.status_var.set(f"{len(self.sessions)} sessions loaded")
+
+    def on_list_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        if float(last) >= 1.0 and not self.sessions_exhausted:
+            self.schedule_load(self.load_more_sessions)
+
+    def search(self):
+        """Replace the session list with full-text search hits"""
+        query = self.search_var.get().strip()
+        if not query:
+            self.show_sessions()
+            return
+        hits = self.store.search(query, limit=PAGE_SIZE * 4)
+        self.sessions_exhausted = True
+        self.sessions = []
+        self.session_list.delete(0, tk.END)
+        for hit in hits:
+            self.sessions.append({"id": hit["session_id"], "updated": hit["created"]})
+            self.session_list.insert(tk.END, f"{hit['role']}: {hit['snippet']}")
+        self.status_var.set(f"{len(hits)} matches for '{query}'")
+
+    def on_select(self, event):
+        selection = self.session_list.curselection()
+        if not selection:
+            return
+        self.open_session(self.sessions[selection[0]]["id"])
+
+    def open_session(self, session_id: int):
+        """Show the latest page of a session's messages"""
+        self.session_id = session_id
+        self.oldest_message_id = None
+        self.messages_exhausted = False
+        self.transcript.config(state=tk.NORMAL)
+        self.transcript.delete("1.0", tk.END)
+        self.transcript.config(state=tk.DISABLED)
+        self.load_older_messages()
+        self.transcript.see(tk.END)
+        self.resume_button.config(state=tk.NORMAL if self.on_resume else tk.DISABLED)
+
+    def load_older_messages(self):
+        """Prepend the page of messages before the oldest one shown"""
+        if self.session_id is None or self.messages_exhausted:
+            return
+        page = self.store.get_messages(self.session_id, limit=PAGE_SIZE, before_id=self.oldest_message_id)
+        self.messages_exhausted = len(page) < PAGE_SIZE
+        if not page:
+            return
+        self.oldest_message_id = page[0]["id"]
+
+        text = ""
+        for message in page:
+            timestamp = datetime.fromtimestamp(message["created"]).strftime("%H:%M:%S")
+            speaker = "You" if message["role"] == "user" else "Bot"
+            text += f"[{timestamp}] {speaker}: {message['content']}\n\n"
+
+        # Keep the view anchored on what was on screen before the insert
+        top_line = self.transcript.index("@0,0")
+        self.transcript.config(state=tk.NORMAL)
+        self.transcript.insert("1.0", text)
+        self.transcript.config(state=tk.DISABLED)
+        added = text.count("\n")
+        line, column = top_line.split(".")
+        self.transcript.yview(f"{int(line) + added}.{column}")
+
+    def on_transcript_scroll(self, first, last):
+        self.transcript.vbar.set(first, last)
+        if float(first) <= 0.0 and float(last) < 1.0 and not self.messages_exhausted:
+            self.schedule_load(self.load_older_messages)
+
+    def schedule_load(self, load: Callable[[], None]):
+        """Run a page load once the current scroll event is handled, at most one at a time"""
+        if self.load_pending:
+            return
+        self.load_pending = True
+
+        def run():
+            self.load_pending = False
+            load()
+
+        self.window.after_idle(run)
+
+    def resume(self):
+        """Continue the selected session in the main window"""
+        if self.session_id is not None and self.on_resume:
+            self.on_resume(self.session_id)
+            self.window.destroy()
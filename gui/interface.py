@@ -5,21 +5,31 @@ Tkinter GUI Interface for TinyllamaChatbot
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 import threading
+import queue
 import logging
-from datetime import datetime
 from typing import Optional
 
-from core.prompt_manager import PromptManager
+from core.metrics import metrics
+from gui.chat_view import ChatView
+from gui.history_browser import HistoryBrowser
 from core.utils import clean_text
 
+# Streamed chunks are coalesced and flushed to the chat view at most this often (~30 fps)
+STREAM_FLUSH_MS = 33
+# Refresh interval of the live stats panel
+STATS_REFRESH_MS = 1000
+
 class ChatbotGUI:
     """Main GUI class for the TinyllamaChatbot"""
 
     def __init__(self, root: tk.Tk, chatbot):
         self.root = root
         self.chatbot = chatbot
-        self.prompt_manager = PromptManager()
+        self.prompt_manager = chatbot.prompt_manager
         self.is_generating = False
+        self.stop_requested = False
+        self.stream_queue = queue.Queue()
+        self.stats_window = None
 
         self.setup_gui()
         self.load_model_async()
@@ -54,16 +64,20 @@ class ChatbotGUI:
         self.info_button = ttk.Button(status_frame, text="Model Info", command=self.show_model_info)
         self.info_button.grid(row=0, column=2, sticky="e")
 
+        self.stats_button = ttk.Button(status_frame, text="Stats", command=self.show_stats)
+        self.stats_button.grid(row=0, column=3, sticky="e", padx=(5, 0))
+
         # Chat display
         chat_frame = ttk.LabelFrame(main_frame, text="Chat History", padding="5")
         chat_frame.grid(row=1, column=0, sticky="nsew", pady=(0, 10))
         chat_frame.columnconfigure(0, weight=1)
         chat_frame.rowconfigure(0, weight=1)
 
-        self.chat_display = scrolledtext.ScrolledText(
-            chat_frame, wrap=tk.WORD, width=70, height=20,
-            state=tk.DISABLED, font=('Consolas', 10)
+        self.chat_view = ChatView(
+            chat_frame, window=self.chatbot.config.get("chat_view_window", 200),
+            wrap=tk.WORD, width=70, height=20, font=('Consolas', 10)
         )
+        self.chat_display = self.chat_view.text
         self.chat_display.grid(row=0, column=0, sticky="nsew")
 
         self.chat_display.tag_configure("user", foreground="blue", font=('Consolas', 10, 'bold'))
@@ -90,6 +104,7 @@ class ChatbotGUI:
 
         self.input_text.bind('<Return>', self.on_enter_key)
         self.input_text.bind('<Shift-Return>', self.on_shift_enter)
+        self.root.bind('<Escape>', lambda event: self.stop_generation())
 
         self.create_menu()
         self.add_system_message("Welcome to Tinyllama Chatbot! Loading model, please wait...")
@@ -110,6 +125,17 @@ class ChatbotGUI:
         edit_menu.add_command(label="Clear Chat", command=self.clear_chat)
         edit_menu.add_command(label="Clear History", command=self.clear_history)
 
+        history_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="History", menu=history_menu)
+        history_menu.add_command(label="New Conversation", command=self.new_conversation)
+        history_menu.add_command(label="Browse Conversations...", command=self.browse_history)
+        history_menu.add_separator()
+        history_menu.add_command(label="Export All Conversations", command=self.export_all_history)
+
+        self.model_var = tk.StringVar()
+        self.model_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Model", menu=self.model_menu)
+
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Help", menu=help_menu)
         help_menu.add_command(label="About", command=self.show_about)
@@ -129,11 +155,58 @@ class ChatbotGUI:
             self.status_label.config(foreground="green")
             self.send_button.config(state=tk.NORMAL)
             self.add_system_message("Model loaded successfully! You can now start chatting.")
+            self.populate_model_menu()
         else:
             self.status_var.set("Model Load Failed")
             self.status_label.config(foreground="red")
             self.add_system_message("Failed to load model. Please check the model file and configuration.")
 
+    def populate_model_menu(self):
+        """List the models found in the model directory"""
+        self.model_menu.delete(0, tk.END)
+        models = self.chatbot.list_models()
+        for model in models:
+            if model["active"]:
+                self.model_var.set(model["name"])
+            self.model_menu.add_radiobutton(label=model["name"], value=model["name"], variable=self.model_var,
+                                            command=lambda name=model["name"]: self.switch_model(name))
+        self.model_menu.add_separator()
+        self.model_menu.add_command(label="Rescan Model Folder", command=self.rescan_models)
+
+    def rescan_models(self):
+        """Pick up model files added since startup"""
+        self.chatbot.registry.scan()
+        self.populate_model_menu()
+
+    def switch_model(self, name: str):
+        """Continue the conversation with another model, loading it in the background if needed"""
+        if self.is_generating:
+            messagebox.showwarning("Switch Model", "Wait for the current reply to finish.")
+            self.populate_model_menu()
+            return
+        self.is_generating = True
+        self.send_button.config(state=tk.DISABLED)
+        self.status_var.set(f"Switching to {name}...")
+        self.status_label.config(foreground="orange")
+
+        def switch():
+            success = self.chatbot.select_model(name)
+            self.root.after(0, self.on_model_switched, name, success)
+
+        threading.Thread(target=switch, daemon=True).start()
+
+    def on_model_switched(self, name: str, success: bool):
+        """Called when a model switch is complete"""
+        self.is_generating = False
+        self.send_button.config(state=tk.NORMAL)
+        self.status_var.set("Ready")
+        self.status_label.config(foreground="green")
+        if success:
+            self.add_system_message(f"Switched to {name}.")
+        else:
+            self.add_system_message(f"Failed to load {name}. Please check the model file.")
+        self.populate_model_menu()
+
     def on_enter_key(self, event):
         """Handle Enter key press"""
         if not event.state & 0x1:  # Shift not pressed
@@ -158,100 +231,261 @@ class ChatbotGUI:
         self.add_user_message(user_input)
 
         self.is_generating = True
-        self.send_button.config(state=tk.DISABLED, text="Generating...")
+        self.stop_requested = False
+        self.send_button.config(text="Stop", command=self.stop_generation)
         self.status_var.set("Generating response...")
         self.status_label.config(foreground="orange")
 
+        self.begin_assistant_message()
+
         def generate_response():
             try:
-                prompt = self.prompt_manager.format_prompt(user_input)
-                response = self.chatbot.generate_response(prompt)
-                self.prompt_manager.add_to_history(user_input, response)
-                self.root.after(0, self.on_response_generated, response)
+                # The chatbot formats the prompt and records the turn in its history
+                for chunk in self.chatbot.stream_response(user_input):
+                    self.stream_queue.put(chunk)
             except Exception as e:
                 logging.error(f"Error generating response: {e}")
-                self.root.after(0, self.on_response_generated, f"Error: {str(e)}")
+                self.stream_queue.put(f"Error: {str(e)}")
+            self.stream_queue.put(None)
 
         threading.Thread(target=generate_response, daemon=True).start()
+        self.root.after(STREAM_FLUSH_MS, self.flush_stream)
+
+    def flush_stream(self):
+        """Append all chunks streamed since the last flush in a single insert"""
+        chunks = []
+        finished = False
+        while True:
+            try:
+                chunk = self.stream_queue.get_nowait()
+            except queue.Empty:
+                break
+            if chunk is None:
+                finished = True
+                break
+            chunks.append(chunk)
+
+        if chunks:
+            self.append_assistant_text("".join(chunks))
+
+        if finished:
+            self.on_response_generated()
+        else:
+            self.root.after(STREAM_FLUSH_MS, self.flush_stream)
+
+    def stop_generation(self):
+        """Stop the reply being generated; the text produced so far is kept"""
+        if not self.is_generating or self.stop_requested:
+            return
+        self.stop_requested = True
+        self.chatbot.cancel()
+        self.send_button.config(state=tk.DISABLED, text="Stopping...")
+        self.status_var.set("Stopping...")
 
-    def on_response_generated(self, response: str):
+    def on_response_generated(self):
         """Handle response completion"""
-        self.add_assistant_message(response)
+        self.append_assistant_text(" [stopped]\n\n" if self.stop_requested else "\n\n")
         self.is_generating = False
-        self.send_button.config(state=tk.NORMAL, text="Send")
+        self.send_button.config(state=tk.NORMAL, text="Send", command=self.send_message)
         self.status_var.set("Ready")
         self.status_label.config(foreground="green")
         self.input_text.focus_set()
 
     def add_user_message(self, message: str):
         """Display user message"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        self.chat_display.insert(tk.END, "You: ", "user")
-        self.chat_display.insert(tk.END, f"{message}\n\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        self.chat_view.add("user", f"{message}\n\n")
 
     def add_assistant_message(self, message: str):
         """Display assistant message"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        self.chat_display.insert(tk.END, "Assistant: ", "assistant")
-        self.chat_display.insert(tk.END, f"{message}\n\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        self.chat_view.add("assistant", f"{message}\n\n")
+
+    def begin_assistant_message(self):
+        """Start an assistant message that is filled in as the response streams"""
+        self.chat_view.add("assistant")
+
+    def append_assistant_text(self, text: str):
+        """Append streamed text to the assistant message in progress"""
+        self.chat_view.append_text(text)
 
     def add_system_message(self, message: str):
         """Display system message"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        self.chat_display.insert(tk.END, "System: ", "system")
-        self.chat_display.insert(tk.END, f"{message}\n\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        self.chat_view.add("system", f"{message}\n\n")
 
     def clear_chat(self):
         """Clear chat display"""
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.delete("1.0", tk.END)
-        self.chat_display.config(state=tk.DISABLED)
+        self.chat_view.clear()
         self.add_system_message("Chat cleared.")
 
+    def run_in_background(self, status: str, work, on_done):
+        """Run ``work`` off the Tk thread, since it may wait for the model, then ``on_done(result)`` on it"""
+        self.is_generating = True
+        self.send_button.config(state=tk.DISABLED)
+        self.status_var.set(status)
+        self.status_label.config(foreground="orange")
+
+        def run():
+            result = None
+            try:
+                result = work()
+            finally:
+                self.root.after(0, self.on_background_done, on_done, result)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def on_background_done(self, on_done, result):
+        """Called when work started by ``run_in_background`` is complete"""
+        self.is_generating = False
+        self.send_button.config(state=tk.NORMAL)
+        self.status_var.set("Ready")
+        self.status_label.config(foreground="green")
+        on_done(result)
+
     def clear_history(self):
         """Clear conversation history"""
-        self.prompt_manager.clear_history()
-        self.add_system_message("Conversation history cleared.")
+        if self.is_generating:
+            messagebox.showwarning("Clear History", "Wait for the current reply to finish.")
+            return
+        self.run_in_background("Clearing history...", self.chatbot.clear_history,
+                               lambda _: self.add_system_message("Conversation history cleared."))
 
-    def export_history(self):
+    def new_conversation(self):
+        """Start a new stored conversation with an empty chat"""
+        if self.is_generating:
+            messagebox.showwarning("New Conversation", "Wait for the current reply to finish.")
+            return
+        self.run_in_background("Starting a new conversation...", self.chatbot.clear_history,
+                               lambda _: self.clear_chat())
+
+    def browse_history(self):
+        """Open the stored conversation browser"""
+        if self.prompt_manager.store is None:
+            messagebox.showinfo("Conversation History",
+                                "The conversation store is disabled (conversation_store_enabled).")
+            return
+        HistoryBrowser(self.root, self.prompt_manager.store, on_resume=self.resume_conversation)
+
+    def resume_conversation(self, session_id: int):
+        """Continue a stored conversation in the chat window"""
+        if self.is_generating:
+            messagebox.showwarning("Conversation History", "Wait for the current reply to finish.")
+            return
+        self.run_in_background("Resuming conversation...", lambda: self.chatbot.resume_session(session_id),
+                               self.show_resumed_conversation)
+
+    def show_resumed_conversation(self, turns):
+        """Replace the chat with the recent turns of a resumed conversation"""
+        turns = turns or []
+        with self.chat_view.batch():
+            self.chat_view.clear()
+            for user_msg, bot_msg in turns:
+                self.add_user_message(user_msg)
+                self.add_assistant_message(bot_msg)
+            self.add_system_message(f"Resumed conversation with {len(turns)} recent turns.")
+
+    def export_history(self, all_sessions: bool = False):
         """Export chat history to file"""
         filename = filedialog.asksaveasfilename(
             defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            filetypes=[("JSON files", "*.json"), ("JSON Lines", "*.jsonl"), ("Text files", "*.txt"),
+                       ("All files", "*.*")],
             title="Export Chat History"
         )
         if filename:
-            success = self.prompt_manager.export_history(filename)
+            success = self.prompt_manager.export_history(filename, all_sessions=all_sessions)
             if success:
                 messagebox.showinfo("Export Successful", f"Chat history exported to {filename}")
             else:
                 messagebox.showerror("Export Failed", "Failed to export chat history")
 
+    def export_all_history(self):
+        """Export every stored conversation"""
+        self.export_history(all_sessions=True)
+
     def show_model_info(self):
         """Show model information dialog"""
         info = self.chatbot.get_model_info()
+        cache = info.get('response_cache')
+        cache_text = (f"{cache['entries']} entries, {cache['hits']} hits / {cache['misses']} misses"
+                      if cache else "Disabled")
         info_text = f"""Model Information:
 
+Model: {info.get('model')}
 Path: {info['model_path']}
 Type: {info['model_type']}
 Temperature: {info['temperature']}
 Max Tokens: {info['max_tokens']}
 GPU Layers: {info['gpu_layers']}
-Status: {'Loaded' if info['is_loaded'] else 'Not Loaded'}"""
+Status: {'Loaded' if info['is_loaded'] else 'Not Loaded'}
+Response Cache: {cache_text}"""
+        semantic = info.get('semantic_cache')
+        if semantic:
+            info_text += (f"\nSemantic Cache: {semantic['entries']} entries, {semantic['hit_rate']:.0%} hit rate, "
+                          f"{semantic['saved_seconds']:.1f}s saved")
+        retrieval = info.get('retrieval')
+        if retrieval:
+            info_text += f"\nDocuments: {retrieval['passages']} passages from {retrieval['files']} files"
+        for lane, counts in (info.get('scheduler') or {}).items():
+            info_text += (f"\nQueue {lane}: {counts['queued']} waiting, {counts['admitted']} admitted, "
+                          f"{counts['rejected']} rejected, {counts['occupancy']:.0%} of the time on the model")
+        gguf = info.get('gguf')
+        if gguf:
+            info_text += (f"\nGGUF v{gguf['version']}: {gguf['architecture']}, {gguf['quantization']}, "
+                          f"{gguf['tensor_count']} tensors, trained context {gguf['context_length']}")
+        if info.get('resident_models'):
+            info_text += f"\nLoaded Models: {', '.join(info['resident_models'])}"
+        if info.get('startup_timings'):
+            info_text += "\nStartup: " + ", ".join(
+                f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in info['startup_timings'].items())
+        for worker in info.get('workers', []):
+            info_text += (f"\nWorker {worker['worker']}: {worker['utilization']:.0%} busy, "
+                          f"{worker['requests']} requests, {worker['tokens_per_second']:.1f} tokens/s")
         messagebox.showinfo("Model Information", info_text)
 
+    def show_stats(self):
+        """Open the live request metrics panel"""
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title("Request Stats")
+        self.stats_window.geometry("520x480")
+        self.stats_text = scrolledtext.ScrolledText(self.stats_window, font=("Consolas", 9), state=tk.DISABLED)
+        self.stats_text.pack(fill=tk.BOTH, expand=True)
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        """Redraw the stats panel and schedule the next refresh while it is open"""
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            self.stats_window = None
+            return
+
+        snapshot = metrics.snapshot()
+        if not snapshot["enabled"]:
+            lines = ["Metrics are disabled (set \"metrics_enabled\": true in settings.json)."]
+        else:
+            lines = [f"Uptime: {snapshot['uptime']:.0f}s", "", "Counters:"]
+            lines += [f"  {name}: {value:g}" for name, value in sorted(snapshot["counters"].items())]
+            if snapshot["gauges"]:
+                lines += ["", "Gauges:"]
+                lines += [f"  {name}: {value:g}" for name, value in sorted(snapshot["gauges"].items())]
+            lines += ["", f"{'Histogram':<30}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}"]
+            for name, h in sorted(snapshot["histograms"].items()):
+                lines.append(f"{name:<30}{h['count']:>7}{h['mean']:>10.4g}{h['p50']:>10.4g}"
+                             f"{h['p95']:>10.4g}{h['p99']:>10.4g}")
+            if snapshot["recent_traces"]:
+                last = snapshot["recent_traces"][-1]
+                lines += ["", f"Last {last['kind']} ({last['elapsed'] * 1000:.1f} ms):"]
+                lines += [f"  {name}: {seconds * 1000:.2f} ms" for name, seconds in last["spans"].items()]
+
+        position = self.stats_text.yview()[0]
+        self.stats_text.config(state=tk.NORMAL)
+        self.stats_text.delete("1.0", tk.END)
+        self.stats_text.insert(tk.END, "\n".join(lines))
+        self.stats_text.config(state=tk.DISABLED)
+        self.stats_text.yview_moveto(position)
+        self.stats_window.after(STATS_REFRESH_MS, self.refresh_stats)
+
     def show_about(self):
         """Show about dialog"""
         about_text = """TinyllamaChatbot v1.0
@@ -1,46 +1,388 @@
-#!/usr/bin/env python3
-"""
-TinyllamaChatbot - Main Entry Point
-A fully offline AI chatbot powered by Tinyllama 1B GGUF model
-"""
-
-import sys
-import os
-import tkinter as tk
-from tkinter import messagebox
-import threading
-
-# Add project root to path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
-from gui.interface import ChatbotGUI
-from core.chatbot import TinyllamaChatbot
-from core.utils import setup_logging
-
-def main():
-    """Main entry point for the TinyllamaChatbot application."""
-    try:
-        # Setup logging
-        setup_logging()
-        
-        # Create root window
-        root = tk.Tk()
-        root.title("Tinyllama Chatbot (Offline)")
-        root.geometry("800x600")
-        root.minsize(600, 400)
-        
-        # Initialize chatbot
-        chatbot = TinyllamaChatbot()
-        
-        # Create GUI
-        gui = ChatbotGUI(root, chatbot)
-        
-        # Start the application
-        root.mainloop()
-        
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to start application: {str(e)}")
-        sys.exit(1)
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+TinyllamaChatbot - Main Entry Point
+A fully offline AI chatbot powered by Tinyllama 1B GGUF model
+"""
+
+import sys
+import os
+import time
+import logging
+import argparse
+
+START_TIME = time.perf_counter()
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.utils import load_config, setup_logging
+
+def create_chatbot(workers: int = None):
+    """Create the chatbot, or a multi-process worker pool when more than one worker is configured."""
+    if workers is None:
+        workers = load_config().get("pool_workers", 1)
+    if workers and workers > 1:
+        from core.worker_pool import ModelWorkerPool
+        return ModelWorkerPool(num_workers=workers)
+    from core.chatbot import TinyllamaChatbot
+    return TinyllamaChatbot()
+
+def run_gui():
+    """Start the Tkinter chat window."""
+    # Imported here so headless modes never need a display or Tk installed
+    import tkinter as tk
+    from tkinter import messagebox
+
+    logger = logging.getLogger(__name__)
+    try:
+        # Create root window and paint it before anything heavy is imported
+        root = tk.Tk()
+        root.title("Tinyllama Chatbot (Offline)")
+        root.geometry("800x600")
+        root.minsize(600, 400)
+        root.update()
+        window_shown = time.perf_counter()
+        logger.info(f"Startup: window shown after {(window_shown - START_TIME) * 1000:.0f} ms")
+
+        from gui.interface import ChatbotGUI
+
+        # Initialize chatbot
+        chatbot = create_chatbot()
+
+        # Create GUI; the model itself loads in the background
+        gui = ChatbotGUI(root, chatbot)
+        logger.info(f"Startup: interface ready after {(time.perf_counter() - START_TIME) * 1000:.0f} ms "
+                    f"({(time.perf_counter() - window_shown) * 1000:.0f} ms imports and setup)")
+
+        # Start the application
+        root.mainloop()
+
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to start application: {str(e)}")
+        sys.exit(1)
+
+def run_server(args):
+    """Serve the model over an OpenAI-compatible HTTP API."""
+    from server.api_server import ChatbotServer
+
+    chatbot = create_chatbot(args.workers)
+    config = chatbot.config
+    server = ChatbotServer(
+        chatbot,
+        host=args.host or config.get("server_host", "127.0.0.1"),
+        port=args.port or config.get("server_port", 8000),
+        queue_size=args.queue_size or config.get("server_queue_size", 8),
+        request_timeout=args.timeout or config.get("server_request_timeout", 120)
+    )
+    server.serve_forever()
+
+def run_batch(args):
+    """Run every prompt of a JSONL file through the model without the GUI."""
+    from cli.batch import BatchRunner
+
+    runner = BatchRunner(
+        create_chatbot(args.workers), args.input, args.output,
+        prompt_field=args.prompt_field,
+        checkpoint_every=args.checkpoint_every
+    )
+    try:
+        runner.run()
+    except Exception as e:
+        print(f"Batch run failed: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+def run_benchmark(args):
+    """Sweep model settings and record load time, TTFT, tokens/s and latency percentiles."""
+    import json
+    from bench.benchmark import (InferenceBenchmark, write_json, write_csv, compare_to_baseline,
+                                 speculative_speedups)
+
+    def values(text, cast=int):
+        return [cast(v) for v in text.split(",")] if text else None
+
+    config = load_config()
+    grid = {
+        "threads": values(args.threads) or [config.get("threads", -1)],
+        "batch_size": values(args.batch_size) or [config.get("batch_size", 8)],
+        "context_length": values(args.context_length) or [config.get("context_length", 2048)],
+        "max_tokens": values(args.max_tokens) or [config.get("max_tokens", 256)]
+    }
+    if args.speculative:
+        # Speculation only applies to greedy decoding
+        grid["temperature"] = [0]
+        grid["speculative_decoding"] = [False, True]
+    overrides = {}
+    if args.fake:
+        overrides = {
+            "backend": "fake",
+            "fake_token_delay": args.token_delay,
+            "fake_prompt_token_delay": args.prompt_token_delay
+        }
+
+    results = InferenceBenchmark(grid, runs=args.runs, config_overrides=overrides).run()
+    write_json(results, args.output)
+    if args.csv:
+        write_csv(results, args.csv)
+
+    for result in results["results"]:
+        if "error" in result:
+            print(f"{result['settings']}: {result['error']}")
+            continue
+        print(
+            f"{result['settings']}: load {result['load_time']:.2f}s | "
+            f"TTFT p50 {result['ttft']['p50'] * 1000:.0f} ms | "
+            f"{result['tokens_per_second']['p50']:.1f} tokens/s | "
+            f"e2e p50 {result['e2e_latency']['p50']:.2f}s p99 {result['e2e_latency']['p99']:.2f}s | "
+            f"cache hit p50 {result['cache_hit_latency']['p50'] * 1e6:.0f} us"
+        )
+    for speedup in speculative_speedups(results):
+        print(f"Speculative decoding {speedup['settings']}: {speedup['speedup']:.2f}x tokens/s, "
+              f"{speedup['acceptance_rate']:.0%} of draft tokens accepted")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+def run_loadtest(args):
+    """Replay a JSONL request trace under load and report latency percentiles and throughput."""
+    from bench.benchmark import write_json
+    from bench.loadtest import HTTPTarget, InProcessTarget, LoadTest, format_summary, read_trace
+
+    if args.url:
+        target = HTTPTarget(args.url)
+    elif args.fake:
+        from core.chatbot import TinyllamaChatbot
+        target = InProcessTarget(TinyllamaChatbot({
+            "backend": "fake",
+            "fake_token_delay": args.token_delay,
+            "fake_prompt_token_delay": args.prompt_token_delay,
+            "logging_enabled": False,
+            "conversation_store_enabled": False
+        }), use_cache=args.cache)
+    else:
+        target = InProcessTarget(create_chatbot(args.workers), use_cache=args.cache)
+
+    try:
+        report = LoadTest(
+            target, read_trace(args.trace, args.prompt_field),
+            concurrency=args.concurrency, rate=args.rate, ramp_up=args.ramp_up,
+            requests=args.requests, poisson=args.poisson, seed=args.seed
+        ).run()
+    except Exception as e:
+        print(f"Load test failed: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    write_json(report, args.output)
+    print(format_summary(report))
+    print(f"Results written to {args.output}")
+
+def run_tune(args):
+    """Calibrate threads, batch size and context length on this host and save the best as its profile."""
+    from bench.autotune import AutoTuner, write_profile
+    from core.utils import total_memory_mb
+
+    def values(text, cast=int):
+        return [cast(v) for v in text.split(",")] if text else None
+
+    config = load_config()
+    cpus = os.cpu_count() or 1
+    grid = {
+        "threads": values(args.threads) or sorted({t for t in (1, 2, 4, 8, 16) if t < cpus} | {cpus}),
+        "batch_size": values(args.batch_size) or [8, 32, 128],
+        "context_length": values(args.context_length) or [config.get("context_length") or 2048]
+    }
+    memory_limit = args.memory_limit
+    if memory_limit is None and total_memory_mb():
+        memory_limit = total_memory_mb() * 0.75
+    overrides = {"max_tokens": args.max_tokens}
+    if args.fake:
+        overrides.update({"backend": "fake", "fake_token_delay": args.token_delay})
+
+    tuning = AutoTuner(grid, runs=args.runs, memory_limit_mb=memory_limit, config_overrides=overrides).run()
+    for result in tuning["results"]:
+        if "error" in result or "rejected" in result:
+            print(f"{result['settings']}: {result.get('error') or result['rejected']}")
+            continue
+        peak = result["peak_memory_mb"]
+        print(
+            f"{result['settings']}: load {result['load_time']:.2f}s | "
+            f"TTFT {result['ttft'] * 1000:.0f} ms | {result['tokens_per_second']:.1f} tokens/s | "
+            f"peak {f'{peak:.0f} MB' if peak is not None else 'n/a'}"
+        )
+
+    best = tuning["best"]
+    if best is None:
+        print("No configuration fit within the memory limit", file=sys.stderr)
+        sys.exit(1)
+    print(f"Best: {best['settings']}")
+    if not args.dry_run:
+        print(f"Profile written to {write_profile(tuning, args.output)}")
+
+def run_index(args):
+    """Build, query or describe the retrieval index of the local documents."""
+    from core.retrieval import docs_path, open_index
+
+    config = load_config()
+    if args.index:
+        config["retrieval_index_path"] = args.index
+    index = open_index(config)
+    try:
+        if args.action == "build":
+            report = index.build(args.docs or docs_path(config), workers=args.workers or config.get("retrieval_workers"),
+                                 rebuild=args.rebuild)
+            timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report["timings"].items())
+            print(f"{report['indexed']} files indexed, {report['unchanged']} unchanged, {report['removed']} removed "
+                  f"({report['workers']} worker{'s' if report['workers'] != 1 else ''})")
+            print(f"Timings: {timings}")
+            print(f"Index: {report['passages']} passages, {report['terms']} terms, {report['postings']} postings, "
+                  f"{report['bytes'] / 1024 / 1024:.1f} MB")
+        elif args.action == "query":
+            start = time.perf_counter()
+            passages = index.search(args.text, args.top_k or config.get("retrieval_top_k", 3))
+            elapsed = time.perf_counter() - start
+            for passage in passages:
+                print(f"[{passage['score']:.2f}] {passage['path']}:{passage['line']}\n    {passage['text']}")
+            print(f"{len(passages)} passages in {elapsed * 1000:.1f} ms")
+        else:
+            stats = index.stats()
+            if stats["built_at"] is None:
+                print("The index has not been built yet (python3 main.py index build)")
+                return
+            print(f"Documents: {stats['docs']}")
+            print(f"Built: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['built_at']))}")
+            print(f"{stats['files']} files, {stats['passages']} passages, {stats['terms']} terms, "
+                  f"{stats['postings']} postings, {stats['bytes'] / 1024 / 1024:.1f} MB on disk")
+    except Exception as e:
+        print(f"Index {args.action} failed: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        index.close()
+
+def run_repl(args):
+    """Chat in the terminal; only the chatbot core is imported, never Tkinter."""
+    from cli.repl import ChatREPL
+    from core.chatbot import TinyllamaChatbot
+
+    overrides = {"backend": "fake"} if args.fake else None
+    chatbot = TinyllamaChatbot(overrides)
+    if args.model:
+        chatbot.session_model = args.model
+    repl = ChatREPL(chatbot, start_time=START_TIME, temperature=args.temperature, max_tokens=args.max_tokens)
+    try:
+        code = repl.run()
+    finally:
+        chatbot.prompt_manager.close()
+    sys.exit(code)
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Tinyllama Chatbot (Offline)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve = subparsers.add_parser("serve", help="Run a headless OpenAI-compatible HTTP server")
+    serve.add_argument("--host", help="Address to bind (default: server_host or 127.0.0.1)")
+    serve.add_argument("--port", type=int, help="Port to bind (default: server_port or 8000)")
+    serve.add_argument("--queue-size", type=int, help="Maximum queued requests before returning 429")
+    serve.add_argument("--timeout", type=float, help="Per-request timeout in seconds")
+    serve.add_argument("--workers", type=int, help="Model worker processes (default: pool_workers or 1)")
+
+    batch = subparsers.add_parser("batch", help="Run a JSONL file of prompts and write results to a JSONL file")
+    batch.add_argument("input", help="Input JSONL file, one object per line with a prompt and optional temperature/max_tokens")
+    batch.add_argument("output", help="Output JSONL file (resumed if a checkpoint exists next to it)")
+    batch.add_argument("--prompt-field", default="prompt", help="Field holding the prompt text (default: prompt)")
+    batch.add_argument("--checkpoint-every", type=int, default=1, help="Checkpoint after this many lines (default: 1)")
+    batch.add_argument("--workers", type=int, help="Model worker processes (default: pool_workers or 1)")
+
+    bench = subparsers.add_parser("bench", help="Benchmark load time, TTFT, tokens/s and latency")
+    bench.add_argument("--threads", help="Comma-separated thread counts to sweep")
+    bench.add_argument("--batch-size", help="Comma-separated batch sizes to sweep")
+    bench.add_argument("--context-length", help="Comma-separated context lengths to sweep")
+    bench.add_argument("--max-tokens", help="Comma-separated max_tokens values to sweep")
+    bench.add_argument("--speculative", action="store_true", help="Compare greedy decoding with and without speculation")
+    bench.add_argument("--runs", type=int, default=3, help="Runs per prompt and configuration (default: 3)")
+    bench.add_argument("--output", default="bench_results.json", help="JSON results file")
+    bench.add_argument("--csv", help="Also write a CSV summary to this file")
+    bench.add_argument("--fake", action="store_true", help="Use the deterministic fake backend instead of the GGUF model")
+    bench.add_argument("--token-delay", type=float, default=0.01, help="Fake backend delay per generated token (s)")
+    bench.add_argument("--prompt-token-delay", type=float, default=0.0005, help="Fake backend delay per prompt token (s)")
+    bench.add_argument("--baseline", help="Previous JSON results; exit 1 if any p50 regresses beyond --tolerance")
+    bench.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression (default: 0.1)")
+
+    tune = subparsers.add_parser("tune", help="Find the fastest threads/batch size/context length for this host")
+    tune.add_argument("--threads", help="Comma-separated thread counts to try (default: powers of two up to the CPU count)")
+    tune.add_argument("--batch-size", help="Comma-separated batch sizes to try (default: 8,32,128)")
+    tune.add_argument("--context-length", help="Comma-separated context lengths to try (default: context_length)")
+    tune.add_argument("--max-tokens", type=int, default=32, help="Tokens generated per calibration run (default: 32)")
+    tune.add_argument("--runs", type=int, default=2, help="Timed runs per configuration (default: 2)")
+    tune.add_argument("--memory-limit", type=float, help="Reject configurations peaking above this many MB (default: 75%% of RAM)")
+    tune.add_argument("--output", help="Profile file (default: config/profiles/<host>.json)")
+    tune.add_argument("--dry-run", action="store_true", help="Print the results without writing a profile")
+    tune.add_argument("--fake", action="store_true", help="Use the deterministic fake backend instead of the GGUF model")
+    tune.add_argument("--token-delay", type=float, default=0.01, help="Fake backend delay per generated token (s)")
+
+    loadtest = subparsers.add_parser("loadtest", help="Replay a JSONL request trace under load and report percentiles")
+    loadtest.add_argument("trace", help="JSONL trace, one object per line with a prompt (or messages) and optional temperature/max_tokens/priority/user")
+    loadtest.add_argument("--url", help="Send to a running server (e.g. http://127.0.0.1:8000) instead of in-process")
+    loadtest.add_argument("--concurrency", type=int, default=1, help="Clients, or the most requests in flight with --rate (default: 1)")
+    loadtest.add_argument("--rate", type=float, help="Open loop: send this many requests per second regardless of replies")
+    loadtest.add_argument("--poisson", action="store_true", help="With --rate, use Poisson arrivals instead of even spacing")
+    loadtest.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which clients start or the rate climbs (default: 0)")
+    loadtest.add_argument("--requests", type=int, help="Requests to send, cycling through the trace (default: one per line)")
+    loadtest.add_argument("--prompt-field", default="prompt", help="Field holding the prompt text (default: prompt)")
+    loadtest.add_argument("--seed", type=int, help="Seed for Poisson arrivals")
+    loadtest.add_argument("--cache", action="store_true", help="Allow response cache hits (in-process)")
+    loadtest.add_argument("--workers", type=int, help="Model worker processes in-process (default: pool_workers or 1)")
+    loadtest.add_argument("--output", default="loadtest_results.json", help="JSON results file")
+    loadtest.add_argument("--fake", action="store_true", help="Use the deterministic fake backend instead of the GGUF model")
+    loadtest.add_argument("--token-delay", type=float, default=0.01, help="Fake backend delay per generated token (s)")
+    loadtest.add_argument("--prompt-token-delay", type=float, default=0.0005, help="Fake backend delay per prompt token (s)")
+
+    index = subparsers.add_parser("index", help="Build or query the retrieval index of the local documents")
+    index.add_argument("--index", help="Index folder (default: retrieval_index_path or data/index)")
+    actions = index.add_subparsers(dest="action", required=True)
+    build = actions.add_parser("build", help="Index new and changed files; unchanged files are skipped")
+    build.add_argument("docs", nargs="?", help="Folder of .txt/.md files (default: retrieval_docs_path or data/docs)")
+    build.add_argument("--workers", type=int, help="Processes parsing files (default: retrieval_workers or the CPU count)")
+    build.add_argument("--rebuild", action="store_true", help="Re-index every file")
+    query = actions.add_parser("query", help="Show the best passages for a question and how long the search took")
+    query.add_argument("text", help="Question or keywords")
+    query.add_argument("-k", "--top-k", type=int, help="Passages to show (default: retrieval_top_k or 3)")
+    actions.add_parser("stats", help="Show the size of the index and when it was built")
+
+    repl = subparsers.add_parser("repl", help="Chat in the terminal (reads messages from stdin when piped)")
+    repl.add_argument("--model", help="Model to chat with (default: model_path or the first in model/)")
+    repl.add_argument("--temperature", type=float, help="Sampling temperature (default: temperature)")
+    repl.add_argument("--max-tokens", type=int, help="Maximum tokens per reply (default: max_tokens)")
+    repl.add_argument("--fake", action="store_true", help="Use the deterministic fake backend instead of the GGUF model")
+
+    return parser.parse_args(argv)
+
+def main():
+    """Main entry point for the TinyllamaChatbot application."""
+    args = parse_args()
+
+    # Setup logging; in the terminal REPL log records would mix with the chat
+    setup_logging(console=args.command != "repl")
+
+    if args.command == "serve":
+        run_server(args)
+    elif args.command == "batch":
+        run_batch(args)
+    elif args.command == "bench":
+        run_benchmark(args)
+    elif args.command == "tune":
+        run_tune(args)
+    elif args.command == "loadtest":
+        run_loadtest(args)
+    elif args.command == "index":
+        run_index(args)
+    elif args.command == "repl":
+        run_repl(args)
+    else:
+        run_gui()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+TinyllamaChatbot - Headless OpenAI-compatible HTTP Server
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from core.metrics import metrics
+from core.scheduler import LANES, SchedulerFullError
+from core.utils import clean_text
+
+class GenerationJob:
+    """A queued completion request and the channel its output is streamed back on."""
+
+    def __init__(self, prompt: str, params: dict, loop: asyncio.AbstractEventLoop):
+        self.prompt = prompt
+        self.params = params
+        self.loop = loop
+        self.chunks: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+        self.enqueued_at = time.perf_counter()
+        # Filled in by the worker; complete once the final None has been handed back
+        self.stats: dict = {}
+
+    def put(self, item):
+        """Hand a chunk (or the final None / exception) back to the event loop."""
+        self.loop.call_soon_threadsafe(self.chunks.put_nowait, item)
+
+
+class ChatbotServer:
+    """Serves /v1/completions and /v1/chat/completions over a minimal asyncio HTTP front end.
+
+    Requests are placed on a bounded queue; when it is full new requests
+    are rejected with 429. A chatbot with a request scheduler gets a drain
+    thread per queue slot, and the queue holds as many requests as the
+    scheduler's lanes admit plus the one running (``queue_size`` standing
+    in for a lane without a limit). Every request therefore waits in the
+    scheduler, which runs them by ``priority``, takes turns between users
+    (the ``user`` field, or else the client's address) and answers 429
+    when a lane is full. A worker pool gets one thread per worker.
+    """
+
+    def __init__(self, chatbot, host: str = "127.0.0.1", port: int = 8000,
+                 queue_size: int = 8, request_timeout: float = 120.0):
+        self.chatbot = chatbot
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.request_timeout = request_timeout
+        self.logger = logging.getLogger(__name__)
+        self.model_status = "loading"
+        self.queue: Optional[asyncio.Queue] = None
+
+    def serve_forever(self):
+        """Load the model in the background and serve until interrupted."""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            self.logger.info("Server stopped")
+
+    async def _serve(self):
+        scheduler = getattr(self.chatbot, "scheduler", None)
+        if scheduler is not None:
+            # The scheduler picks the order and enforces the lane limits, so it has to see every request
+            capacity = sum(limit or self.queue_size for limit in scheduler.max_queued.values()) + 1
+            threads = capacity
+        else:
+            capacity = self.queue_size
+            threads = getattr(self.chatbot, "num_workers", 1)
+        self.queue = asyncio.Queue(maxsize=capacity)
+        loop = asyncio.get_running_loop()
+
+        threading.Thread(target=self._load_model, daemon=True).start()
+        for _ in range(threads):
+            threading.Thread(target=self._worker, args=(loop,), daemon=True).start()
+
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.logger.info(f"Serving on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def _load_model(self):
+        self.model_status = "ready" if self.chatbot.load_model() else "failed"
+        self.logger.info(f"Model status: {self.model_status}")
+
+    def _worker(self, loop: asyncio.AbstractEventLoop):
+        """Drain the request queue, running one generation at a time."""
+        while True:
+            job = asyncio.run_coroutine_threadsafe(self.queue.get(), loop).result()
+            metrics.observe("queue_wait_seconds", time.perf_counter() - job.enqueued_at)
+            if job.cancelled:
+                continue
+            params = dict(job.params)
+            if self.request_timeout:
+                # Let the generation itself stop at the deadline the client is held to
+                params["timeout"] = max(self.request_timeout - (time.perf_counter() - job.enqueued_at), 1e-3)
+            try:
+                for chunk in self.chatbot.stream_completion(job.prompt, job.stats, **params):
+                    if job.cancelled:
+                        break
+                    job.put(chunk)
+                job.put(None)
+            except SchedulerFullError as e:
+                job.put(e)
+            except Exception as e:
+                self.logger.error(f"Error generating response: {str(e)}")
+                job.put(e)
+
+    # HTTP handling
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            body = b""
+            if "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+
+            await self._route(method, path.split("?", 1)[0], body, writer)
+
+        except (ValueError, asyncio.IncompleteReadError):
+            await self._send_error(writer, 400, "Malformed request")
+        except ConnectionError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error handling request: {str(e)}")
+            await self._send_error(writer, 500, str(e))
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if method == "GET" and path in ("/health", "/v1/health"):
+            status = 200 if self.model_status == "ready" else 503
+            await self._send_json(writer, status, {
+                "status": self.model_status,
+                "ready": self.model_status == "ready",
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize
+            })
+        elif method == "GET" and path == "/v1/models":
+            models = await asyncio.get_running_loop().run_in_executor(None, self.chatbot.list_models)
+            await self._send_json(writer, 200, {
+                "object": "list",
+                "data": [{"id": model["name"], "object": "model", "owned_by": "local"} for model in models]
+            })
+        elif method == "GET" and path == "/metrics":
+            await self._send_text(writer, 200, metrics.prometheus(), "text/plain; version=0.0.4")
+        elif method == "GET" and path == "/v1/metrics":
+            snapshot = metrics.snapshot()
+            snapshot["queue_depth"] = self.queue.qsize()
+            if getattr(self.chatbot, "scheduler", None) is not None:
+                snapshot["scheduler"] = self.chatbot.scheduler.stats()
+            await self._send_json(writer, 200, snapshot)
+        elif method == "POST" and path in ("/v1/completions", "/v1/chat/completions"):
+            try:
+                payload = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                await self._send_error(writer, 400, "Request body is not valid JSON")
+                return
+            await self._handle_completion(path.endswith("chat/completions"), payload, writer)
+        else:
+            await self._send_error(writer, 404, f"No route for {method} {path}")
+
+    async def _handle_completion(self, chat: bool, payload: dict, writer: asyncio.StreamWriter):
+        if self.model_status != "ready":
+            await self._send_error(writer, 503, f"Model is not ready (status: {self.model_status})")
+            return
+
+        if chat:
+            messages = payload.get("messages")
+            if not isinstance(messages, list) or not messages:
+                await self._send_error(writer, 400, "'messages' must be a non-empty list")
+                return
+            # Formatted with the template of the model the request will run on
+            model = payload.get("model")
+            template = self.chatbot.registry.template(model if isinstance(model, str) and model in self.chatbot.registry else None)
+            prompt = self.chatbot.prompt_manager.format_messages(messages, template)
+        else:
+            prompt = payload.get("prompt")
+            if isinstance(prompt, list):
+                prompt = "".join(prompt)
+            if not isinstance(prompt, str) or not prompt:
+                await self._send_error(writer, 400, "'prompt' must be a non-empty string")
+                return
+
+        params = {}
+        if payload.get("temperature") is not None:
+            params["temperature"] = float(payload["temperature"])
+        if payload.get("max_tokens") is not None:
+            params["max_tokens"] = int(payload["max_tokens"])
+        if payload.get("stop") is not None:
+            stop = payload["stop"]
+            params["stop"] = [stop] if isinstance(stop, str) else list(stop)
+        # Names that aren't local models (e.g. "gpt-3.5-turbo") fall back to the current model
+        model = payload.get("model")
+        if isinstance(model, str) and model in self.chatbot.registry:
+            params["model"] = model
+        priority = payload.get("priority") or LANES[0]
+        if priority not in LANES:
+            await self._send_error(writer, 400, f"'priority' must be one of: {', '.join(LANES)}")
+            return
+        params["priority"] = priority
+        user = payload.get("user")
+        peer = writer.get_extra_info("peername")
+        params["session"] = user if isinstance(user, str) and user else (str(peer[0]) if peer else None)
+
+        job = GenerationJob(prompt, params, asyncio.get_running_loop())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.increment("server_rejected_total")
+            await self._send_error(writer, 429, "Server is busy, try again later")
+            return
+
+        request_id = f"{'chatcmpl' if chat else 'cmpl'}-{uuid.uuid4().hex[:24]}"
+        deadline = job.enqueued_at + self.request_timeout
+        try:
+            # Waited for before any response is sent, so a request the scheduler turns away still gets a 429
+            first = await self._next_chunk(job, deadline)
+            if payload.get("stream"):
+                await self._stream_response(job, chat, request_id, deadline, writer, first)
+            else:
+                text = []
+                chunk = first
+                while chunk is not None:
+                    text.append(chunk)
+                    chunk = await self._next_chunk(job, deadline)
+                await self._send_json(writer, 200, self._completion_body(chat, request_id, clean_text("".join(text)),
+                                                                      self._finish_reason(job), job.params.get("model")))
+        except SchedulerFullError as e:
+            metrics.increment("server_rejected_total")
+            await self._send_error(writer, 429, f"Server is busy, try again later ({str(e)})")
+        except asyncio.TimeoutError:
+            job.cancelled = True
+            metrics.increment("server_timeouts_total")
+            await self._send_error(writer, 504, f"Request timed out after {self.request_timeout:.0f}s")
+        except ConnectionError:
+            job.cancelled = True
+        except Exception as e:
+            job.cancelled = True
+            await self._send_error(writer, 500, str(e))
+
+    async def _next_chunk(self, job: GenerationJob, deadline: float) -> Optional[str]:
+        """Wait for the next chunk of a job, raising on worker errors and timeouts."""
+        chunk = await asyncio.wait_for(job.chunks.get(), max(deadline - time.perf_counter(), 0))
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    async def _stream_response(self, job: GenerationJob, chat: bool, request_id: str,
+                               deadline: float, writer: asyncio.StreamWriter, first: Optional[str]):
+        """Send ``first`` and the chunks after it as server-sent events as the worker produces them."""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        try:
+            chunk = first
+            while True:
+                finish_reason = self._finish_reason(job) if chunk is None else None
+                event = self._chunk_body(chat, request_id, chunk or "", finish_reason, job.params.get("model"))
+                writer.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                await writer.drain()
+                if chunk is None:
+                    break
+                chunk = await self._next_chunk(job, deadline)
+        except asyncio.TimeoutError:
+            job.cancelled = True
+            metrics.increment("server_timeouts_total")
+            error = {"error": {"message": "Request timed out", "type": "timeout"}}
+            writer.write(f"data: {json.dumps(error)}\n\n".encode("utf-8"))
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The 200 is already sent, so the error goes out as the stream's last event
+            job.cancelled = True
+            error = {"error": {"message": str(e), "type": "server_error"}}
+            writer.write(f"data: {json.dumps(error)}\n\n".encode("utf-8"))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+
+    def _finish_reason(self, job: GenerationJob) -> str:
+        """The OpenAI finish reason for a finished job: "length" if it ran out of tokens, else "stop"."""
+        return "length" if job.stats.get("finish_reason") in ("length", "budget") else "stop"
+
+    def _completion_body(self, chat: bool, request_id: str, text: str, finish_reason: str = "stop",
+                         model: Optional[str] = None) -> dict:
+        if chat:
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+        return {
+            "id": request_id,
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": model or self.chatbot.config.get("model_type"),
+            "choices": [choice]
+        }
+
+    def _chunk_body(self, chat: bool, request_id: str, text: str, finish_reason: Optional[str],
+                    model: Optional[str] = None) -> dict:
+        if chat:
+            choice = {"index": 0, "delta": {"content": text} if text else {}, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+        return {
+            "id": request_id,
+            "object": "chat.completion.chunk" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": model or self.chatbot.config.get("model_type"),
+            "choices": [choice]
+        }
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, body: dict):
+        await self._send_text(writer, status, json.dumps(body), "application/json")
+
+    async def _send_text(self, writer: asyncio.StreamWriter, status: int, text: str, content_type: str):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+                   500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+        data = text.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {reasons.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, status: int, message: str):
+        try:
+            await self._send_json(writer, status, {"error": {"message": message, "code": status}})
+        except ConnectionError:
+            pass